@@ -0,0 +1,85 @@
+"""
+Cold start benchmark of the serverless handler, each run is a new python
+process invoking the synthetic events of `src.account.handler` on the in
+memory dynamodb.
+
+    python -m benchmarks.cold_start --runs 10 [--output cold-start.json]
+
+Reports the percentiles of the whole process duration (interpreter start
+included), of each cold start phase (import, init and the first request)
+and of the warm invocations.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.endpoints import percentile
+
+
+def run_once(repeat: int):
+    env = {
+        **os.environ,
+        "DYNAMODB_BACKEND": "memory",
+        "FLASK_ENV": "development",
+    }
+    started_at = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-m", "src.account.handler", f"--repeat={repeat}"],
+        capture_output=True,
+        check=True,
+        env=env,
+        text=True,
+    ).stdout
+    result = json.loads(output)
+    result["process"] = time.perf_counter() - started_at
+    return result
+
+
+def summarize(runs: list):
+    series = {"process": [run["process"] for run in runs]}
+    for run in runs:
+        for phase, seconds in run["cold_start"].items():
+            series.setdefault(phase, []).append(seconds)
+    series["warm"] = [
+        invocation["seconds"]
+        for run in runs
+        for invocation in run["invocations"]
+    ]
+    return {
+        name: {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1e3,
+            "p95_ms": percentile(values, 95) * 1e3,
+            "p99_ms": percentile(values, 99) * 1e3,
+        }
+        for name, values in series.items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="times the events are invoked by each process",
+    )
+    parser.add_argument("--output", help="json file, stdout when not given")
+    args = parser.parse_args(argv)
+
+    results = summarize([run_once(args.repeat) for _ in range(args.runs)])
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Endpoint benchmark, replays requests through the flask test client with the
+in memory dynamodb, so only the application code is measured.
+
+    python -m benchmarks.endpoints --mix mixed --requests 2000 \
+        --output bench.json [--traffic traffic.jsonl] [--compare base.json]
+
+The traffic file has one request per line, `{account_id}` in the path is
+replaced by one of the seeded accounts:
+
+    {"method": "POST", "path": "/v1/account/{account_id}/deposit",
+     "json": {"valor": 10}}
+    {"method": "GET", "path": "/v1/account/{account_id}/transactions",
+     "query": {"page-size": 10}}
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Optional
+
+from src.account import wsgi
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import registry
+
+ACCOUNT_PLACEHOLDER = "{account_id}"
+
+
+@dataclass
+class BenchRequest:
+    method: str
+    path: str
+    json: Optional[dict] = None
+    query: Optional[dict] = None
+
+
+@dataclass
+class EndpointStats:
+    durations_ns: list = field(default_factory=list)
+    dynamo_calls: int = 0
+    alloc_peak_bytes: list = field(default_factory=list)
+    status: dict = field(default_factory=dict)
+
+
+mixes = {
+    "deposit": {"deposit": 1},
+    "withdraw": {"withdraw": 1},
+    "balance": {"balance": 1},
+    "transactions": {"transactions": 1},
+    "mixed": {"deposit": 3, "withdraw": 2, "balance": 3, "transactions": 2},
+}
+
+
+def synthetic_request(kind: str, rng: random.Random):
+    path = f"/v1/account/{ACCOUNT_PLACEHOLDER}"
+    if kind == "deposit":
+        value = rng.randint(1, 500)
+        return BenchRequest("POST", f"{path}/deposit", json={"valor": value})
+    if kind == "withdraw":
+        value = rng.randint(1, 50)
+        return BenchRequest("POST", f"{path}/withdraw", json={"valor": value})
+    if kind == "balance":
+        return BenchRequest("GET", f"{path}/balance")
+    if kind == "transactions":
+        return BenchRequest(
+            "GET", f"{path}/transactions", query={"page-size": 25}
+        )
+    raise ValueError(f"unknown request kind {kind}")
+
+
+def synthetic_traffic(mix: str, count: int, seed: int):
+    rng = random.Random(seed)
+    kinds, weights = zip(*mixes[mix].items())
+    return [
+        synthetic_request(kind, rng)
+        for kind in rng.choices(kinds, weights, k=count)
+    ]
+
+
+def load_traffic(path: str):
+    """Requests of a jsonl file, lines that are not a request are skipped"""
+    requests, skipped = [], 0
+    with open(path) as traffic_file:
+        for line in traffic_file:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                requests.append(
+                    BenchRequest(
+                        entry["method"].upper(),
+                        entry["path"],
+                        json=entry.get("json"),
+                        query=entry.get("query"),
+                    )
+                )
+            except (ValueError, KeyError, AttributeError, TypeError):
+                skipped += 1
+    return requests, skipped
+
+
+def percentile(values: list, percent: float):
+    """Nearest rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def dynamo_calls():
+    return sum(memory.shared_resource().calls.values())
+
+
+class Bench:
+    def __init__(self, accounts: int = 20, seed: int = 42):
+        registry.clear()
+        memory.shared_resource().reset()
+        self.app = wsgi.create_app()
+        self.app.config["TESTING"] = True
+        self.client = self.app.test_client()
+        self.adapter = self.app.url_map.bind("localhost")
+        self.rng = random.Random(seed)
+        self.account_ids = [self.create_account() for _ in range(accounts)]
+
+    def create_account(self):
+        response = self.client.post(
+            "/v1/account",
+            json={
+                "saldo": 1_000_000,
+                "flagAtivo": True,
+                "limiteSaqueDiario": 1_000_000,
+                "tipoConta": 1,
+                "idPessoa": "benchmark",
+            },
+        )
+        return response.headers["Content-Location"].rsplit("/", 1)[-1]
+
+    def endpoint_name(self, bench_request: BenchRequest, path: str):
+        try:
+            endpoint, _ = self.adapter.match(path, bench_request.method)
+        except Exception:
+            endpoint = "unmatched"
+        return f"{bench_request.method} {endpoint}"
+
+    def send(self, bench_request: BenchRequest):
+        path = bench_request.path.replace(
+            ACCOUNT_PLACEHOLDER, self.rng.choice(self.account_ids)
+        )
+        response = self.client.open(
+            path,
+            method=bench_request.method,
+            json=bench_request.json,
+            query_string=bench_request.query,
+        )
+        # streamed responses are only produced when consumed
+        response.get_data()
+        return path, response.status_code
+
+    def run(self, requests: list, warmup: int = 50, trace_every: int = 10):
+        warmup_requests = itertools.islice(itertools.cycle(requests), warmup)
+        for bench_request in warmup_requests:
+            self.send(bench_request)
+
+        stats = {}
+        started = time.perf_counter_ns()
+        for bench_request in requests:
+            calls = dynamo_calls()
+            begin = time.perf_counter_ns()
+            path, status = self.send(bench_request)
+            elapsed = time.perf_counter_ns() - begin
+            endpoint = stats.setdefault(
+                self.endpoint_name(bench_request, path), EndpointStats()
+            )
+            endpoint.durations_ns.append(elapsed)
+            endpoint.dynamo_calls += dynamo_calls() - calls
+            endpoint.status[status] = endpoint.status.get(status, 0) + 1
+        wall_ns = time.perf_counter_ns() - started
+
+        # tracing slows every allocation down, so it has its own pass over a
+        # sample of the requests
+        tracemalloc.start()
+        try:
+            for bench_request in requests[::trace_every]:
+                tracemalloc.reset_peak()
+                current, _ = tracemalloc.get_traced_memory()
+                path, _ = self.send(bench_request)
+                _, peak = tracemalloc.get_traced_memory()
+                name = self.endpoint_name(bench_request, path)
+                stats[name].alloc_peak_bytes.append(peak - current)
+        finally:
+            tracemalloc.stop()
+        return stats, wall_ns
+
+
+def summarize(stats: dict, wall_ns: int):
+    def summary(durations, calls, allocations, status):
+        count = len(durations)
+        total_ns = sum(durations)
+        return {
+            "count": count,
+            "p50_ms": percentile(durations, 50) / 1e6,
+            "p95_ms": percentile(durations, 95) / 1e6,
+            "p99_ms": percentile(durations, 99) / 1e6,
+            "mean_ms": total_ns / count / 1e6,
+            "throughput_rps": count / (total_ns / 1e9) if total_ns else None,
+            "dynamo_calls_per_request": calls / count,
+            "alloc_peak_kib_per_request": (
+                sum(allocations) / len(allocations) / 1024
+                if allocations
+                else None
+            ),
+            "status": {str(code): n for code, n in sorted(status.items())},
+        }
+
+    endpoints = {
+        name: summary(
+            s.durations_ns, s.dynamo_calls, s.alloc_peak_bytes, s.status
+        )
+        for name, s in sorted(stats.items())
+    }
+    all_status = {}
+    for s in stats.values():
+        for code, n in s.status.items():
+            all_status[code] = all_status.get(code, 0) + n
+    total = summary(
+        [d for s in stats.values() for d in s.durations_ns],
+        sum(s.dynamo_calls for s in stats.values()),
+        [a for s in stats.values() for a in s.alloc_peak_bytes],
+        all_status,
+    )
+    # the wall clock includes the client overhead between requests
+    total["throughput_rps"] = total["count"] / (wall_ns / 1e9)
+    return {"endpoints": endpoints, "total": total}
+
+
+def compare(current: dict, baseline: dict, max_regression: float):
+    """Lines describing the p95 changes and if any got too slow"""
+    lines, regressed = [], False
+    for name, result in current["endpoints"].items():
+        base = baseline["endpoints"].get(name)
+        if not base:
+            continue
+        change = result["p95_ms"] / base["p95_ms"] - 1
+        marker = ""
+        if change > max_regression:
+            regressed, marker = True, "  REGRESSION"
+        lines.append(
+            f"{name}: p95 {base['p95_ms']:.3f}ms -> "
+            f"{result['p95_ms']:.3f}ms ({change:+.1%}){marker}"
+        )
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--traffic", help="jsonl file with requests to replay")
+    parser.add_argument("--mix", choices=sorted(mixes), default="mixed")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="file to write the json results")
+    parser.add_argument("--compare", help="json results of a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    # the backend is chosen when the resources are created by the registry
+    os.environ.setdefault("DYNAMODB_BACKEND", "memory")
+    os.environ.setdefault("FLASK_ENV", "development")
+    os.environ.setdefault("CURSOR_SECRET", "benchmark")
+    os.environ.setdefault("HEALTH_CHECK_INTERVAL", "0")
+
+    skipped = 0
+    if args.traffic:
+        requests, skipped = load_traffic(args.traffic)
+        if not requests:
+            parser.error(f"no request found in {args.traffic}")
+    else:
+        requests = synthetic_traffic(args.mix, args.requests, args.seed)
+
+    bench = Bench(accounts=args.accounts, seed=args.seed)
+    stats, wall_ns = bench.run(requests, warmup=args.warmup)
+    results = {
+        "meta": {
+            "traffic": args.traffic or f"synthetic:{args.mix}",
+            "skipped_lines": skipped,
+            "requests": len(requests),
+            "accounts": args.accounts,
+            "python": platform.python_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        **summarize(stats, wall_ns),
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            lines, regressed = compare(
+                results, json.load(baseline_file), args.max_regression
+            )
+        print("\n".join(lines), file=sys.stderr)
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
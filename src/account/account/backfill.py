@@ -0,0 +1,128 @@
+"""
+Bulk insert of historical transactions. The input is NDJSON, one
+transaction per line in the `BackfillTransactionSchema` format:
+
+    {"idConta": "...", "valor": -10.5, "dataTransacao": "2021-06-13T20:14"}
+
+The balances are not touched, only the ledger and the account versions (the
+listings etags). Rows without `idTransacao` get a new id, so send the ids to
+be able to run the same file again.
+
+    python -m src.account.account.backfill transactions.ndjson --workers 8
+"""
+import argparse
+import datetime as dt
+import json
+import sys
+import time
+from dataclasses import dataclass
+from typing import Iterable
+
+import marshmallow as ma
+
+from src.account.account import models
+from src.account.account import serializers as ser
+from src.account.core.aws.dynamodb import DynamoResource
+from src.account.core.iterators import chunked
+from src.account.core.jobs import JobReport, run_in_workers
+
+
+@dataclass
+class BackfillReport(JobReport):
+    rows: int = 0
+    written: int = 0
+
+    job = "Backfill"
+
+    @property
+    def rows_per_second(self):
+        return self.written / self.seconds if self.seconds else 0.0
+
+
+def parse(lines: Iterable, report: BackfillReport):
+    """Transaction items of the valid lines, the invalid go to the report"""
+    schema = ser.BackfillTransactionSchema()
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        report.rows += 1
+        try:
+            data = schema.loads(line)
+        except ma.ValidationError as error:
+            report.add_error({"linha": line_number, "erro": error.messages})
+            continue
+        except ValueError:
+            report.add_error({"linha": line_number, "erro": "Invalid json"})
+            continue
+        yield models.Transaction.new_item(
+            data["account_id"],
+            data["value"],
+            data["created_at"].astimezone(dt.timezone.utc),
+            data.get("id"),
+        )
+
+
+def backfill(lines: Iterable, workers: int = 4):
+    """
+    Writes the transactions in batches of 25 items with `workers` threads.
+    At most two batches per worker are kept in memory
+    """
+    report = BackfillReport()
+    started_at = time.perf_counter()
+    accounts = set()
+
+    def written(chunk: list, _):
+        report.written += len(chunk)
+        accounts.update(item[models.Transaction.hash_key] for item in chunk)
+
+    def write_error(chunk: list, error: Exception):
+        report.add_error(
+            {
+                # the ids of the file, when they were replaced
+                "transacoes": [
+                    item.get("legacy_id", item[models.Transaction.sort_key])
+                    for item in chunk
+                ],
+                "erro": repr(error),
+            }
+        )
+
+    def touch_error(account_id: str, error: Exception):
+        report.add_error({"conta": account_id, "erro": repr(error)})
+
+    run_in_workers(
+        models.Transaction.add_batch,
+        chunked(parse(lines, report), DynamoResource.batch_write_limit),
+        workers,
+        write_error,
+        written,
+    )
+    # the listings of the accounts changed, their etags must too
+    run_in_workers(models.Account.touch, accounts, workers, touch_error)
+
+    report.seconds = time.perf_counter() - started_at
+    return report
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "file", help="NDJSON file with the transactions, - for stdin"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    if args.file == "-":
+        report = backfill(sys.stdin, args.workers)
+    else:
+        with open(args.file, "rb") as lines:
+            report = backfill(lines, args.workers)
+    print(json.dumps(ser.BackfillReportSchema().dump(report), indent=2))
+    return 1 if report.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Folds the balance shards of the sharded accounts back into the account
+items (see `models.BalanceShard`), so their balances are mostly in one
+item and the withdraws rarely need to fold them. Meant to run every few
+minutes:
+
+    python -m src.account.account.compaction [--account ID ...]
+
+Without `--account` the accounts in `SHARDED_ACCOUNTS` are folded. Run it
+for an account after removing it from `SHARDED_ACCOUNTS`, its shards are
+not read anymore.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from typing import Iterable
+
+from src.account.account import models
+
+
+def compact(accounts: Iterable[str]):
+    report = {"contas": 0, "compactadas": 0, "erros": []}
+    for account_id in accounts:
+        report["contas"] += 1
+        try:
+            if models.BalanceShard.fold(account_id):
+                report["compactadas"] += 1
+        except Exception as error:
+            logging.error(f"Compaction error on {account_id}: {error!r}")
+            report["erros"].append({"conta": account_id, "erro": repr(error)})
+    return report
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--account", action="append", help="account to fold the shards"
+    )
+    args = parser.parse_args(argv)
+
+    accounts = args.account or [
+        account_id.strip()
+        for account_id in os.environ.get("SHARDED_ACCOUNTS", "").split(",")
+        if account_id.strip()
+    ]
+    report = compact(accounts)
+    print(json.dumps(report, indent=2))
+    return 1 if report["erros"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
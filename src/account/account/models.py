@@ -1,25 +1,76 @@
+import atexit
 import datetime as dt
 import decimal as d
+import functools
+import hashlib
+import logging
+import random
 import uuid
 from dataclasses import dataclass
 from http import HTTPStatus
-from typing import Optional
+from typing import Iterable, Optional
 
 import botocore.exceptions
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
 from flask import abort, jsonify, make_response
 
+from src.account.core import concurrency, ulid
+from src.account.core.aws import retry
 from src.account.core.aws.dynamodb import DynamoResource
+from src.account.core.cache import TTLCache
+from src.account.core.journal import Journal
+from src.account.core.singleflight import SingleFlight
 
 date_format = "%Y-%m-%d"
 
 
+class DuplicateRequest(Exception):
+    """The idempotency key was already used, `record` has the first
+    result"""
+
+    def __init__(self, record: dict):
+        super().__init__(f"idempotency key {record.get('key')} already used")
+        self.record = record
+
+
+class ReadConflict(retry.DatabaseUnavailable):
+    """The account kept changing while it was read with its transactions,
+    the request can be retried"""
+
+
 class Account:
     table_name = "account"
 
     SUM = "+"
     SUB = "-"
 
+    # account items read without consistency, invalidated on every write
+    # made by this process
+    cache = TTLCache()
+    # concurrent reads of the same account share the dynamodb call
+    reads = SingleFlight("account")
+
+    # every write to the account increases the version, used by the etags.
+    # The items created before the version existed start from 0
+    version_update = (
+        "#version = if_not_exists(#version, :zero) + :version_step, "
+        "#updated_at = :updated_at"
+    )
+    version_names = {"#version": "version", "#updated_at": "updated_at"}
+
+    # the accounts whose transactions all have time ordered ids (the new
+    # ones and the ones migrated by `transaction_ids`), their transactions
+    # are read by date from the base table
+    ordered_ids_attribute = "ordered_transaction_ids"
+
+    # ids of the transactions written behind (see `Transaction.journal`)
+    # not flushed yet, kept in the item the balance operation updated
+    pending_attribute = "journal_pending"
+    # ids of the transactions written behind whose record was lost (moved to
+    # the dead letter file or never journaled), the balance has them but
+    # the ledger doesn't. The reconcile job takes out the ones written later
+    missing_attribute = "missing_transactions"
+
     @classmethod
     def add(
         cls,
@@ -38,43 +89,375 @@ class Account:
             "daily_withdraw_limit": daily_withdraw_limit,
             "active": active,
             "account_type": account_type,
+            "version": 1,
+            cls.ordered_ids_attribute: True,
         }
         DynamoResource().add(cls.table_name, payload)
         return payload["id"]
 
     @classmethod
-    def find_one_by_id(cls, account_id: str):
-        return DynamoResource().find_one_by_id(
-            cls.table_name, {"hash_key": "id", "hash_value": account_id}
+    def find_one_by_id(cls, account_id: str, consistent_read: bool = False):
+        """
+        With `consistent_read` the cache is skipped and the read is never
+        shared (a read started before may miss a write made by another
+        process), use it when the balance must be the current one
+        """
+        token = cls.cache.token()
+        if consistent_read:
+            account = cls._read(account_id, True)
+        else:
+            account = cls.cache.get(account_id)
+            if account is not None:
+                return account
+            account = cls.reads.do(
+                account_id, cls._read, account_id, consistent_read
+            )
+        if account:
+            cls.cache.set(account_id, account, token)
+        return account
+
+    @classmethod
+    def find_many(cls, account_ids: list, consistent_read: bool = False):
+        """
+        Accounts by id, the ones not found are left out. A single
+        BatchGetItem per 100 ids (the ids must not repeat), the cache is not
+        used
+        """
+        items = DynamoResource().batch_get_item(
+            cls.table_name,
+            [{"id": account_id} for account_id in account_ids],
+            consistent_read=consistent_read,
         )
+        accounts = {}
+        for account in items:
+            if BalanceShard.enabled(account["id"]):
+                account = BalanceShard.merge(
+                    account,
+                    BalanceShard.find_all(account["id"], consistent_read),
+                )
+            accounts[account["id"]] = account
+        return accounts
 
     @classmethod
-    def _balance_operation(
-        cls, account_id: str, value: d.Decimal, operator: str = "+"
-    ):
+    def _read(cls, account_id: str, consistent_read: bool):
+        account = DynamoResource().get_item(
+            cls.table_name, {"id": account_id}, consistent_read=consistent_read
+        )
+        if account and BalanceShard.enabled(account_id):
+            account = BalanceShard.merge(
+                account, BalanceShard.find_all(account_id, consistent_read)
+            )
+        return account
+
+    @classmethod
+    def find_version(cls, account_id: str):
+        """Current version of the account, reading only the version. None
+        when the account doesn't exist"""
+        item = DynamoResource().get_item(
+            cls.table_name,
+            {"id": account_id},
+            projection=["id", "version"],
+            consistent_read=True,
+        )
+        if not item:
+            return None
+        version = item.get("version", 0)
+        if BalanceShard.enabled(account_id):
+            shards = BalanceShard.find_all(
+                account_id, True, projection=["version"]
+            )
+            version += sum(shard.get("version", 0) for shard in shards)
+        return int(version)
+
+    @classmethod
+    def ordered_ids(cls, account_id: str):
+        """If the account transactions have time ordered ids, reading the
+        cached account (the flag is never removed)"""
+        account = cls.find_one_by_id(account_id)
+        return bool(account and account.get(cls.ordered_ids_attribute))
+
+    @classmethod
+    def mark_ordered_ids(cls, account_id: str):
+        """Flags the account after its transactions ids were migrated, with
+        a new version (the ids listed changed)"""
         dynamodb_resource = DynamoResource()
-        withdraw_operation = operator == "-"
-        expression_attr_values = {":balance": value, ":blocked": False}
-        condition_expression = "#blocked = :blocked"
-        if withdraw_operation:
-            condition_expression = (condition_expression +
-                                    " And #balance > :balance")
         try:
             dynamodb_resource.table_resource(cls.table_name).update_item(
                 Key={"id": account_id},
-                UpdateExpression=("SET #balance = #balance "
-                                  f"{operator} :balance"),
+                UpdateExpression=(
+                    f"SET #ordered = :ordered, {cls.version_update}"
+                ),
+                ConditionExpression="attribute_exists(#id)",
                 ExpressionAttributeNames={
-                    "#balance": "balance",
-                    "#blocked": "blocked",
+                    "#id": "id",
+                    "#ordered": cls.ordered_ids_attribute,
+                    **cls.version_names,
+                },
+                ExpressionAttributeValues={
+                    ":ordered": True,
+                    **cls.version_values(),
                 },
-                ExpressionAttributeValues=expression_attr_values,
-                ConditionExpression=condition_expression,
             )
-            return dt.datetime.now(dt.timezone.utc)
+        except botocore.exceptions.ClientError as error:
+            dynamodb_resource.handle_error(error)
+        finally:
+            cls.invalidate(account_id)
+
+    @classmethod
+    def version_values(cls):
+        return {
+            ":zero": 0,
+            ":version_step": 1,
+            ":updated_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+        }
+
+    @classmethod
+    def touch(cls, account_id: str):
+        """New version of the account, when something read with it changed
+        without a balance operation (the backfilled transactions)"""
+        dynamodb_resource = DynamoResource()
+        try:
+            dynamodb_resource.table_resource(cls.table_name).update_item(
+                Key={"id": account_id},
+                UpdateExpression=f"SET {cls.version_update}",
+                ConditionExpression="attribute_exists(#id)",
+                ExpressionAttributeNames={"#id": "id", **cls.version_names},
+                ExpressionAttributeValues=cls.version_values(),
+            )
         except botocore.exceptions.ClientError as error:
             error_code = error.response["Error"]["Code"]
-            if error_code == "ConditionalCheckFailedException":
+            if error_code != "ConditionalCheckFailedException":
+                dynamodb_resource.handle_error(error)
+        finally:
+            cls.invalidate(account_id)
+
+    @classmethod
+    def add_pending(cls, update: dict, transaction_id: str):
+        """Balance update (of the account or of a shard) also adding the
+        transaction written behind to the pending ones of the item"""
+        update["UpdateExpression"] += " ADD #pending :pending"
+        update["ExpressionAttributeNames"]["#pending"] = cls.pending_attribute
+        update["ExpressionAttributeValues"][":pending"] = {transaction_id}
+        return update
+
+    @classmethod
+    def clear_pending(
+        cls,
+        account_id: str,
+        table_name: str,
+        key: dict,
+        transaction_ids,
+        missing: bool = False,
+    ):
+        """
+        Takes the flushed transactions out of the pending ones of the item,
+        with a new version so the etags given while they were pending don't
+        match anymore. With `missing` their records were lost and they are
+        flagged in the item. Nothing happens when they were already taken
+        out
+        """
+        update = f"DELETE #pending :pending SET {cls.version_update}"
+        names = {"#pending": cls.pending_attribute, **cls.version_names}
+        if missing:
+            update += " ADD #missing :pending"
+            names["#missing"] = cls.missing_attribute
+        dynamodb_resource = DynamoResource()
+        try:
+            dynamodb_resource.table_resource(table_name).update_item(
+                Key=key,
+                UpdateExpression=update,
+                ConditionExpression="attribute_exists(#pending)",
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues={
+                    ":pending": set(transaction_ids),
+                    **cls.version_values(),
+                },
+            )
+        except botocore.exceptions.ClientError as error:
+            error_code = error.response["Error"]["Code"]
+            if error_code != "ConditionalCheckFailedException":
+                dynamodb_resource.handle_error(error)
+        finally:
+            cls.invalidate(account_id)
+        if missing:
+            logging.error(
+                f"Transactions of the account {account_id} missing from the "
+                f"ledger: {sorted(transaction_ids)}"
+            )
+
+    @classmethod
+    def clear_missing(
+        cls, account_id: str, table_name: str, key: dict, transaction_ids
+    ):
+        """Takes the transactions found in the ledger out of the missing
+        ones of the item"""
+        dynamodb_resource = DynamoResource()
+        try:
+            dynamodb_resource.table_resource(table_name).update_item(
+                Key=key,
+                UpdateExpression="DELETE #missing :missing",
+                ExpressionAttributeNames={"#missing": cls.missing_attribute},
+                ExpressionAttributeValues={":missing": set(transaction_ids)},
+            )
+        except botocore.exceptions.ClientError as error:
+            dynamodb_resource.handle_error(error)
+        finally:
+            cls.invalidate(account_id)
+
+    @classmethod
+    def pending_before(
+        cls, account: dict, moment: Optional[dt.datetime] = None
+    ):
+        """Whether transactions made before `moment` (at any time without
+        it) are still in a journal, missing from the transaction table"""
+        pending = account.get(cls.pending_attribute) or ()
+        if moment is None:
+            return bool(pending)
+        limit = ulid.millisecond(moment)
+        return any(ulid.millisecond_of(i) < limit for i in pending)
+
+    @classmethod
+    def invalidate(cls, account_id: str):
+        """After a write the reads in flight and the cache may have the old
+        item"""
+        cls.reads.forget(account_id)
+        cls.cache.invalidate(account_id)
+
+    @classmethod
+    def _balance_update(
+        cls, account_id: str, value: d.Decimal, operator: str = "+"
+    ):
+        condition_expression = "#blocked = :blocked"
+        if operator == cls.SUB:
+            condition_expression = (condition_expression +
+                                    " And #balance > :balance")
+        return {
+            "TableName": cls.table_name,
+            "Key": {"id": account_id},
+            "UpdateExpression": (
+                f"SET #balance = #balance {operator} :balance, "
+                f"{cls.version_update}"
+            ),
+            "ExpressionAttributeNames": {
+                "#balance": "balance",
+                "#blocked": "blocked",
+                **cls.version_names,
+            },
+            "ExpressionAttributeValues": {
+                ":balance": value,
+                ":blocked": False,
+                **cls.version_values(),
+            },
+            "ConditionExpression": condition_expression,
+        }
+
+    @classmethod
+    def _balance_operation(
+        cls,
+        account_id: str,
+        value: d.Decimal,
+        operator: str = "+",
+        daily_withdraw_limit: Optional[d.Decimal] = None,
+        idempotency: Optional[dict] = None,
+        prepare_shards: bool = True,
+    ):
+        """
+        Updates the balance, the daily withdrawn total (on withdraws) and
+        inserts the transaction record in a single atomic dynamodb
+        transaction. Returns the new transaction id.
+
+        With `idempotency` (see `Idempotency.new_item`) the result is saved
+        in the same transaction, if the key was already used nothing is
+        written and `DuplicateRequest` is raised with the saved result.
+
+        The deposits into sharded accounts (see `BalanceShard`) update one
+        of the shards, the withdraws fold the shards into the account when
+        it doesn't have the balance alone
+        """
+        dynamodb_resource = DynamoResource()
+        withdraw_operation = operator == cls.SUB
+        sharded = BalanceShard.enabled(account_id)
+        operation_date = dt.datetime.now(dt.timezone.utc)
+        transaction = Transaction.new_item(
+            account_id, -value if withdraw_operation else value, operation_date
+        )
+        if sharded and not withdraw_operation:
+            update = BalanceShard.deposit_update(account_id, value)
+        else:
+            update = cls._balance_update(account_id, value, operator)
+        items = [{"Update": update}]
+        if withdraw_operation:
+            items.append(
+                {
+                    "Update": DailyWithdraw.total_update(
+                        account_id, value, operation_date, daily_withdraw_limit
+                    )
+                }
+            )
+        journal = Transaction.journal
+        if journal is None:
+            items.append({"Put": Transaction.put_item(transaction)})
+        else:
+            # pending in the updated item until the journal flushes it
+            cls.add_pending(update, transaction[Transaction.sort_key])
+        if idempotency:
+            idempotency = Idempotency.with_result(
+                idempotency, account_id, transaction[Transaction.sort_key]
+            )
+            items.append({"Put": Idempotency.put_item(idempotency)})
+
+        def written():
+            cls.invalidate(account_id)
+            if withdraw_operation:
+                DailyWithdraw.forget(account_id, operation_date)
+
+        try:
+            dynamodb_resource.transact_write_items(items)
+            written()
+            if journal is not None:
+                Transaction.write_behind(
+                    journal, transaction, update["TableName"], update["Key"]
+                )
+            return transaction[Transaction.sort_key]
+        except botocore.exceptions.ClientError as error:
+            written()
+            error_code = error.response["Error"]["Code"]
+            reasons = retry.cancellation_reasons(error)
+            if (
+                idempotency
+                and error_code == "TransactionCanceledException"
+                and reasons[-1:] == ["ConditionalCheckFailed"]
+            ):
+                # checked first, a replay may also fail the other conditions
+                raise DuplicateRequest(
+                    Idempotency.cancelled_record(error, idempotency["key"])
+                )
+            if (
+                sharded
+                and prepare_shards
+                and error_code == "TransactionCanceledException"
+                and reasons[:1] == ["ConditionalCheckFailed"]
+            ):
+                # the shard may not exist yet, or the account item alone
+                # may not have the balance to withdraw
+                prepared = (
+                    BalanceShard.fold(account_id)
+                    if withdraw_operation
+                    else BalanceShard.create(account_id)
+                )
+                if prepared:
+                    return cls._balance_operation(
+                        account_id,
+                        value,
+                        operator,
+                        daily_withdraw_limit,
+                        idempotency,
+                        prepare_shards=False,
+                    )
+            if (
+                error_code == "TransactionCanceledException"
+                and reasons[:1] == ["ConditionalCheckFailed"]
+            ):
                 error_msg = "Account got blocked before the deposit execution"
                 error_msg += (
                     " or the withdraw was more than the balance available"
@@ -87,24 +470,62 @@ class Account:
                         HTTPStatus.FORBIDDEN,
                     )
                 )
+            if (
+                error_code == "TransactionCanceledException"
+                and withdraw_operation
+                and reasons[1:2] == ["ConditionalCheckFailed"]
+            ):
+                withdrawn = DailyWithdraw.find_total(
+                    account_id,
+                    operation_date.strftime(date_format),
+                    consistent_read=True,
+                )
+                available = max(daily_withdraw_limit - withdrawn, 0)
+                error_msg = (
+                    "It is not possible to carry out the withdraw. "
+                    f"Withdraw available is R$ {available}"
+                )
+                abort(
+                    make_response(
+                        jsonify(error=error_msg),
+                        HTTPStatus.FORBIDDEN,
+                    )
+                )
             dynamodb_resource.handle_error(error)
 
     @classmethod
-    def deposit_into(cls, account_id: str, value: d.Decimal):
-        return cls._balance_operation(account_id, value, cls.SUM)
+    def deposit_into(
+        cls,
+        account_id: str,
+        value: d.Decimal,
+        idempotency: Optional[dict] = None,
+    ):
+        return cls._balance_operation(
+            account_id, value, cls.SUM, idempotency=idempotency
+        )
 
     @classmethod
     def block(cls, account_id: str, block: bool):
+        if BalanceShard.enabled(account_id):
+            cls._block_sharded(account_id, block)
+            return
         dynamodb_resource = DynamoResource()
         try:
             dynamodb_resource.table_resource(cls.table_name).update_item(
                 Key={"id": account_id},
-                UpdateExpression="SET #blocked = :blocked",
+                UpdateExpression=(
+                    f"SET #blocked = :blocked, {cls.version_update}"
+                ),
                 ExpressionAttributeNames={
                     "#blocked": "blocked",
+                    **cls.version_names,
+                },
+                ExpressionAttributeValues={
+                    ":blocked": block,
+                    **cls.version_values(),
                 },
-                ExpressionAttributeValues={":blocked": block},
             )
+            cls.invalidate(account_id)
         except botocore.exceptions.ClientError as error:
             error_code = error.response["Error"]["Code"]
             if error_code == "ValidationException":
@@ -117,8 +538,540 @@ class Account:
             dynamodb_resource.handle_error(error)
 
     @classmethod
-    def withdraw(cls, account_id: str, value: d.Decimal):
-        return cls._balance_operation(account_id, value, cls.SUB)
+    def _block_sharded(cls, account_id: str, block: bool):
+        """The account and the copies of `blocked` in its shards change
+        together"""
+        dynamodb_resource = DynamoResource()
+        items = [
+            {
+                "Update": {
+                    "TableName": cls.table_name,
+                    "Key": {"id": account_id},
+                    "UpdateExpression": (
+                        f"SET #blocked = :blocked, {cls.version_update}"
+                    ),
+                    "ConditionExpression": "attribute_exists(#id)",
+                    "ExpressionAttributeNames": {
+                        "#id": "id",
+                        "#blocked": "blocked",
+                        **cls.version_names,
+                    },
+                    "ExpressionAttributeValues": {
+                        ":blocked": block,
+                        **cls.version_values(),
+                    },
+                }
+            }
+        ]
+        items.extend(BalanceShard.block_updates(account_id, block))
+        try:
+            dynamodb_resource.transact_write_items(items)
+        except botocore.exceptions.ClientError as error:
+            reasons = retry.cancellation_reasons(error)
+            if reasons[:1] == ["ConditionalCheckFailed"]:
+                abort(
+                    make_response(
+                        jsonify(error="Account not found"),
+                        HTTPStatus.NOT_FOUND,
+                    )
+                )
+            dynamodb_resource.handle_error(error)
+        finally:
+            cls.invalidate(account_id)
+
+    @classmethod
+    def withdraw(
+        cls,
+        account_id: str,
+        value: d.Decimal,
+        daily_withdraw_limit: Optional[d.Decimal] = None,
+        idempotency: Optional[dict] = None,
+    ):
+        return cls._balance_operation(
+            account_id, value, cls.SUB, daily_withdraw_limit, idempotency
+        )
+
+
+class DailyWithdraw:
+    """
+    Total withdrawn by an account in a day, kept up to date on each withdraw
+    so the daily limit is checked with a single key lookup. Each day has its
+    own item, that expires after `retention_days`, so the totals roll over
+    by themselves
+    """
+
+    table_name = "daily_withdraw"
+
+    hash_key = "account_id"
+    sort_key = "withdraw_date"
+
+    retention_days = 2
+
+    # concurrent reads of the same total share the dynamodb call
+    reads = SingleFlight("daily_withdraw")
+
+    @classmethod
+    def key(cls, account_id: str, withdraw_date: str):
+        return {cls.hash_key: account_id, cls.sort_key: withdraw_date}
+
+    @classmethod
+    def forget(cls, account_id: str, operation_date: dt.datetime):
+        withdraw_date = operation_date.strftime(date_format)
+        cls.reads.forget((account_id, withdraw_date))
+
+    @classmethod
+    def total_update(
+        cls,
+        account_id: str,
+        value: d.Decimal,
+        operation_date: dt.datetime,
+        daily_withdraw_limit: Optional[d.Decimal] = None,
+    ):
+        """
+        Update adding `value` to the day total. With `daily_withdraw_limit`
+        the update fails if the new total goes over the limit
+        """
+        withdraw_date = operation_date.strftime(date_format)
+        expires_at = dt.datetime.strptime(withdraw_date, date_format).replace(
+            tzinfo=dt.timezone.utc
+        ) + dt.timedelta(days=cls.retention_days)
+        params = {
+            "TableName": cls.table_name,
+            "Key": cls.key(account_id, withdraw_date),
+            "UpdateExpression": "ADD #total :value SET #expires = :expires",
+            "ExpressionAttributeNames": {
+                "#total": "total",
+                "#expires": "expires_at",
+            },
+            "ExpressionAttributeValues": {
+                ":value": value,
+                ":expires": int(expires_at.timestamp()),
+            },
+        }
+        if daily_withdraw_limit is not None:
+            params["ConditionExpression"] = (
+                "attribute_not_exists(#total) Or #total <= :available"
+            )
+            params["ExpressionAttributeValues"][":available"] = (
+                daily_withdraw_limit - value
+            )
+        return params
+
+    @classmethod
+    def add(
+        cls, account_id: str, value: d.Decimal, operation_date: dt.datetime
+    ):
+        params = cls.total_update(account_id, value, operation_date)
+        params.pop("TableName")
+        dynamodb_resource = DynamoResource()
+        try:
+            dynamodb_resource.table_resource(cls.table_name).update_item(
+                **params
+            )
+        except botocore.exceptions.ClientError as error:
+            dynamodb_resource.handle_error(error)
+        finally:
+            cls.forget(account_id, operation_date)
+
+    @classmethod
+    def find_total(
+        cls,
+        account_id: str,
+        withdraw_date: Optional[str] = None,
+        consistent_read: bool = False,
+    ):
+        withdraw_date = withdraw_date or dt.datetime.now(
+            dt.timezone.utc
+        ).strftime(date_format)
+
+        def read():
+            return DynamoResource().get_item(
+                cls.table_name,
+                cls.key(account_id, withdraw_date),
+                projection=["total"],
+                consistent_read=consistent_read,
+            )
+
+        # the consistent reads must see every write made before them
+        if consistent_read:
+            item = read()
+        else:
+            item = cls.reads.do((account_id, withdraw_date), read)
+        return item["total"] if item else d.Decimal(0)
+
+    @classmethod
+    def find_totals(
+        cls, account_ids: list, withdraw_date: Optional[str] = None
+    ):
+        """Amount withdrawn in the day by each account, read with
+        BatchGetItem (the ids must not repeat)"""
+        withdraw_date = withdraw_date or dt.datetime.now(
+            dt.timezone.utc
+        ).strftime(date_format)
+        items = DynamoResource().batch_get_item(
+            cls.table_name,
+            [cls.key(account_id, withdraw_date) for account_id in account_ids],
+            projection=[cls.hash_key, "total"],
+        )
+        totals = {account_id: d.Decimal(0) for account_id in account_ids}
+        totals.update((item[cls.hash_key], item["total"]) for item in items)
+        return totals
+
+
+class BalanceShard:
+    """
+    Deposits into the accounts that receive too many of them (`configure`)
+    update one of `count` shard items instead of the account item, so the
+    writes spread over many partitions. The balance of those accounts is
+    the account item plus its shards (see `merge`).
+
+    Each shard is its own partition (`<account id>#<shard>`), read with a
+    single BatchGetItem of the `count` keys. Lowering `count` leaves the
+    shards above it unread, fold the account before.
+
+    Withdraws only take from the account item, conditioned on its balance
+    as any other account, folding the shards into it first when it's not
+    enough. The compaction job folds them periodically. The shards keep a
+    copy of `blocked`, changed with the account one and checked by the
+    deposits
+    """
+
+    table_name = "balance_shard"
+
+    hash_key = "shard_id"
+
+    # a fold updates the account and every shard in one transaction
+    max_count = 99
+
+    accounts = frozenset()
+    count = 8
+
+    @classmethod
+    def configure(cls, accounts, count: int):
+        if not 1 <= count <= cls.max_count:
+            raise ValueError(
+                f"the shards must be between 1 and {cls.max_count}"
+            )
+        cls.accounts = frozenset(accounts)
+        cls.count = count
+
+    @classmethod
+    def enabled(cls, account_id: str):
+        return account_id in cls.accounts
+
+    @classmethod
+    def key(cls, account_id: str, shard: int):
+        return {cls.hash_key: f"{account_id}#{shard}"}
+
+    @classmethod
+    def account_of(cls, shard: dict):
+        return shard[cls.hash_key].rsplit("#", 1)[0]
+
+    @classmethod
+    def number_of(cls, shard: dict):
+        return int(shard[cls.hash_key].rsplit("#", 1)[1])
+
+    @classmethod
+    def find_all(
+        cls,
+        account_id: str,
+        consistent_read: bool = False,
+        projection: Optional[Iterable[str]] = None,
+    ):
+        """The shards that exist, the key is always projected"""
+        if projection:
+            projection = list(dict.fromkeys([cls.hash_key, *projection]))
+        return DynamoResource().batch_get_item(
+            cls.table_name,
+            [cls.key(account_id, shard) for shard in range(cls.count)],
+            projection,
+            consistent_read,
+        )
+
+    @staticmethod
+    def merge(account: dict, shards: list):
+        """The account with the balance and the version of its shards"""
+        account = dict(account)
+        for shard in shards:
+            account["balance"] += shard.get("balance", 0)
+            account["version"] = account.get("version", 0) + shard.get(
+                "version", 0
+            )
+            if shard.get("updated_at", "") > account.get("updated_at", ""):
+                account["updated_at"] = shard["updated_at"]
+            if shard.get(Account.pending_attribute):
+                account[Account.pending_attribute] = set(
+                    account.get(Account.pending_attribute) or ()
+                ) | shard[Account.pending_attribute]
+        return account
+
+    @classmethod
+    def deposit_update(cls, account_id: str, value: d.Decimal):
+        """Update of a random shard, fails if it doesn't exist (see
+        `create`) or the account is blocked"""
+        return {
+            "TableName": cls.table_name,
+            "Key": cls.key(account_id, random.randrange(cls.count)),
+            "UpdateExpression": (
+                f"SET #balance = #balance + :balance, {Account.version_update}"
+            ),
+            "ConditionExpression": "#blocked = :blocked",
+            "ExpressionAttributeNames": {
+                "#balance": "balance",
+                "#blocked": "blocked",
+                **Account.version_names,
+            },
+            "ExpressionAttributeValues": {
+                ":balance": value,
+                ":blocked": False,
+                **Account.version_values(),
+            },
+        }
+
+    @classmethod
+    def create(cls, account_id: str):
+        """
+        Creates the missing shards of an account not blocked. False when
+        none was missing or the account is blocked (or doesn't exist)
+        """
+        existing = {
+            cls.number_of(shard)
+            for shard in cls.find_all(account_id, True, [cls.hash_key])
+        }
+        missing = [i for i in range(cls.count) if i not in existing]
+        if not missing:
+            return False
+        items = [
+            {
+                "ConditionCheck": {
+                    "TableName": Account.table_name,
+                    "Key": {"id": account_id},
+                    "ConditionExpression": "#blocked = :blocked",
+                    "ExpressionAttributeNames": {"#blocked": "blocked"},
+                    "ExpressionAttributeValues": {":blocked": False},
+                }
+            }
+        ]
+        for shard in missing:
+            items.append(
+                {
+                    "Put": {
+                        "TableName": cls.table_name,
+                        "Item": {
+                            **cls.key(account_id, shard),
+                            "balance": d.Decimal(0),
+                            "blocked": False,
+                            "version": 0,
+                        },
+                        "ConditionExpression": "attribute_not_exists(#key)",
+                        "ExpressionAttributeNames": {"#key": cls.hash_key},
+                    }
+                }
+            )
+        dynamodb_resource = DynamoResource()
+        try:
+            dynamodb_resource.transact_write_items(items)
+            return True
+        except botocore.exceptions.ClientError as error:
+            reasons = retry.cancellation_reasons(error)
+            if reasons[:1] == ["ConditionalCheckFailed"]:
+                return False
+            if "ConditionalCheckFailed" in reasons:
+                # created at the same time by another request
+                return True
+            dynamodb_resource.handle_error(error)
+
+    @classmethod
+    def block_updates(cls, account_id: str, block: bool):
+        """Updates of the copies of `blocked`, creating the shards that
+        don't exist"""
+        return [
+            {
+                "Update": {
+                    "TableName": cls.table_name,
+                    "Key": cls.key(account_id, shard),
+                    "UpdateExpression": (
+                        "SET #blocked = :blocked, "
+                        "#balance = if_not_exists(#balance, :zero), "
+                        "#version = if_not_exists(#version, :zero)"
+                    ),
+                    "ExpressionAttributeNames": {
+                        "#blocked": "blocked",
+                        "#balance": "balance",
+                        "#version": "version",
+                    },
+                    "ExpressionAttributeValues": {
+                        ":blocked": block,
+                        ":zero": 0,
+                    },
+                }
+            }
+            for shard in range(cls.count)
+        ]
+
+    @classmethod
+    def fold(cls, account_id: str):
+        """
+        Moves the balance of the shards into the account item, in one
+        transaction conditioned on the shards still having what was read.
+        False when there was nothing to move
+        """
+        shards = [
+            shard
+            for shard in cls.find_all(account_id, consistent_read=True)
+            if shard.get("balance", 0) > 0
+        ]
+        if not shards:
+            return False
+        total = sum(shard["balance"] for shard in shards)
+        items = [
+            {
+                "Update": {
+                    "TableName": Account.table_name,
+                    "Key": {"id": account_id},
+                    "UpdateExpression": (
+                        "SET #balance = #balance + :balance, "
+                        f"{Account.version_update}"
+                    ),
+                    "ConditionExpression": "attribute_exists(#id)",
+                    "ExpressionAttributeNames": {
+                        "#id": "id",
+                        "#balance": "balance",
+                        **Account.version_names,
+                    },
+                    "ExpressionAttributeValues": {
+                        ":balance": total,
+                        **Account.version_values(),
+                    },
+                }
+            }
+        ]
+        for shard in shards:
+            items.append(
+                {
+                    "Update": {
+                        "TableName": cls.table_name,
+                        "Key": {cls.hash_key: shard[cls.hash_key]},
+                        "UpdateExpression": (
+                            "SET #balance = #balance - :balance, "
+                            f"{Account.version_update}"
+                        ),
+                        "ConditionExpression": "#balance >= :balance",
+                        "ExpressionAttributeNames": {
+                            "#balance": "balance",
+                            **Account.version_names,
+                        },
+                        "ExpressionAttributeValues": {
+                            ":balance": shard["balance"],
+                            **Account.version_values(),
+                        },
+                    }
+                }
+            )
+        dynamodb_resource = DynamoResource()
+        try:
+            dynamodb_resource.transact_write_items(items)
+        except botocore.exceptions.ClientError as error:
+            reasons = set(retry.cancellation_reasons(error))
+            if reasons & {"ConditionalCheckFailed", "TransactionConflict"}:
+                # folded at the same time by another request
+                return True
+            dynamodb_resource.handle_error(error)
+        finally:
+            Account.invalidate(account_id)
+        return True
+
+
+class Idempotency:
+    """
+    Result of the balance operations sent with an `Idempotency-Key`. The
+    record is written in the same transaction as the balance change, so a
+    retried request either finds it or applies the operation itself. The
+    records expire after `retention_hours` with the dynamodb TTL
+    """
+
+    table_name = "idempotency"
+
+    hash_key = "key"
+
+    retention_hours = 24
+
+    @classmethod
+    def record_key(cls, account_id: str, operation: str, key: str):
+        return f"{account_id}#{operation}#{key}"
+
+    @classmethod
+    def fingerprint(cls, body: bytes):
+        return hashlib.sha256(body).hexdigest()
+
+    @classmethod
+    def new_item(
+        cls, account_id: str, operation: str, key: str, body: bytes
+    ):
+        """Record of a request not executed yet, the result is added by
+        `with_result`"""
+        now = dt.datetime.now(dt.timezone.utc)
+        expires_at = now + dt.timedelta(hours=cls.retention_hours)
+        return {
+            cls.hash_key: cls.record_key(account_id, operation, key),
+            "fingerprint": cls.fingerprint(body),
+            "created_at": now.isoformat(),
+            "expires_at": int(expires_at.timestamp()),
+        }
+
+    @classmethod
+    def with_result(cls, record: dict, account_id: str, transaction_id: str):
+        return {
+            **record,
+            "status": HTTPStatus.CREATED.value,
+            "transaction_id": transaction_id,
+            "content_location": Transaction.location(
+                account_id, transaction_id
+            ),
+        }
+
+    @classmethod
+    def put_item(cls, record: dict):
+        """Put of the record, as part of the balance transaction. Fails when
+        the key was already used (and the record did not expire), returning
+        the saved record"""
+        now = dt.datetime.now(dt.timezone.utc)
+        return {
+            "TableName": cls.table_name,
+            "Item": record,
+            "ConditionExpression": (
+                "attribute_not_exists(#key) Or #expires <= :now"
+            ),
+            "ExpressionAttributeNames": {
+                "#key": cls.hash_key,
+                "#expires": "expires_at",
+            },
+            "ExpressionAttributeValues": {":now": int(now.timestamp())},
+            "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+        }
+
+    @classmethod
+    def cancelled_record(
+        cls, error: botocore.exceptions.ClientError, record_key: str
+    ):
+        """The saved record from the cancellation reason of its put, read
+        again if dynamodb did not return it"""
+        reason = error.response["CancellationReasons"][-1]
+        if reason.get("Item"):
+            return DynamoResource.deserialize(reason["Item"])
+        return cls.find(record_key) or {cls.hash_key: record_key}
+
+    @classmethod
+    def find(cls, record_key: str):
+        return DynamoResource().get_item(
+            cls.table_name, {cls.hash_key: record_key}, consistent_read=True
+        )
+
+    @classmethod
+    def is_expired(cls, record: dict):
+        # dynamodb deletes the expired items some time after the expiration
+        now = dt.datetime.now(dt.timezone.utc).timestamp()
+        return record.get("expires_at", now + 1) <= now
 
 
 @dataclass
@@ -151,86 +1104,367 @@ class Transaction:
     hash_key = "account_id"
     sort_key = "id"
 
+    # attributes returned in the transactions listing
+    list_projection = ("id", "account_id", "value", "created_at")
+
+    # with a journal (see `start_journal`) the balance operations don't put
+    # the transaction record in their dynamodb transaction, it's written
+    # behind by the journal
+    journal: Optional[Journal] = None
+
     @classmethod
-    def add(
+    def new_item(
         cls,
         account_id: str,
         value: d.Decimal,
         operation_date: dt.datetime,
+        transaction_id: Optional[str] = None,
     ):
         payload = {
-            cls.sort_key: str(uuid.uuid4()),
             cls.hash_key: account_id,
             "created_at": operation_date.isoformat(),
             "value": value,
         }
+        if transaction_id and not ulid.is_ulid_of(
+            transaction_id, operation_date
+        ):
+            # the ids given to the backfill keep the table in time order too
+            payload["legacy_id"] = transaction_id
+            transaction_id = ulid.derived(operation_date, transaction_id)
+        payload[cls.sort_key] = transaction_id or ulid.new(operation_date)
         if value < 0:
             payload["withdraw_date"] = operation_date.strftime(date_format)
+        return payload
+
+    @classmethod
+    def location(cls, account_id: str, transaction_id: str):
+        return f"/account/{account_id}/transaction/{transaction_id}"
+
+    @classmethod
+    def put_item(cls, payload: dict):
+        """Put of a new transaction, as part of a dynamodb transaction"""
+        return {
+            "TableName": cls.table_name,
+            "Item": payload,
+            "ConditionExpression": "attribute_not_exists(#id)",
+            "ExpressionAttributeNames": {"#id": cls.sort_key},
+        }
+
+    @classmethod
+    def add(
+        cls,
+        account_id: str,
+        value: d.Decimal,
+        operation_date: dt.datetime,
+    ):
+        payload = cls.new_item(account_id, value, operation_date)
         DynamoResource().add(cls.table_name, payload)
         return payload["id"]
 
     @classmethod
-    def paginated_query(cls, table, key_expression, index_name: str):
-        kwarsgs = {"KeyConditionExpression": key_expression}
+    def start_journal(cls, directory: str, flush_interval: float = 0.2):
+        """Starts the write-behind mode, recovering the records left in the
+        directory by the processes that stopped"""
+        if cls.journal is None:
+            cls.journal = Journal(
+                directory,
+                cls._flush_journal,
+                name=cls.table_name,
+                batch_size=DynamoResource.batch_write_limit,
+                flush_interval=flush_interval,
+                on_dead_letter=cls._lost_records,
+            ).open()
+            # what can't be flushed on exit stays for the next process
+            atexit.register(cls.stop_journal)
+        return cls.journal
+
+    @classmethod
+    def stop_journal(cls, timeout: float = 5):
+        journal, cls.journal = cls.journal, None
+        if journal:
+            journal.close(timeout)
+
+    @classmethod
+    def _pending_items(cls, payloads: list, records: list):
+        """(account id, table name, key, transaction ids) of the items
+        that have the journal records pending"""
+        pending = {}
+        for record, payload in zip(records, payloads):
+            key = DynamoResource.deserialize(record["key"])
+            item = (record["table"], tuple(sorted(key.items())))
+            pending.setdefault(item, (payload[cls.hash_key], key, set()))
+            pending[item][2].add(payload[cls.sort_key])
+        for (table_name, _), (account_id, key, ids) in pending.items():
+            yield account_id, table_name, key, ids
+
+    @classmethod
+    def _flush_journal(cls, records: list):
+        payloads = [DynamoResource.deserialize(r["item"]) for r in records]
+        cls.add_batch(payloads)
+        # then the items updated by the balance operations stop having them
+        # pending
+        for item in cls._pending_items(payloads, records):
+            Account.clear_pending(*item)
+
+    @classmethod
+    def _lost_records(cls, records: list):
+        """The records moved to the dead letter file are not pending
+        anymore, they are missing"""
+        payloads = [DynamoResource.deserialize(r["item"]) for r in records]
+        for item in cls._pending_items(payloads, records):
+            Account.clear_pending(*item, missing=True)
+
+    @classmethod
+    def write_behind(
+        cls, journal: Journal, payload: dict, table_name: str, key: dict
+    ):
+        """Appends the record of a committed balance operation, with the
+        item (`table_name` and `key`) that has it pending"""
+        try:
+            journal.append(
+                {
+                    "item": DynamoResource.serialize(payload),
+                    "table": table_name,
+                    "key": DynamoResource.serialize(key),
+                }
+            )
+        except Exception:
+            # the balance already changed, the record must be written by hand
+            logging.critical(f"Transaction not journaled: {payload!r}")
+            try:
+                Account.clear_pending(
+                    payload[cls.hash_key],
+                    table_name,
+                    key,
+                    {payload[cls.sort_key]},
+                    missing=True,
+                )
+            except Exception:
+                # left to `reconcile`
+                logging.exception("Failed to flag the transaction missing")
+            raise
+
+    @classmethod
+    def add_batch(cls, payloads: list):
+        """Inserts already built transactions (see `new_item`), without
+        touching the balances"""
+        DynamoResource().batch_write(cls.table_name, payloads)
+
+    @classmethod
+    def paginated_query(
+        cls,
+        table,
+        key_expression,
+        index_name: str,
+        prefetch: bool = False,
+        **query_kwargs,
+    ):
+        """
+        Every item matching the key expression, page by page. With
+        `prefetch` the next page is requested while the current one is
+        consumed
+        """
+        kwarsgs = {"KeyConditionExpression": key_expression, **query_kwargs}
         if index_name:
             kwarsgs["IndexName"] = index_name
-        result = table.query(**kwarsgs)
-        for item in result["Items"]:
-            yield item
-
-        while "LastEvaluatedKey" in result:
-            args = {
-                "KeyConditionExpression": key_expression,
-                "ExclusiveStartKey": result["LastEvaluatedKey"],
-            }
-            if index_name:
-                args["IndexName"] = index_name
-            result = table.query(**args)
+        if not prefetch:
+            result = table.query(**kwarsgs)
             for item in result["Items"]:
                 yield item
 
+            while "LastEvaluatedKey" in result:
+                args = {
+                    **kwarsgs,
+                    "ExclusiveStartKey": result["LastEvaluatedKey"],
+                }
+                result = table.query(**args)
+                for item in result["Items"]:
+                    yield item
+            return
+
+        def query(**args):
+            # each thread must use its own table resource
+            return DynamoResource().table_resource(table.name).query(**args)
+
+        next_page = concurrency.submit(query, **kwarsgs)
+        try:
+            while next_page:
+                result = next_page.result()
+                next_page = None
+                if "LastEvaluatedKey" in result:
+                    next_page = concurrency.submit(
+                        query,
+                        **kwarsgs,
+                        ExclusiveStartKey=result["LastEvaluatedKey"],
+                    )
+                for item in result["Items"]:
+                    yield item
+        finally:
+            # the consumer stopped early, the page is not needed anymore
+            if next_page:
+                next_page.cancel()
+
+    @classmethod
+    def _date_key_expression(
+        cls,
+        account_id: str,
+        begin_date: Optional[dt.datetime] = None,
+        end_date: Optional[dt.datetime] = None,
+    ):
+        index = TransactionIndex.datetime
+        key_expression = Key(index.hash_key).eq(account_id)
+        if begin_date and end_date:
+            key_expression = key_expression & Key(index.sort_key).between(
+                begin_date.isoformat(), end_date.isoformat()
+            )
+        elif begin_date:
+            key_expression = key_expression & Key(index.sort_key).gte(
+                begin_date.isoformat()
+            )
+        elif end_date:
+            key_expression = key_expression & Key(index.sort_key).lt(
+                end_date.isoformat()
+            )
+        return key_expression
+
+    @classmethod
+    def _date_query(
+        cls,
+        account_id: str,
+        begin_date: Optional[dt.datetime] = None,
+        end_date: Optional[dt.datetime] = None,
+        ordered_ids: bool = False,
+    ):
+        """
+        Query arguments of the transactions in the date range. Time ordered
+        ids are read from the base table, consistently, by the ids of the
+        limits milliseconds (filtered by the exact dates). The others need
+        the date index
+        """
+        if not ordered_ids:
+            return {
+                "KeyConditionExpression": cls._date_key_expression(
+                    account_id, begin_date, end_date
+                ),
+                "IndexName": TransactionIndex.datetime.name,
+            }
+        key_expression = Key(cls.hash_key).eq(account_id)
+        ids = Key(cls.sort_key)
+        created_at = Attr(TransactionIndex.datetime.sort_key)
+        query = {"ConsistentRead": True}
+        if begin_date and end_date:
+            key_expression = key_expression & ids.between(
+                ulid.lower_bound(begin_date), ulid.upper_bound(end_date)
+            )
+            query["FilterExpression"] = created_at.between(
+                begin_date.isoformat(), end_date.isoformat()
+            )
+        elif begin_date:
+            key_expression = key_expression & ids.gte(
+                ulid.lower_bound(begin_date)
+            )
+            query["FilterExpression"] = created_at.gte(begin_date.isoformat())
+        elif end_date:
+            key_expression = key_expression & ids.lte(
+                ulid.upper_bound(end_date)
+            )
+            query["FilterExpression"] = created_at.lt(end_date.isoformat())
+        query["KeyConditionExpression"] = key_expression
+        return query
+
     @classmethod
     def find_by_account_id(
         cls,
         account_id: str,
         begin_date: Optional[dt.datetime] = None,
         end_date: Optional[dt.datetime] = None,
-        next_cursor: Optional[str] = None,
+        next_cursor: Optional[dict] = None,
+        page_size: Optional[int] = None,
+        ordered_ids: bool = False,
     ):
+        """
+        One page of the account transactions, `next_cursor` is the
+        `LastEvaluatedKey` of the previous page. `ordered_ids` reads the
+        base table (see `Account.ordered_ids`)
+        """
+        if next_cursor and next_cursor.get(cls.hash_key) != account_id:
+            abort(
+                make_response(
+                    jsonify(error={"next-page-cursor": ["Invalid cursor"]}),
+                    HTTPStatus.BAD_REQUEST,
+                )
+            )
+        if next_cursor:
+            # the next pages come from the query of the first one, the
+            # account may have been migrated in between
+            ordered_ids = TransactionIndex.datetime.sort_key not in next_cursor
         dynamodb_resource = DynamoResource()
         try:
-            index = TransactionIndex.datetime
-            key_expression = Key(index.hash_key).eq(account_id)
-            if begin_date and end_date:
-                key_expression = key_expression & Key(index.sort_key).between(
-                    begin_date.isoformat(), end_date.isoformat()
-                )
-            elif begin_date:
-                key_expression = key_expression & Key(index.sort_key).gte(
-                    begin_date.isoformat()
-                )
-            elif end_date:
-                key_expression = key_expression & Key(index.sort_key).lt(
-                    end_date.isoformat()
-                )
-
+            query = cls._date_query(
+                account_id, begin_date, end_date, ordered_ids
+            )
+            kwargs = dynamodb_resource.projection_kwargs(cls.list_projection)
+            if next_cursor:
+                kwargs["ExclusiveStartKey"] = next_cursor
+            if page_size:
+                kwargs["Limit"] = page_size
             return dynamodb_resource.table_resource(cls.table_name).query(
-                KeyConditionExpression=key_expression,
-                IndexName=index.name
+                **query, **kwargs
+            )
+        except botocore.exceptions.ClientError as error:
+            dynamodb_resource.handle_error(error)
+
+    @classmethod
+    def export(
+        cls,
+        account_id: str,
+        begin_date: Optional[dt.datetime] = None,
+        end_date: Optional[dt.datetime] = None,
+        ordered_ids: bool = False,
+    ):
+        """
+        Generator with the whole account history in the date range, in
+        chronological order. Only one page is kept in memory (plus the
+        prefetched one)
+        """
+        dynamodb_resource = DynamoResource()
+        query = cls._date_query(account_id, begin_date, end_date, ordered_ids)
+        try:
+            yield from cls.paginated_query(
+                dynamodb_resource.table_resource(cls.table_name),
+                query.pop("KeyConditionExpression"),
+                query.pop("IndexName", None),
+                prefetch=True,
+                **query,
+                **dynamodb_resource.projection_kwargs(cls.list_projection),
             )
         except botocore.exceptions.ClientError as error:
             dynamodb_resource.handle_error(error)
 
     @classmethod
     def find_withdraw_limit_available(cls, account_id: str):
+        """Amount already withdrawn today"""
+        return DailyWithdraw.find_total(account_id)
+
+    @classmethod
+    def sum_withdraw_index(
+        cls, account_id: str, withdraw_date: Optional[str] = None
+    ):
+        """
+        Amount withdrawn in a day summing every withdraw transaction, slow
+        but useful to audit or rebuild the `DailyWithdraw` totals
+        """
+        withdraw_date = withdraw_date or dt.datetime.now(
+            dt.timezone.utc
+        ).strftime(date_format)
         dynamodb_resource = DynamoResource()
         try:
             index = TransactionIndex.withdraw
             key_expression = Key(index.hash_key).eq(account_id) & Key(
                 index.sort_key
-            ).eq(dt.datetime.now(dt.timezone.utc).strftime(date_format))
+            ).eq(withdraw_date)
             table = dynamodb_resource.table_resource(cls.table_name)
-            return sum(
+            return -sum(
                 i["value"]
                 for i in cls.paginated_query(
                     table,
@@ -242,6 +1476,386 @@ class Transaction:
             dynamodb_resource.handle_error(error)
 
 
+class LedgerRollup:
+    """
+    Closed daily and monthly summaries of the account ledger: deposits,
+    withdrawals (positive), count and closing balance, written by the
+    `rollup` job for the days already over (UTC). The history questions
+    read the summaries plus only the transactions of the days still open.
+
+    The `STATE` item has the last closed day, its closing balance and the
+    balance before the first transaction. It is written after the
+    summaries, so a job that failed in the middle runs again from the same
+    day
+    """
+
+    table_name = "ledger_rollup"
+
+    hash_key = "account_id"
+    sort_key = "period"
+
+    DAY = "D"
+    MONTH = "M"
+    STATE = "STATE"
+
+    # daily totals of the closed days of the accounts not rolled up yet,
+    # read by the statements
+    closed_days = TTLCache(maxsize=256, ttl=3600)
+    statement_attempts = 3
+
+    @classmethod
+    def period(cls, granularity: str, date: dt.date):
+        if granularity == cls.MONTH:
+            return f"{cls.MONTH}#{date.strftime('%Y-%m')}"
+        return f"{cls.DAY}#{date.isoformat()}"
+
+    @staticmethod
+    def midnight(date: dt.date):
+        return dt.datetime.combine(date, dt.time(), tzinfo=dt.timezone.utc)
+
+    @staticmethod
+    def empty_totals():
+        return {
+            "deposits": d.Decimal(0),
+            "withdrawals": d.Decimal(0),
+            "count": 0,
+        }
+
+    @staticmethod
+    def merge_totals(totals: dict, other: dict):
+        for name in ("deposits", "withdrawals", "count"):
+            totals[name] += other[name]
+        return totals
+
+    @staticmethod
+    def net(totals: dict):
+        return totals["deposits"] - totals["withdrawals"]
+
+    @classmethod
+    def daily_totals(cls, items, begin: dt.date, end: dt.date):
+        """Totals by day (iso date) of the transactions between `begin` and
+        `end` (inclusive), the others are ignored"""
+        days = {}
+        low, high = begin.isoformat(), end.isoformat()
+        for item in items:
+            # the dates are saved in utc, the day is the date part
+            day = item["created_at"][:10]
+            if not low <= day <= high:
+                continue
+            totals = days.setdefault(day, cls.empty_totals())
+            if item["value"] < 0:
+                totals["withdrawals"] -= item["value"]
+            else:
+                totals["deposits"] += item["value"]
+            totals["count"] += 1
+        return days
+
+    @classmethod
+    def _segments(cls, begin: dt.date, end: dt.date):
+        """The range split in the days before the first whole month, the
+        whole months and the days after them"""
+        one_day = dt.timedelta(days=1)
+        first_month = begin
+        if begin.day != 1:
+            first_month = (begin.replace(day=28) + 4 * one_day).replace(day=1)
+        after_months = end + one_day
+        if after_months.day != 1:
+            after_months = end.replace(day=1)
+        if first_month >= after_months:
+            return [(cls.DAY, begin, end)]
+        segments = []
+        if begin < first_month:
+            segments.append((cls.DAY, begin, first_month - one_day))
+        segments.append((cls.MONTH, first_month, after_months - one_day))
+        if after_months <= end:
+            segments.append((cls.DAY, after_months, end))
+        return segments
+
+    @classmethod
+    def record(
+        cls,
+        account_id: str,
+        granularity: str,
+        date: dt.date,
+        totals: dict,
+        closing_balance: d.Decimal,
+    ):
+        return {
+            cls.hash_key: account_id,
+            cls.sort_key: cls.period(granularity, date),
+            **totals,
+            "closing_balance": closing_balance,
+        }
+
+    @classmethod
+    def state(
+        cls,
+        account_id: str,
+        closed_through: dt.date,
+        closing_balance: d.Decimal,
+        opening_balance: d.Decimal,
+    ):
+        return {
+            cls.hash_key: account_id,
+            cls.sort_key: cls.STATE,
+            "closed_through": closed_through.isoformat(),
+            "closing_balance": closing_balance,
+            "opening_balance": opening_balance,
+        }
+
+    @classmethod
+    def find_state(cls, account_id: str):
+        return DynamoResource().get_item(
+            cls.table_name,
+            {cls.hash_key: account_id, cls.sort_key: cls.STATE},
+            consistent_read=True,
+        )
+
+    @classmethod
+    def find(
+        cls, account_id: str, granularity: str, begin: dt.date, end: dt.date
+    ):
+        """Summaries of the periods between `begin` and `end` (inclusive)"""
+        dynamodb_resource = DynamoResource()
+        try:
+            key_expression = Key(cls.hash_key).eq(account_id) & Key(
+                cls.sort_key
+            ).between(
+                cls.period(granularity, begin), cls.period(granularity, end)
+            )
+            return list(
+                Transaction.paginated_query(
+                    dynamodb_resource.table_resource(cls.table_name),
+                    key_expression,
+                    "",
+                    ConsistentRead=True,
+                )
+            )
+        except botocore.exceptions.ClientError as error:
+            dynamodb_resource.handle_error(error)
+
+    @classmethod
+    def save(cls, records: list, state: dict):
+        dynamodb_resource = DynamoResource()
+        dynamodb_resource.batch_write(cls.table_name, records)
+        dynamodb_resource.add(cls.table_name, state)
+
+    @classmethod
+    def _open_totals(
+        cls, account_id: str, begin: dt.date, end: Optional[dt.date] = None
+    ):
+        """Totals of the days not summarized yet, from the transactions.
+        Without `end` until the last one"""
+        end_date = None
+        if end:
+            end_date = cls.midnight(end + dt.timedelta(days=1))
+        items = Transaction.export(
+            account_id,
+            cls.midnight(begin),
+            end_date,
+            Account.ordered_ids(account_id),
+        )
+        return functools.reduce(
+            cls.merge_totals,
+            cls.daily_totals(items, begin, end or dt.date.max).values(),
+            cls.empty_totals(),
+        )
+
+    @classmethod
+    def totals(cls, account_id: str, begin: dt.date, end: dt.date):
+        """
+        Deposits, withdrawals and count of the transactions between `begin`
+        and `end` (inclusive), reading the monthly summaries of the whole
+        months, the daily ones of the other closed days and the
+        transactions of the days still open
+        """
+        state = cls.find_state(account_id)
+        one_day = dt.timedelta(days=1)
+        closed_through = (
+            dt.date.fromisoformat(state["closed_through"])
+            if state
+            else begin - one_day
+        )
+        totals = cls.empty_totals()
+        closed_end = min(end, closed_through)
+        if begin <= closed_end:
+            for granularity, low, high in cls._segments(begin, closed_end):
+                for record in cls.find(account_id, granularity, low, high):
+                    cls.merge_totals(totals, record)
+        open_begin = max(begin, closed_through + one_day)
+        if open_begin <= end:
+            cls.merge_totals(
+                totals, cls._open_totals(account_id, open_begin, end)
+            )
+        return totals
+
+    @classmethod
+    def balance_at(cls, account_id: str, date: dt.date):
+        """
+        Balance at the end of the day. A closed day reads a single summary,
+        an open one adds its transactions to the last closing balance.
+        Accounts never rolled up go back from the current balance
+        """
+        state = cls.find_state(account_id)
+        one_day = dt.timedelta(days=1)
+        if not state:
+            account = Account.find_one_by_id(account_id, consistent_read=True)
+            if not account:
+                return None
+            later = cls._open_totals(account_id, date + one_day)
+            return account["balance"] - cls.net(later)
+
+        closed_through = dt.date.fromisoformat(state["closed_through"])
+        if date > closed_through:
+            return state["closing_balance"] + cls.net(
+                cls._open_totals(account_id, closed_through + one_day, date)
+            )
+        dynamodb_resource = DynamoResource()
+        try:
+            resp = dynamodb_resource.table_resource(cls.table_name).query(
+                KeyConditionExpression=Key(cls.hash_key).eq(account_id)
+                & Key(cls.sort_key).between(
+                    cls.period(cls.DAY, dt.date.min),
+                    cls.period(cls.DAY, date),
+                ),
+                ScanIndexForward=False,
+                Limit=1,
+                ConsistentRead=True,
+            )
+        except botocore.exceptions.ClientError as error:
+            dynamodb_resource.handle_error(error)
+        if resp["Items"]:
+            return resp["Items"][0]["closing_balance"]
+        # no transaction until the day
+        return state["opening_balance"]
+
+    @classmethod
+    def _statement_days(cls, account_id: str, begin: dt.date):
+        """
+        Totals by day from `begin` until the last transaction and the
+        opening balance of `begin`, of an account never rolled up. The
+        closed days are cached, the next statements only read the
+        transactions of the days still open
+        """
+        # the days are closed and settled as the rollup does it
+        from src.account.account import rollup
+
+        one_day = dt.timedelta(days=1)
+        now = dt.datetime.now(dt.timezone.utc)
+        last_closed = rollup.last_closed_day(now)
+        low = begin.isoformat()
+        for _ in range(cls.statement_attempts):
+            account = Account.find_one_by_id(account_id, consistent_read=True)
+            if not account:
+                return None, None
+            token = cls.closed_days.token()
+            cached = cls.closed_days.get(account_id)
+            days, read_from = {}, begin
+            if cached and cached["begin"] <= low:
+                # the cached days continue with the ones read now
+                cached_end = dt.date.fromisoformat(cached["end"])
+                if begin <= cached_end + one_day:
+                    days = dict(cached["days"])
+                    read_from = cached_end + one_day
+                else:
+                    cached = None
+            items = Transaction.export(
+                account_id,
+                cls.midnight(read_from),
+                None,
+                bool(account.get(Account.ordered_ids_attribute)),
+            )
+            days.update(cls.daily_totals(items, read_from, dt.date.max))
+            # the balance must have every transaction read, and only them
+            if Account.find_version(account_id) == account.get(
+                "version", 0
+            ) and not Account.pending_before(account):
+                break
+        else:
+            raise ReadConflict(f"account {account_id} kept changing")
+        # a change too recent may be missing from the transactions read
+        if begin <= last_closed and rollup.settled(account, now):
+            cls.closed_days.set(
+                account_id,
+                {
+                    "begin": min(low, cached["begin"]) if cached else low,
+                    "end": last_closed.isoformat(),
+                    "days": {
+                        day: totals
+                        for day, totals in days.items()
+                        if day <= last_closed.isoformat()
+                    },
+                },
+                token,
+            )
+        days = {day: totals for day, totals in days.items() if day >= low}
+        opening = account["balance"] - sum(
+            cls.net(totals) for totals in days.values()
+        )
+        return days, opening
+
+    @classmethod
+    def statement(
+        cls, account_id: str, begin: dt.date, end: dt.date, monthly: bool
+    ):
+        """
+        Deposits, withdrawals, count and closing balance of each day (or
+        month) with transactions between `begin` and `end`, and the balance
+        before `begin`. The closed days come from the summaries (or from
+        the cache of the accounts not rolled up yet), only the transactions
+        of the open days are read. None when the account doesn't exist,
+        `ReadConflict` when it kept changing while it was read
+        """
+        state = cls.find_state(account_id)
+        one_day = dt.timedelta(days=1)
+        days = {}
+        if not state:
+            days, opening = cls._statement_days(account_id, begin)
+            if days is None:
+                return None
+        else:
+            closed_through = dt.date.fromisoformat(state["closed_through"])
+            closed_end = min(end, closed_through)
+            if begin <= closed_end:
+                segments = cls._segments(begin, closed_end)
+                if not monthly:
+                    segments = [(cls.DAY, begin, closed_end)]
+                for granularity, low, high in segments:
+                    for record in cls.find(account_id, granularity, low, high):
+                        # the records keys are the date after the "D#"/"M#"
+                        days[record[cls.sort_key][2:]] = record
+            open_begin = max(begin, closed_through + one_day)
+            if open_begin <= end:
+                items = Transaction.export(
+                    account_id,
+                    cls.midnight(open_begin),
+                    cls.midnight(end + one_day),
+                    Account.ordered_ids(account_id),
+                )
+                days.update(cls.daily_totals(items, open_begin, end))
+            opening = cls.balance_at(account_id, begin - one_day)
+
+        periods = {}
+        for day in sorted(days):
+            if day > end.isoformat():
+                break
+            totals = days[day]
+            if not totals["count"]:
+                continue
+            period = day[:7] if monthly else day
+            cls.merge_totals(
+                periods.setdefault(period, cls.empty_totals()), totals
+            )
+        balance = opening
+        rows = []
+        for period, totals in periods.items():
+            balance += cls.net(totals)
+            rows.append(
+                {"period": period, **totals, "closing_balance": balance}
+            )
+        return {"opening_balance": opening, "periods": rows}
+
+
 class Person:
     """
     Not a column of account with the excuse that a
@@ -0,0 +1,184 @@
+"""
+Resolves the transactions left pending by the write-behind journal (see
+`models.Transaction.journal`) whose records never reached the ledger: the
+ones of a process that crashed after the commit and whose journal was never
+recovered, or that failed to be journaled or flagged. While pending they
+keep the statements unavailable and the rollup postponed. Meant to run
+every hour or so:
+
+    python -m src.account.account.reconcile [--account ID ...]
+
+The transactions pending for more than `--older-than` seconds are looked up
+in the ledger, the ones found stop being pending and the ones not found are
+flagged missing in the account (`missing_transactions`), the records must
+be written by hand (the dead letter file of the journal has the records
+that failed). The missing ones found in the ledger on a later run are taken
+out of the flag.
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import sys
+from typing import Iterable, Optional
+
+from src.account.account import models
+from src.account.core import ulid
+from src.account.core.aws.dynamodb import DynamoResource
+
+# a journal of a stopped process is recovered when the next one starts,
+# its records are only given up after this
+pending_grace = dt.timedelta(hours=1)
+
+
+def _item_key(table_name: str, item: dict):
+    """(account id, key) of an account or shard item"""
+    if table_name == models.Account.table_name:
+        return item["id"], {"id": item["id"]}
+    shard = models.BalanceShard
+    return shard.account_of(item), {shard.hash_key: item[shard.hash_key]}
+
+
+def _scan(table_name: str):
+    table = DynamoResource().table_resource(table_name)
+    kwargs = {
+        "FilterExpression": (
+            "attribute_exists(#pending) OR attribute_exists(#missing)"
+        ),
+        "ExpressionAttributeNames": {
+            "#pending": models.Account.pending_attribute,
+            "#missing": models.Account.missing_attribute,
+        },
+    }
+    while True:
+        resp = table.scan(**kwargs)
+        for item in resp["Items"]:
+            yield item
+        if "LastEvaluatedKey" not in resp:
+            return
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def unresolved_items(accounts: Optional[Iterable[str]] = None):
+    """(table name, item) of the account and shard items with pending or
+    missing transactions, of every account when `accounts` is not given"""
+    tables = (models.Account.table_name, models.BalanceShard.table_name)
+    if accounts is None:
+        for table_name in tables:
+            for item in _scan(table_name):
+                yield table_name, item
+        return
+    dynamodb_resource = DynamoResource()
+    for account_id in accounts:
+        account = dynamodb_resource.get_item(
+            models.Account.table_name, {"id": account_id}, consistent_read=True
+        )
+        items = [(tables[0], account)] if account else []
+        items += [
+            (tables[1], shard)
+            for shard in models.BalanceShard.find_all(account_id, True)
+        ]
+        for table_name, item in items:
+            if item.get(models.Account.pending_attribute) or item.get(
+                models.Account.missing_attribute
+            ):
+                yield table_name, item
+
+
+def reconcile_item(
+    table_name: str, item: dict, now: dt.datetime, older_than: dt.timedelta
+):
+    """Counts of the transactions (pending) found, (pending) flagged
+    missing and (missing) found"""
+    account = models.Account
+    account_id, key = _item_key(table_name, item)
+    limit = ulid.millisecond(now - older_than)
+    pending = {
+        transaction_id
+        for transaction_id in item.get(account.pending_attribute) or ()
+        if ulid.millisecond_of(transaction_id) < limit
+    }
+    missing = set(item.get(account.missing_attribute) or ())
+    if not pending | missing:
+        return 0, 0, 0
+    transaction = models.Transaction
+    found = {
+        row[transaction.sort_key]
+        for row in DynamoResource().batch_get_item(
+            transaction.table_name,
+            [
+                {transaction.hash_key: account_id, transaction.sort_key: i}
+                for i in sorted(pending | missing)
+            ],
+            [transaction.sort_key],
+            consistent_read=True,
+        )
+    }
+    if pending & found:
+        account.clear_pending(account_id, table_name, key, pending & found)
+    if pending - found:
+        account.clear_pending(
+            account_id, table_name, key, pending - found, missing=True
+        )
+    if missing & found:
+        account.clear_missing(account_id, table_name, key, missing & found)
+    return len(pending & found), len(pending - found), len(missing & found)
+
+
+def reconcile(
+    accounts: Optional[Iterable[str]] = None,
+    now: Optional[dt.datetime] = None,
+    older_than: dt.timedelta = pending_grace,
+):
+    now = now or dt.datetime.now(dt.timezone.utc)
+    report = {
+        "itens": 0,
+        "encontradas": 0,
+        "perdidas": 0,
+        "recuperadas": 0,
+        "erros": [],
+    }
+    for table_name, item in unresolved_items(accounts):
+        report["itens"] += 1
+        try:
+            found, lost, recovered = reconcile_item(
+                table_name, item, now, older_than
+            )
+        except Exception as error:
+            account_id, _ = _item_key(table_name, item)
+            logging.error(f"Reconcile error on {account_id}: {error!r}")
+            report["erros"].append({"conta": account_id, "erro": repr(error)})
+            continue
+        report["encontradas"] += found
+        report["perdidas"] += lost
+        report["recuperadas"] += recovered
+    return report
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--account",
+        action="append",
+        help="account to reconcile, every account when not given",
+    )
+    parser.add_argument(
+        "--older-than",
+        type=float,
+        default=pending_grace.total_seconds(),
+        help="seconds a transaction is pending before it's looked up",
+    )
+    args = parser.parse_args(argv)
+
+    report = reconcile(
+        args.account, older_than=dt.timedelta(seconds=args.older_than)
+    )
+    print(json.dumps(report, indent=2))
+    return 1 if report["erros"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
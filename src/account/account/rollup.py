@@ -0,0 +1,235 @@
+"""
+Daily and monthly ledger summaries (see `models.LedgerRollup`). Each run
+summarizes the days closed since the previous one, so it's meant to run
+periodically (once a day is enough):
+
+    python -m src.account.account.rollup [--account ID ...] --workers 8
+
+The first run of an account reads its whole history once. Transactions
+backfilled into days already summarized need `--rebuild`, that summarizes
+the account history again.
+"""
+import argparse
+import datetime as dt
+import json
+import sys
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from src.account.account import models
+from src.account.core.aws.dynamodb import DynamoResource
+from src.account.core.jobs import JobReport, run_in_workers
+
+# a day is only closed some minutes after it ends, so the transactions
+# committed at midnight are already in the index
+close_delay = dt.timedelta(minutes=5)
+# the first run of an account waits for its last change to reach the index
+settle_seconds = 5
+
+
+@dataclass
+class RollupReport(JobReport):
+    accounts: int = 0
+    records: int = 0
+    postponed: int = 0
+
+    job = "Rollup"
+
+
+def last_closed_day(now: dt.datetime):
+    return (now - close_delay).date() - dt.timedelta(days=1)
+
+
+def settled(account: dict, now: dt.datetime):
+    """Whether the last change of the account already reached the index"""
+    updated_at = account.get("updated_at")
+    if not updated_at:
+        return True
+    age = now - dt.datetime.fromisoformat(updated_at)
+    return age.total_seconds() >= settle_seconds
+
+
+def roll_up(
+    account_id: str,
+    now: Optional[dt.datetime] = None,
+    rebuild: bool = False,
+):
+    """
+    Writes the summaries of the days closed since the last run and of the
+    months they closed. Returns how many were written, None when the
+    account changed while its first run read it or has transactions of the
+    days to summarize still in a journal (it's tried again on the next run)
+    """
+    rollup = models.LedgerRollup
+    now = now or dt.datetime.now(dt.timezone.utc)
+    last_day = last_closed_day(now)
+    one_day = dt.timedelta(days=1)
+    state = None if rebuild else rollup.find_state(account_id)
+
+    if state:
+        begin = dt.date.fromisoformat(state["closed_through"]) + one_day
+        if begin > last_day:
+            return 0
+        account = models.Account.find_one_by_id(
+            account_id, consistent_read=True
+        )
+        # transactions of the closed days still in a journal
+        if account and models.Account.pending_before(
+            account, rollup.midnight(last_day + one_day)
+        ):
+            return None
+        items = models.Transaction.export(
+            account_id,
+            rollup.midnight(begin),
+            rollup.midnight(last_day + one_day),
+            models.Account.ordered_ids(account_id),
+        )
+        days = rollup.daily_totals(items, begin, last_day)
+        opening = state["opening_balance"]
+        closing = state["closing_balance"]
+        month = rollup.empty_totals()
+        if begin.day != 1:
+            # the month started in a previous run
+            for record in rollup.find(
+                account_id, rollup.DAY, begin.replace(day=1), begin - one_day
+            ):
+                rollup.merge_totals(month, record)
+    else:
+        # the balance before the first transaction comes from the current
+        # one, read with every transaction after it
+        account = models.Account.find_one_by_id(
+            account_id, consistent_read=True
+        )
+        if (
+            not account
+            or not settled(account, now)
+            or models.Account.pending_before(account)
+        ):
+            return None
+        items = list(
+            models.Transaction.export(
+                account_id,
+                ordered_ids=bool(
+                    account.get(models.Account.ordered_ids_attribute)
+                ),
+            )
+        )
+        days = rollup.daily_totals(items, dt.date.min, last_day)
+        later = rollup.daily_totals(items, last_day + one_day, dt.date.max)
+        if models.Account.find_version(account_id) != account.get(
+            "version", 0
+        ):
+            return None
+        opening = account["balance"]
+        for totals in list(days.values()) + list(later.values()):
+            opening -= rollup.net(totals)
+        closing = opening
+        begin = (
+            dt.date.fromisoformat(min(days)) if days else last_day + one_day
+        )
+        month = rollup.empty_totals()
+
+    records = []
+    day = begin
+    while day <= last_day:
+        totals = days.get(day.isoformat())
+        if totals:
+            closing += rollup.net(totals)
+            records.append(
+                rollup.record(account_id, rollup.DAY, day, totals, closing)
+            )
+            rollup.merge_totals(month, totals)
+        if (day + one_day).day == 1:
+            records.append(
+                rollup.record(account_id, rollup.MONTH, day, month, closing)
+            )
+            month = rollup.empty_totals()
+        day += one_day
+
+    rollup.save(
+        records, rollup.state(account_id, last_day, closing, opening)
+    )
+    return len(records)
+
+
+def account_ids():
+    dynamodb_resource = DynamoResource()
+    table = dynamodb_resource.table_resource(models.Account.table_name)
+    kwargs = dynamodb_resource.projection_kwargs(["id"])
+    while True:
+        resp = table.scan(**kwargs)
+        for item in resp["Items"]:
+            yield item["id"]
+        if "LastEvaluatedKey" not in resp:
+            return
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def roll_up_all(
+    accounts: Iterable[str], workers: int = 4, rebuild: bool = False
+):
+    report = RollupReport()
+    started_at = time.perf_counter()
+    now = dt.datetime.now(dt.timezone.utc)
+
+    def rolled_up(_, written: Optional[int]):
+        report.accounts += 1
+        if written is None:
+            report.postponed += 1
+        else:
+            report.records += written
+
+    def failed(account_id: str, error: Exception):
+        report.add_error({"conta": account_id, "erro": repr(error)})
+
+    run_in_workers(
+        lambda account_id: roll_up(account_id, now, rebuild),
+        accounts,
+        workers,
+        failed,
+        rolled_up,
+    )
+
+    report.seconds = time.perf_counter() - started_at
+    return report
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--account",
+        action="append",
+        help="account to summarize, every account when not given",
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="summarize the whole history again",
+    )
+    args = parser.parse_args(argv)
+
+    report = roll_up_all(
+        args.account or account_ids(), args.workers, args.rebuild
+    )
+    print(
+        json.dumps(
+            {
+                "contas": report.accounts,
+                "registros": report.records,
+                "adiadas": report.postponed,
+                "erros": report.errors,
+                "segundos": report.seconds,
+            },
+            indent=2,
+        )
+    )
+    return 1 if report.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,24 @@
+import csv
+import datetime as dt
 import decimal as d
+import io
+import json
 from http import HTTPStatus
 
 import marshmallow as ma
 from flask import abort, jsonify, make_response
 
+from src.account.core.iterators import chunked
+from src.account.core.pagination import (
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+)
+
+transactions_page_size = 25
+transactions_max_page_size = 100
+batch_balance_max_accounts = 500
+
 
 class CreatePersonSchema(ma.Schema):
     class Meta:
@@ -52,6 +67,15 @@ class BalanceResponse(ma.Schema):
     withdraw_available = ma.fields.Number(data_key="limiteSaqueDisponivel")
 
 
+class BatchBalanceSchema(ma.Schema):
+    account_ids = ma.fields.List(
+        ma.fields.Str(validate=ma.validate.Length(min=1)),
+        data_key="idsConta",
+        required=True,
+        validate=ma.validate.Length(1, batch_balance_max_accounts),
+    )
+
+
 class BlockAccountSchema(ma.Schema):
     block = ma.fields.Bool(required=True, data_key="bloquear")
 
@@ -65,10 +89,28 @@ class WithdrawSchema(ma.Schema):
         return data
 
 
+class Cursor(ma.fields.Field):
+    """Signed and opaque `LastEvaluatedKey` of a query"""
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        return encode_cursor(value) if value else None
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        try:
+            return decode_cursor(value)
+        except InvalidCursor as error:
+            raise ma.ValidationError("Invalid cursor") from error
+
+
 class ListTransactionQuerySchema(ma.Schema):
     begin_date = ma.fields.DateTime(data_key="begin-date")
     end_date = ma.fields.DateTime(data_key="end-date")
-    next_cursor = ma.fields.Str(data_key="next-page-cursor")
+    next_cursor = Cursor(data_key="next-page-cursor")
+    page_size = ma.fields.Integer(
+        data_key="page-size",
+        load_default=transactions_page_size,
+        validate=ma.validate.Range(1, transactions_max_page_size),
+    )
 
 
 class TransactionItemResponseSchema(ma.Schema):
@@ -78,10 +120,173 @@ class TransactionItemResponseSchema(ma.Schema):
     created_at = ma.fields.Str(data_key="dataTransacao")
 
 
+class BackfillTransactionSchema(TransactionItemResponseSchema):
+    class Meta:
+        unknown = ma.EXCLUDE
+
+    id = ma.fields.Str(data_key="idTransacao")
+    account_id = ma.fields.Str(data_key="idConta", required=True)
+    value = ma.fields.Decimal(data_key="valor", required=True)
+    created_at = ma.fields.AwareDateTime(
+        data_key="dataTransacao",
+        required=True,
+        default_timezone=dt.timezone.utc,
+    )
+
+
+class BackfillReportSchema(ma.Schema):
+    rows = ma.fields.Int(data_key="linhas")
+    written = ma.fields.Int(data_key="gravadas")
+    errors = ma.fields.List(ma.fields.Dict(), data_key="erros")
+    seconds = ma.fields.Float(data_key="segundos")
+    rows_per_second = ma.fields.Float(data_key="linhasPorSegundo")
+
+
 class ListTransactionsResponseSchema(ma.Schema):
     items = ma.fields.List(
         ma.fields.Nested(TransactionItemResponseSchema),
         attribute="Items",
     )
-    next_cursor = ma.fields.Str(data_key="nextCursor",
-                                attribute="LastEvaluatedKey")
+    next_cursor = Cursor(data_key="nextCursor", attribute="LastEvaluatedKey")
+
+
+def _field_converter(field: ma.fields.Field):
+    if type(field) in (ma.fields.Number, ma.fields.Float, ma.fields.Integer):
+        if field.as_string:
+            raise TypeError(f"{field} as string is not supported")
+        num_type = field.num_type
+        return lambda value: None if value is None else num_type(value)
+    if type(field) is ma.fields.String:
+        return lambda value: None if value is None else str(value)
+    raise TypeError(f"{type(field).__name__} is not supported")
+
+
+def compile_dump(schema: ma.Schema):
+    """
+    Function returning the same as `schema.dump(item)` for a flat schema of
+    strings and numbers, without the marshmallow machinery per field
+    """
+    plan = []
+    for name, field in schema.dump_fields.items():
+        attribute = field.attribute or name
+        if "." in attribute:
+            raise TypeError(f"nested attribute {attribute} is not supported")
+        key = field.data_key or name
+        plan.append((attribute, key, _field_converter(field)))
+
+    def dump(item: dict):
+        dumped = {}
+        for attribute, key, convert in plan:
+            value = item.get(attribute, ma.missing)
+            if value is not ma.missing:
+                dumped[key] = convert(value)
+        return dumped
+
+    return dump
+
+
+# built once, the schemas are only used to dump
+balance_response = BalanceResponse()
+dump_transaction = compile_dump(TransactionItemResponseSchema())
+backfill_report = BackfillReportSchema()
+
+# the request schemas keep no state between loads, so the instances are
+# shared by every request (building a schema copies all its fields)
+create_person = CreatePersonSchema()
+create_account = CreateAccountSchema()
+deposit = DepositSchema()
+block_account = BlockAccountSchema()
+withdraw = WithdrawSchema()
+batch_balance = BatchBalanceSchema()
+
+
+def dump_transactions_page(resp: dict):
+    """Same as `ListTransactionsResponseSchema().dump(resp)`"""
+    page = {}
+    if "Items" in resp:
+        items = resp["Items"]
+        page["items"] = (
+            None if items is None else [dump_transaction(i) for i in items]
+        )
+    if "LastEvaluatedKey" in resp:
+        last_evaluated_key = resp["LastEvaluatedKey"]
+        page["nextCursor"] = (
+            encode_cursor(last_evaluated_key) if last_evaluated_key else None
+        )
+    return page
+
+
+class ExportTransactionQuerySchema(ma.Schema):
+    begin_date = ma.fields.DateTime(data_key="begin-date")
+    end_date = ma.fields.DateTime(data_key="end-date")
+    export_format = ma.fields.Str(
+        data_key="format",
+        load_default="ndjson",
+        validate=ma.validate.OneOf(["ndjson", "csv"]),
+    )
+
+
+class StatementQuerySchema(ma.Schema):
+    begin_date = ma.fields.Date(data_key="begin-date", required=True)
+    end_date = ma.fields.Date(
+        data_key="end-date",
+        load_default=lambda: dt.datetime.now(dt.timezone.utc).date(),
+    )
+    period = ma.fields.Str(
+        load_default="day", validate=ma.validate.OneOf(["day", "month"])
+    )
+
+    @ma.validates_schema
+    def validate_range(self, data, **_):
+        if data["begin_date"] > data["end_date"]:
+            raise ma.ValidationError(
+                "begin-date must not be after end-date", "begin-date"
+            )
+
+
+class StatementPeriodSchema(ma.Schema):
+    period = ma.fields.Str(data_key="periodo")
+    deposits = ma.fields.Number(data_key="depositos")
+    withdrawals = ma.fields.Number(data_key="saques")
+    count = ma.fields.Int(data_key="quantidade")
+    closing_balance = ma.fields.Number(data_key="saldoFinal")
+
+
+class StatementResponseSchema(ma.Schema):
+    opening_balance = ma.fields.Number(data_key="saldoInicial")
+    periods = ma.fields.List(
+        ma.fields.Nested(StatementPeriodSchema), data_key="periodos"
+    )
+
+
+statement_response = StatementResponseSchema()
+
+
+export_mimetypes = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+export_chunk_size = 100
+
+
+def export_ndjson(items, chunk_size: int = export_chunk_size):
+    for chunk in chunked(items, chunk_size):
+        yield "".join(
+            json.dumps(dump_transaction(item), separators=(",", ":")) + "\n"
+            for item in chunk
+        )
+
+
+def export_csv(items, chunk_size: int = export_chunk_size):
+    schema = TransactionItemResponseSchema()
+    columns = [field.data_key for field in schema.fields.values()]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for chunk in chunked(items, chunk_size):
+        writer.writerows(dump_transaction(item) for item in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+exporters = {"ndjson": export_ndjson, "csv": export_csv}
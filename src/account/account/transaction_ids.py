@@ -0,0 +1,263 @@
+"""
+Migration of the transactions with random (uuid4) ids to time ordered ones
+(see `core.ulid`), so the account transactions are read by date from the
+base table instead of the `transaction_date_index`:
+
+    python -m src.account.account.transaction_ids [--account ID ...]
+
+Each transaction is written again with the id made from its `created_at`
+(the old one stays in `legacy_id`) and the old item is deleted in the same
+transaction, with the idempotency record that points to it (so a replayed
+request gets the new location). The ids that look like ULIDs but are not of
+the transaction time are replaced too. The new id is always the same for
+the same transaction, so a migration that stopped in the middle just runs
+again. When an account has
+no old id left it's flagged (`Account.ordered_ids_attribute`) and starts
+being read from the base table.
+"""
+import argparse
+import datetime as dt
+import json
+import sys
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import botocore.exceptions
+from boto3.dynamodb.conditions import Attr, Key
+
+from src.account.account import models
+from src.account.account.rollup import account_ids
+from src.account.core import ulid
+from src.account.core.aws import retry
+from src.account.core.aws.dynamodb import DynamoResource
+from src.account.core.jobs import JobReport, run_in_workers
+
+
+@dataclass
+class MigrationReport(JobReport):
+    accounts: int = 0
+    migrated: int = 0
+    transactions: int = 0
+
+    job = "Transaction ids migration"
+
+
+def new_item(item: dict):
+    """The transaction with the ordered id of its creation date"""
+    transaction_id = item[models.Transaction.sort_key]
+    created_at = dt.datetime.fromisoformat(item["created_at"])
+    return {
+        **item,
+        models.Transaction.sort_key: ulid.derived(created_at, transaction_id),
+        "legacy_id": transaction_id,
+    }
+
+
+def legacy_items(account_id: str):
+    dynamodb_resource = DynamoResource()
+    table = dynamodb_resource.table_resource(models.Transaction.table_name)
+    items = models.Transaction.paginated_query(
+        table,
+        Key(models.Transaction.hash_key).eq(account_id),
+        None,
+        ConsistentRead=True,
+    )
+    for item in items:
+        created_at = dt.datetime.fromisoformat(item["created_at"])
+        if not ulid.is_ulid_of(item[models.Transaction.sort_key], created_at):
+            yield item
+
+
+def idempotency_records(account_id: Optional[str] = None):
+    """
+    Keys of the idempotency records by account and transaction id, of one
+    account or of all of them. The records only live for a day, the table
+    is small
+    """
+    idempotency = models.Idempotency
+    dynamodb_resource = DynamoResource()
+    table = dynamodb_resource.table_resource(idempotency.table_name)
+    kwargs = dynamodb_resource.projection_kwargs(
+        [idempotency.hash_key, "transaction_id"]
+    )
+    if account_id:
+        kwargs["FilterExpression"] = Attr(idempotency.hash_key).begins_with(
+            f"{account_id}#"
+        )
+    records = {}
+    while True:
+        resp = table.scan(**kwargs)
+        for record in resp["Items"]:
+            if "transaction_id" not in record:
+                continue
+            record_account = record[idempotency.hash_key].split("#", 1)[0]
+            records.setdefault(record_account, {})[
+                record["transaction_id"]
+            ] = record[idempotency.hash_key]
+        if "LastEvaluatedKey" not in resp:
+            return records
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def idempotency_update(record_key: str, item: dict, new_id: str):
+    """The idempotency record points to the new id, if it still points to
+    the old one"""
+    account_id = item[models.Transaction.hash_key]
+    return {
+        "TableName": models.Idempotency.table_name,
+        "Key": {models.Idempotency.hash_key: record_key},
+        "UpdateExpression": "SET #id = :new_id, #location = :location",
+        "ConditionExpression": "#id = :old_id",
+        "ExpressionAttributeNames": {
+            "#id": "transaction_id",
+            "#location": "content_location",
+        },
+        "ExpressionAttributeValues": {
+            ":new_id": new_id,
+            ":old_id": item[models.Transaction.sort_key],
+            ":location": models.Transaction.location(account_id, new_id),
+        },
+    }
+
+
+def replace(item: dict, record_key: Optional[str] = None):
+    """Writes the new item and deletes the old one, updating the
+    idempotency record `record_key`. False when another migration already
+    did it"""
+    transaction = models.Transaction
+    names = {"#id": transaction.sort_key}
+    replacement = new_item(item)
+    items = [
+        {"Put": transaction.put_item(replacement)},
+        {
+            "Delete": {
+                "TableName": transaction.table_name,
+                "Key": {
+                    transaction.hash_key: item[transaction.hash_key],
+                    transaction.sort_key: item[transaction.sort_key],
+                },
+                "ConditionExpression": "attribute_exists(#id)",
+                "ExpressionAttributeNames": names,
+            }
+        },
+    ]
+    if record_key:
+        items.append(
+            {
+                "Update": idempotency_update(
+                    record_key, item, replacement[transaction.sort_key]
+                )
+            }
+        )
+    dynamodb_resource = DynamoResource()
+    try:
+        dynamodb_resource.transact_write_items(items)
+        return True
+    except botocore.exceptions.ClientError as error:
+        # by position: the put, the delete and the idempotency record
+        reasons = retry.cancellation_reasons(error)
+        if "ConditionalCheckFailed" in reasons[:2]:
+            return False
+        if reasons[2:] == ["ConditionalCheckFailed"]:
+            # the record expired or was used again meanwhile
+            return replace(item)
+        dynamodb_resource.handle_error(error)
+
+
+def migrate(
+    account_id: str, records: Optional[dict] = None, recheck: bool = False
+):
+    """
+    Replaces the old ids of the account transactions and flags it. Returns
+    how many were replaced, None when the account doesn't exist. `records`
+    has the keys of the idempotency records by transaction id (see
+    `idempotency_records`), read when not given. With `recheck` the flagged
+    accounts are read again (for the ids backfilled while any ULID was
+    kept)
+    """
+    account = models.Account.find_one_by_id(account_id, consistent_read=True)
+    if not account:
+        return None
+    if account.get(models.Account.ordered_ids_attribute) and not recheck:
+        return 0
+    if records is None:
+        records = idempotency_records(account_id).get(account_id, {})
+    replaced = sum(
+        replace(item, records.get(item[models.Transaction.sort_key]))
+        for item in legacy_items(account_id)
+    )
+    models.Account.mark_ordered_ids(account_id)
+    return replaced
+
+
+def migrate_all(
+    accounts: Iterable[str], workers: int = 4, recheck: bool = False
+):
+    report = MigrationReport()
+    started_at = time.perf_counter()
+    # the new transactions have ordered ids, the records of the old ones
+    # are all there already
+    records = idempotency_records()
+
+    def migrated(_, replaced: Optional[int]):
+        report.accounts += 1
+        if replaced is not None:
+            report.migrated += 1
+            report.transactions += replaced
+
+    def failed(account_id: str, error: Exception):
+        report.add_error({"conta": account_id, "erro": repr(error)})
+
+    run_in_workers(
+        lambda account_id: migrate(
+            account_id, records.get(account_id, {}), recheck
+        ),
+        accounts,
+        workers,
+        failed,
+        migrated,
+    )
+
+    report.seconds = time.perf_counter() - started_at
+    return report
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--account",
+        action="append",
+        help="account to migrate, every account when not given",
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--recheck",
+        action="store_true",
+        help="also read the accounts already flagged",
+    )
+    args = parser.parse_args(argv)
+
+    report = migrate_all(
+        args.account or account_ids(), args.workers, args.recheck
+    )
+    print(
+        json.dumps(
+            {
+                "contas": report.accounts,
+                "migradas": report.migrated,
+                "transacoes": report.transactions,
+                "erros": report.errors,
+                "segundos": report.seconds,
+            },
+            indent=2,
+        )
+    )
+    return 1 if report.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,41 @@
 import datetime as dt
-import decimal as d
 import functools
+import itertools
 import logging
 from http import HTTPStatus
 
-from flask import Blueprint, abort, jsonify, make_response, request
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    g,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+)
+from werkzeug.http import quote_etag
 
-from src.account.account import serializers as ser, models
+from src.account.account import backfill, models
+from src.account.account import serializers as ser
+from src.account.core import concurrency
 from src.account.core.decorators import json_consumer, query_to_json
+from src.account.core.iterators import chunked
 
 bp = Blueprint("account", __name__)
 
+# ids per BatchGetItem call (the dynamodb limit)
+batch_get_chunk_size = 100
+
 
 @bp.route("", methods=["POST"])
 @json_consumer
 def create_account():
-    parsed_data = ser.CreateAccountSchema().loads(request.data)
+    parsed_data = ser.create_account.loads(request.data)
     create_person = not parsed_data.get("person_id")
     if create_person:
-        person_data = ser.CreatePersonSchema().loads(request.data)
+        person_data = ser.create_person.loads(request.data)
         parsed_data["person_id"] = models.Person.add(**person_data)
 
     try:
@@ -41,16 +58,29 @@ def create_account():
         )
 
 
-def get_account_id(path_key):
+@bp.route("/transactions/backfill", methods=["POST"])
+def backfill_transactions():
+    """Bulk insert of historical transactions, one json per line"""
+    if "application/x-ndjson" not in request.headers.get("Content-Type", ""):
+        return {
+            "error": "content-type must be application/x-ndjson"
+        }, HTTPStatus.BAD_REQUEST
+    report = backfill.backfill(request.stream)
+    return ser.backfill_report.dump(report), HTTPStatus.OK
+
+
+def get_account_id(path_key, consistent_read=False):
+    """`consistent_read` skips the account cache, needed when the balance
+    is used"""
+
     def real_valid_path_decorator(fn):
         @functools.wraps(fn)
         def real_valid_path_inner(**kwargs):
-            account = models.Account.find_one_by_id(kwargs[path_key])
+            account = models.Account.find_one_by_id(
+                kwargs[path_key], consistent_read=consistent_read
+            )
             if not account:
-                return (
-                    {"error": "Account not found"},
-                    HTTPStatus.NOT_FOUND,
-                )
+                return account_not_found()
             kwargs["account"] = account
             return fn(**kwargs)
 
@@ -59,6 +89,10 @@ def get_account_id(path_key):
     return real_valid_path_decorator
 
 
+def account_not_found():
+    return {"error": "Account not found"}, HTTPStatus.NOT_FOUND
+
+
 def abort_blocked(f):
     @functools.wraps(f)
     def decorated_function(account_id: str, account: dict):
@@ -69,12 +103,7 @@ def abort_blocked(f):
     return decorated_function
 
 
-def register_new_transaction(
-    account_id: str, transaction_date: dt.datetime, value: d.Decimal
-):
-    transaction_id = models.Transaction.add(
-        account_id, value, transaction_date
-    )
+def register_new_transaction(account_id: str, transaction_id: str):
     return (
         "",
         HTTPStatus.CREATED,
@@ -86,33 +115,209 @@ def register_new_transaction(
     )
 
 
+idempotency_key_max_length = 255
+
+
+def replay_idempotent(saved: dict, record: dict):
+    if saved.get("fingerprint") != record["fingerprint"]:
+        return {
+            "error": "Idempotency-Key already used with another request"
+        }, HTTPStatus.UNPROCESSABLE_ENTITY
+    if "status" not in saved:
+        return {
+            "error": "Request with this Idempotency-Key is being processed"
+        }, HTTPStatus.CONFLICT
+    return (
+        "",
+        int(saved["status"]),
+        {
+            "Content-Location": saved["content_location"],
+            "Idempotent-Replayed": "true",
+        },
+    )
+
+
+def idempotent(operation: str):
+    """
+    With an `Idempotency-Key` header the operation runs once per account and
+    key, the retries get the first result back without touching the
+    balance. The record for the model is left in `g.idempotency`
+    """
+
+    def idempotent_decorator(fn):
+        @functools.wraps(fn)
+        def idempotent_inner(**kwargs):
+            key = request.headers.get("Idempotency-Key")
+            if key is None:
+                return fn(**kwargs)
+            if not key or len(key) > idempotency_key_max_length:
+                return {
+                    "error": "Idempotency-Key must have 1 to "
+                    f"{idempotency_key_max_length} characters"
+                }, HTTPStatus.BAD_REQUEST
+            record = models.Idempotency.new_item(
+                kwargs["account_id"], operation, key, request.get_data()
+            )
+            # the prechecks of the view could fail on a replay (the balance
+            # may be gone), so the saved result is looked up first
+            saved = models.Idempotency.find(record["key"])
+            if saved and not models.Idempotency.is_expired(saved):
+                return replay_idempotent(saved, record)
+            g.idempotency = record
+            try:
+                return fn(**kwargs)
+            except models.DuplicateRequest as duplicate:
+                # a concurrent request with the same key won
+                return replay_idempotent(duplicate.record, record)
+
+        return idempotent_inner
+
+    return idempotent_decorator
+
+
 @bp.route("/<string:account_id>/deposit", methods=["POST"])
+@idempotent("deposit")
 @get_account_id(
     "account_id"
 )  # not ideal but only notice this flaw sunday and was already too late
 @abort_blocked
 @json_consumer
 def deposito_em_conta(account_id: str, account: dict):
-    deposit_value = ser.DepositSchema().loads(request.data)
-    transaction_date = models.Account.deposit_into(
-        account_id, deposit_value["value"]
-    )
-    return register_new_transaction(
-        account_id, transaction_date, deposit_value["value"]
+    deposit_value = ser.deposit.loads(request.data)
+    transaction_id = models.Account.deposit_into(
+        account_id, deposit_value["value"], g.get("idempotency")
     )
+    return register_new_transaction(account_id, transaction_id)
+
+
+# the responses also come from eventually consistent reads (the transaction
+# index and the daily totals) that may miss a change made right now, so
+# they only get an etag once the last change of the account settled
+etag_settle_seconds = 1
+
+
+def account_etag(version, *parts):
+    return "-".join(str(part) for part in (int(version), *parts))
+
+
+def response_etag(account: dict, *parts):
+    """Etag of a response built from `account`, None if it's too recent"""
+    updated_at = account.get("updated_at")
+    if updated_at:
+        age = dt.datetime.now(dt.timezone.utc) - dt.datetime.fromisoformat(
+            updated_at
+        )
+        if age.total_seconds() < etag_settle_seconds:
+            return None
+    return account_etag(account.get("version", 0), *parts)
+
+
+def etag_headers(etag):
+    return {"ETag": quote_etag(etag)} if etag else {}
+
+
+def utc_today():
+    return dt.datetime.now(dt.timezone.utc).date().isoformat()
+
+
+def not_modified(etag_parts=tuple):
+    """
+    Answers 304 when `If-None-Match` has the current etag of the account,
+    reading only its version. `etag_parts` gives the rest of the etag, what
+    changes the response without changing the account
+    """
+
+    def not_modified_decorator(fn):
+        @functools.wraps(fn)
+        def not_modified_inner(**kwargs):
+            if request.if_none_match:
+                version = models.Account.find_version(kwargs["account_id"])
+                etag = account_etag(version or 0, *etag_parts())
+                if version is not None and (
+                    request.if_none_match.contains_weak(etag)
+                ):
+                    return "", HTTPStatus.NOT_MODIFIED, etag_headers(etag)
+            return fn(**kwargs)
+
+        return not_modified_inner
+
+    return not_modified_decorator
 
 
 @bp.route("/<string:account_id>/balance", methods=["GET"])
-@get_account_id("account_id")
-def get_balance(account_id: str, account: dict):
-    withdrawn_today = models.Transaction.find_withdraw_limit_available(
-        account_id
+@not_modified(lambda: (utc_today(),))
+def get_balance(account_id: str):
+    # the withdraw available changes with the day
+    today = utc_today()
+    # the account and the daily total are independent, both are read at the
+    # same time
+    account, withdrawn_today = concurrency.gather(
+        functools.partial(
+            models.Account.find_one_by_id, account_id, consistent_read=True
+        ),
+        functools.partial(
+            models.Transaction.find_withdraw_limit_available, account_id
+        ),
+        timeout=current_app.config["FANOUT_TIMEOUT"],
+    )
+    if not account:
+        return account_not_found()
+    account["withdraw_available"] = withdraw_available(
+        account, withdrawn_today
     )
-    withdraw_available = account["daily_withdraw_limit"] - withdrawn_today
-    account["withdraw_available"] = (
-        withdraw_available if withdraw_available > 0 else 0
+    return (
+        ser.balance_response.dump(account),
+        HTTPStatus.OK,
+        etag_headers(response_etag(account, today)),
+    )
+
+
+def withdraw_available(account: dict, withdrawn_today):
+    available = account["daily_withdraw_limit"] - withdrawn_today
+    return available if available > 0 else 0
+
+
+@bp.route("/balances", methods=["POST"])
+@json_consumer
+def get_balances():
+    """Balance of many accounts, keyed by id"""
+    # BatchGetItem rejects repeated keys
+    account_ids = list(
+        dict.fromkeys(ser.batch_balance.loads(request.data)["account_ids"])
+    )
+    chunks = list(chunked(account_ids, batch_get_chunk_size))
+    # one BatchGetItem per chunk of accounts and of daily totals, all of
+    # them at the same time in the shared pool
+    results = concurrency.gather(
+        *(
+            functools.partial(
+                models.Account.find_many, chunk, consistent_read=True
+            )
+            for chunk in chunks
+        ),
+        *(
+            functools.partial(models.DailyWithdraw.find_totals, chunk)
+            for chunk in chunks
+        ),
+        timeout=current_app.config["FANOUT_TIMEOUT"],
     )
-    return ser.BalanceResponse().dump(account)
+    accounts, withdrawn = {}, {}
+    for found in results[:len(chunks)]:
+        accounts.update(found)
+    for totals in results[len(chunks):]:
+        withdrawn.update(totals)
+
+    balances = {}
+    for account_id in account_ids:
+        account = accounts.get(account_id)
+        if not account:
+            balances[account_id] = account_not_found()[0]
+            continue
+        account["withdraw_available"] = withdraw_available(
+            account, withdrawn[account_id]
+        )
+        balances[account_id] = ser.balance_response.dump(account)
+    return balances, HTTPStatus.OK
 
 
 @bp.route("/<string:account_id>/block", methods=["PATCH"])
@@ -120,17 +325,18 @@ def get_balance(account_id: str, account: dict):
 def block_account(account_id: str):
     """This endpoint does not use the `get_account_id` because it would make
     an unnecessary request to the database"""
-    payload = ser.BlockAccountSchema().loads(request.data)
+    payload = ser.block_account.loads(request.data)
     models.Account.block(account_id, payload["block"])
     return "", HTTPStatus.NO_CONTENT
 
 
 @bp.route("/<string:account_id>/withdraw", methods=["POST"])
-@get_account_id("account_id")
+@idempotent("withdraw")
+@get_account_id("account_id", consistent_read=True)
 @abort_blocked
 @json_consumer
 def withdraw(account_id: str, account: str):
-    withdraw_data = ser.WithdrawSchema().loads(request.data)
+    withdraw_data = ser.withdraw.loads(request.data)
 
     if account["balance"] < withdraw_data["value"]:
         return {
@@ -143,27 +349,64 @@ def withdraw(account_id: str, account: str):
         error_msg = f"{error_msg}. Limit reached."
         return {"error": error_msg}, HTTPStatus.FORBIDDEN
 
-    reached_limit = models.Transaction.find_withdraw_limit_available(
-        account_id
-    )
-    available_limit = daily_limit - reached_limit
-    if withdraw_data["value"] > available_limit:
-        available_msg = available_limit if available_limit > 0 else 0
-        error_msg = f"{error_msg}. Withdraw available is R$ {available_msg}"
-        return {"error": error_msg}, HTTPStatus.FORBIDDEN
-
-    transaction_date = models.Account.withdraw(
-        account_id, withdraw_data["value"]
-    )
-    return register_new_transaction(
-        account_id, transaction_date, withdraw_data["value"] * -1
+    # the limit already withdrawn today is checked inside the transaction
+    transaction_id = models.Account.withdraw(
+        account_id, withdraw_data["value"], daily_limit, g.get("idempotency")
     )
+    return register_new_transaction(account_id, transaction_id)
 
 
 @bp.route("<string:account_id>/transactions", methods=["GET"])
+@not_modified()
 @get_account_id("account_id")
 @query_to_json(ser.ListTransactionQuerySchema)
 def list_transactions(account_id, account, queries):
-    # TODO pagination untested
-    resp = models.Transaction.find_by_account_id(account_id, **queries)
-    return ser.ListTransactionsResponseSchema().dump(resp)
+    # the version is read before the transactions, a new one can only make
+    # the page newer than its etag
+    etag = response_etag(account)
+    resp = models.Transaction.find_by_account_id(
+        account_id,
+        ordered_ids=bool(account.get("ordered_transaction_ids")),
+        **queries,
+    )
+    return ser.dump_transactions_page(resp), HTTPStatus.OK, etag_headers(etag)
+
+
+@bp.route("<string:account_id>/transactions/export", methods=["GET"])
+@get_account_id("account_id")
+@query_to_json(ser.ExportTransactionQuerySchema)
+def export_transactions(account_id, account, queries):
+    export_format = queries.pop("export_format")
+    items = models.Transaction.export(
+        account_id,
+        ordered_ids=bool(account.get("ordered_transaction_ids")),
+        **queries,
+    )
+    chunks = ser.exporters[export_format](items)
+    # the first page is read before the response starts, so database errors
+    # still turn into a proper error status
+    first_chunk = next(chunks, "")
+    return Response(
+        stream_with_context(itertools.chain([first_chunk], chunks)),
+        mimetype=ser.export_mimetypes[export_format],
+        headers={
+            "Content-Disposition": (
+                f"attachment; filename={account_id}.{export_format}"
+            )
+        },
+    )
+
+
+@bp.route("<string:account_id>/statement", methods=["GET"])
+@get_account_id("account_id")
+@query_to_json(ser.StatementQuerySchema)
+def account_statement(account_id, account, queries):
+    statement = models.LedgerRollup.statement(
+        account_id,
+        queries["begin_date"],
+        queries["end_date"],
+        monthly=queries["period"] == "month",
+    )
+    if statement is None:
+        return account_not_found()
+    return ser.statement_response.dump(statement), HTTPStatus.OK
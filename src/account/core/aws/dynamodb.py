@@ -1,18 +1,148 @@
 import logging
 import os
+import threading
+import time
+import uuid
+from typing import Iterable, Optional
 
 import boto3
+import botocore.config
 import botocore.exceptions
 from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
 from flask import abort
 
+from src.account.core import metrics
+from src.account.core.aws import retry
+
+
+def _env_int(name: str, default: int):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+read_operations = {"get_item", "query", "scan", "batch_get_item"}
+
+
+def _record_capacity(consumed, kind: str):
+    if not consumed:
+        return
+    for capacity in consumed if isinstance(consumed, list) else [consumed]:
+        metrics.dynamodb_consumed_capacity.inc(
+            capacity.get("TableName", ""),
+            kind,
+            amount=capacity.get("CapacityUnits", 0),
+        )
+
+
+retry_policy = retry.RetryPolicy()
+
+
+def instrumented_call(
+    operation: str, table_name: str, call, index_name: str = "", **kwargs
+):
+    """
+    Calls dynamodb asking for the consumed capacity, the duration, errors
+    and capacity are recorded in the metrics. The retryable errors are
+    retried by `retry_policy` (`table_name` may list many tables separated
+    by commas)
+    """
+    kwargs.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+    def attempt():
+        timer = metrics.dynamodb_call_duration.time(
+            operation, table_name, index_name
+        )
+        try:
+            with timer:
+                resp = call(**kwargs)
+        except retry.attempt_errors as error:
+            metrics.dynamodb_errors.inc(
+                operation, table_name, retry.error_code(error)
+            )
+            raise
+        if isinstance(resp, dict):
+            kind = "read" if operation in read_operations else "write"
+            _record_capacity(resp.get("ConsumedCapacity"), kind)
+        return resp
+
+    def on_retry(error):
+        metrics.dynamodb_retries.inc(
+            operation, table_name, retry.error_code(error)
+        )
+
+    return retry_policy.run(table_name.split(","), attempt, on_retry)
+
+
+class InstrumentedTable:
+    """Table handle whose item operations go through `instrumented_call`"""
+
+    operations = {
+        "get_item",
+        "put_item",
+        "update_item",
+        "delete_item",
+        "query",
+        "scan",
+    }
+
+    def __init__(self, table_name: str, table):
+        self.name = table_name
+        self._table = table
+
+    def __getattr__(self, attr):
+        target = getattr(self._table, attr)
+        if attr not in self.operations:
+            return target
+
+        def call(**kwargs):
+            return instrumented_call(
+                attr,
+                self.name,
+                target,
+                index_name=kwargs.get("IndexName", ""),
+                **kwargs,
+            )
+
+        return call
+
+
+class DynamoRegistry:
+    """
+    Keeps one boto3 dynamodb resource for the whole process, built once. Its
+    client (and connection pool) is thread safe and shared by every thread,
+    so a thread per request reuses it. The resource itself is not, it only
+    builds the Table handles under the lock (each thread gets its own, they
+    are cheap and share the client) and calls the client in its actions.
+    """
 
-# TODO turn into a singleton to avoid unnecessary connection initialization
-class DynamoResource:
     def __init__(self):
-        localstack = os.environ["LOCALSTACK"]
-        kwargs = {}
-        if localstack:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = 0
+        self._resource = None
+
+    @classmethod
+    def client_config(cls):
+        return botocore.config.Config(
+            max_pool_connections=_env_int("DYNAMODB_MAX_POOL_CONNECTIONS", 10),
+            connect_timeout=_env_float("DYNAMODB_CONNECT_TIMEOUT", 1),
+            read_timeout=_env_float("DYNAMODB_READ_TIMEOUT", 3),
+            tcp_keepalive=os.environ.get("DYNAMODB_TCP_KEEPALIVE", "1") != "0",
+            # the retries, connection errors and timeouts included, are made
+            # by `retry_policy`
+            retries={"mode": "standard", "total_max_attempts": 1},
+        )
+
+    @classmethod
+    def resource_kwargs(cls):
+        kwargs = {"config": cls.client_config()}
+        if os.environ.get("LOCALSTACK"):
             kwargs.update(
                 {
                     "use_ssl": False,
@@ -20,7 +150,87 @@ class DynamoResource:
                     "endpoint_url": "http://localhost:4566",
                 }
             )
-        self.resource = boto3.resource("dynamodb", **kwargs)
+        return kwargs
+
+    @classmethod
+    def backend(cls):
+        return os.environ.get("DYNAMODB_BACKEND", "aws")
+
+    def _new_resource(self):
+        if self.backend() == "memory":
+            # imported only when used, it's not needed in the deployments
+            from src.account.core.aws import memory
+
+            # the in memory database is shared by every thread
+            return memory.shared_resource()
+        return boto3.resource("dynamodb", **self.resource_kwargs())
+
+    def resource(self):
+        resource = self._resource
+        if resource is None:
+            # the default boto3 session used to build it is shared between
+            # threads, so the creation must be serialized
+            with self._lock:
+                if self._resource is None:
+                    self._resource = self._new_resource()
+                resource = self._resource
+        return resource
+
+    def _tables(self):
+        state = getattr(self._local, "state", None)
+        if state is None or state["generation"] != self._generation:
+            state = {"generation": self._generation, "tables": {}}
+            self._local.state = state
+        return state["tables"]
+
+    def table(self, table_name: str):
+        tables = self._tables()
+        if table_name not in tables:
+            resource = self.resource()
+            with self._lock:
+                table = resource.Table(table_name)
+            tables[table_name] = InstrumentedTable(table_name, table)
+        return tables[table_name]
+
+    def warm(self, *table_names: str):
+        """Builds the shared resource ahead of the first request, loading
+        the service model and the client used by every thread"""
+        try:
+            for table_name in table_names:
+                self.table(table_name)
+        except botocore.exceptions.BotoCoreError as error:
+            logging.warning(f"Could not warm up the dynamodb client: {error}")
+
+    def clear(self):
+        """Drops the resource and the tables, they are recreated on the next
+        access"""
+        with self._lock:
+            self._resource = None
+            self._generation += 1
+
+
+registry = DynamoRegistry()
+
+
+class UnprocessedKeysError(Exception):
+    """Dynamodb kept returning unprocessed keys after every retry"""
+
+
+class UnprocessedItemsError(Exception):
+    """Dynamodb kept returning unprocessed items after every retry"""
+
+
+class DynamoResource:
+    _serializer = TypeSerializer()
+    _deserializer = TypeDeserializer()
+
+    batch_get_limit = 100
+    batch_write_limit = 25
+    batch_max_attempts = 5
+    batch_backoff_base = 0.05
+
+    def __init__(self):
+        self.resource = registry.resource()
 
     @classmethod
     def error_help_strings(cls, error_code):
@@ -60,6 +270,10 @@ class DynamoResource:
                 "The input fails to satisfy the constraints specified by"
                 " DynamoDB, fix input before retrying"
             ),
+            "TransactionCanceledException": (
+                "The transaction was canceled, verify the cancellation "
+                "reasons. Conflicts are generally safe to retry"
+            ),
             "RequestLimitExceeded": (
                 "Throughput exceeds the current throughput limit for "
                 "your account, increase account level throughput "
@@ -81,21 +295,174 @@ class DynamoResource:
                 error_message=error_message,
             )
         )
+        if retry.is_unavailable(error):
+            raise retry.DatabaseUnavailable() from error
         env_name = os.environ["FLASK_ENV"]
         if env_name == "development":
             raise error
         raise Exception()
 
     def table_resource(self, table_name):
-        return self.resource.Table(table_name)
+        return registry.table(table_name)
 
     def add(self, table_name: str, data: dict):
-        table = self.resource.Table(table_name)
+        table = self.table_resource(table_name)
         try:
             table.put_item(Item=data)
         except botocore.exceptions.ClientError as error:
             self.handle_error(error)
 
+    @classmethod
+    def serialize(cls, data: dict):
+        return {
+            key: cls._serializer.serialize(value)
+            for key, value in data.items()
+        }
+
+    @classmethod
+    def deserialize(cls, data: dict):
+        return {
+            key: cls._deserializer.deserialize(value)
+            for key, value in data.items()
+        }
+
+    def transact_write_items(self, items: list):
+        """
+        Writes all the items or none of them. The items are in the
+        `TransactItems` format, but with the keys, items and expression
+        values as plain python values like in the table resource.
+        Errors are raised to the caller, to inspect the cancellation reasons
+        """
+        transact_items = []
+        for transact_item in items:
+            ((operation, params),) = transact_item.items()
+            params = dict(params)
+            for attr in ("Key", "Item", "ExpressionAttributeValues"):
+                if attr in params:
+                    params[attr] = self.serialize(params[attr])
+            transact_items.append({operation: params})
+        table_names = sorted(
+            {params["TableName"] for item in items for params in item.values()}
+        )
+        return instrumented_call(
+            "transact_write_items",
+            ",".join(table_names),
+            self.resource.meta.client.transact_write_items,
+            TransactItems=transact_items,
+            # the same token on every retry, so a transaction that succeeded
+            # but whose response was lost is not written twice
+            ClientRequestToken=str(uuid.uuid4()),
+        )
+
+    @classmethod
+    def projection_kwargs(cls, projection: Optional[Iterable[str]]):
+        """ProjectionExpression with every attribute aliased, so reserved
+        words (like `value`) can be projected"""
+        if not projection:
+            return {}
+        names = {f"#p{i}": attr for i, attr in enumerate(projection)}
+        return {
+            "ProjectionExpression": ", ".join(names),
+            "ExpressionAttributeNames": names,
+        }
+
+    def get_item(
+        self,
+        table_name: str,
+        key: dict,
+        projection: Optional[Iterable[str]] = None,
+        consistent_read: bool = False,
+    ):
+        """Exact primary key lookup, returns the item or None"""
+        table = self.table_resource(table_name)
+        try:
+            resp = table.get_item(
+                Key=key,
+                ConsistentRead=consistent_read,
+                **self.projection_kwargs(projection),
+            )
+            return resp.get("Item")
+        except botocore.exceptions.ClientError as error:
+            self.handle_error(error)
+
+    def batch_get_item(
+        self,
+        table_name: str,
+        keys: list,
+        projection: Optional[Iterable[str]] = None,
+        consistent_read: bool = False,
+    ):
+        """
+        Exact primary key lookup of many items, in chunks of 100 keys (the
+        dynamodb limit). The unprocessed keys are retried with exponential
+        back-off. The items are returned in no particular order
+        """
+        items = []
+        request = {
+            "ConsistentRead": consistent_read,
+            **self.projection_kwargs(projection),
+        }
+        for start in range(0, len(keys), self.batch_get_limit):
+            pending = keys[start:start + self.batch_get_limit]
+            for attempt in range(self.batch_max_attempts):
+                try:
+                    resp = instrumented_call(
+                        "batch_get_item",
+                        table_name,
+                        self.resource.batch_get_item,
+                        RequestItems={
+                            table_name: {**request, "Keys": pending}
+                        },
+                    )
+                except botocore.exceptions.ClientError as error:
+                    self.handle_error(error)
+                    return
+                items.extend(resp["Responses"].get(table_name, []))
+                unprocessed = resp.get("UnprocessedKeys", {}).get(table_name)
+                if not unprocessed:
+                    break
+                pending = unprocessed["Keys"]
+                time.sleep(self.batch_backoff_base * 2**attempt)
+            else:
+                logging.error(
+                    f"[{table_name}] {len(pending)} keys still unprocessed "
+                    f"after {self.batch_max_attempts} attempts"
+                )
+                raise UnprocessedKeysError()
+        return items
+
+    def batch_write(self, table_name: str, items: list):
+        """
+        Puts the items in chunks of 25 (the dynamodb limit), retrying the
+        unprocessed items with exponential back-off
+        """
+        for start in range(0, len(items), self.batch_write_limit):
+            pending = [
+                {"PutRequest": {"Item": item}}
+                for item in items[start:start + self.batch_write_limit]
+            ]
+            for attempt in range(self.batch_max_attempts):
+                try:
+                    resp = instrumented_call(
+                        "batch_write_item",
+                        table_name,
+                        self.resource.batch_write_item,
+                        RequestItems={table_name: pending},
+                    )
+                except botocore.exceptions.ClientError as error:
+                    self.handle_error(error)
+                    return
+                pending = resp.get("UnprocessedItems", {}).get(table_name)
+                if not pending:
+                    break
+                time.sleep(self.batch_backoff_base * 2**attempt)
+            else:
+                logging.error(
+                    f"[{table_name}] {len(pending)} items still unprocessed "
+                    f"after {self.batch_max_attempts} attempts"
+                )
+                raise UnprocessedItemsError()
+
     def __handle_key_expression(self, keys_map: dict):
         hash_expression = Key(keys_map["hash_key"]).eq(keys_map["hash_value"])
         sort_key = keys_map.get("sort_key")
@@ -106,7 +473,7 @@ class DynamoResource:
         return keys_expression
 
     def find_by_id(self, table_name: str, keys: dict):
-        table = self.resource.Table(table_name)
+        table = self.table_resource(table_name)
 
         keys_expression = self.__handle_key_expression(keys)
         try:
@@ -127,7 +494,7 @@ class DynamoResource:
         expression_attr_name,
         expression_attr_value,
     ):
-        table = self.resource.Table(table_name)
+        table = self.table_resource(table_name)
         try:
             table.update_item(
                 Key=keys,
@@ -0,0 +1,1141 @@
+"""
+In process dynamodb, for tests and benchmarks without network.
+
+It implements the part of the boto3 dynamodb resource used by
+`DynamoResource` and the models (tables with hash/sort keys, global
+secondary indexes, condition and update expressions, batches and
+transactions), so selecting it with `DYNAMODB_BACKEND=memory` exercises the
+same code paths as the real database. The tables are created from the
+cloudformation template `Account_cf_template.json`.
+
+Each table and index keeps the sort keys of every partition in a sorted
+list, so queries are a bisect plus the page read.
+"""
+import bisect
+import copy
+import json
+import math
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Optional
+
+import botocore.exceptions
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+template_path = Path(__file__).parents[4] / "Account_cf_template.json"
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+class _Missing:
+    def __repr__(self):
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+def client_error(code: str, message: str, operation: str, **extra):
+    return botocore.exceptions.ClientError(
+        {"Error": {"Code": code, "Message": message}, **extra}, operation
+    )
+
+
+def validation_error(message: str, operation: str = "Expression"):
+    return client_error("ValidationException", message, operation)
+
+
+def _normalize(item: dict):
+    """Same conversions boto3 does (int to Decimal, float rejected...)"""
+    try:
+        return {
+            key: _deserializer.deserialize(_serializer.serialize(value))
+            for key, value in item.items()
+        }
+    except TypeError as error:
+        raise validation_error(str(error), "Serialize") from error
+
+
+def serialize(item: dict):
+    return {key: _serializer.serialize(value) for key, value in item.items()}
+
+
+def deserialize(item: dict):
+    return {
+        key: _deserializer.deserialize(value) for key, value in item.items()
+    }
+
+
+# ---------------------------------------------------------------- expressions
+
+_token_re = re.compile(
+    r"\s*(?:(?P<name>#\w+)|(?P<value>:\w+)|(?P<number>\d+)"
+    r"|(?P<ident>[A-Za-z_][\w-]*)|(?P<op><>|<=|>=|[=<>(),.\[\]+-]))"
+)
+
+_keywords = {"AND", "OR", "NOT", "BETWEEN", "IN", "SET", "ADD", "REMOVE"}
+_update_clauses = {"SET", "ADD", "REMOVE", "DELETE"}
+
+
+def _tokenize(expression: str):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _token_re.match(expression, position)
+        if not match or match.end() == position:
+            raise validation_error(
+                f"Invalid expression near: {expression[position:]}"
+            )
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "ident" and text.upper() in _keywords | _update_clauses:
+            kind, text = "keyword", text.upper()
+        tokens.append((kind, text))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression: str, names: dict, values: dict):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise validation_error("Unexpected end of expression")
+        self.position += 1
+        return token
+
+    def expect(self, text: str):
+        kind, token = self.next()
+        if token != text:
+            raise validation_error(f"Expected {text} got {token}")
+
+    def accept(self, text: str):
+        if self.peek()[1] == text:
+            self.position += 1
+            return True
+        return False
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    # paths and operands
+    def path(self):
+        kind, text = self.next()
+        if kind == "name":
+            if text not in self.names:
+                raise validation_error(f"Undefined attribute name {text}")
+            segments = [self.names[text]]
+        elif kind == "ident":
+            segments = [text]
+        else:
+            raise validation_error(f"Invalid attribute path {text}")
+        while True:
+            if self.accept("."):
+                kind, text = self.next()
+                if kind == "name":
+                    segments.append(self.names[text])
+                else:
+                    segments.append(text)
+            elif self.accept("["):
+                kind, text = self.next()
+                if kind != "number":
+                    raise validation_error("Invalid list index")
+                segments.append(int(text))
+                self.expect("]")
+            else:
+                return ("path", tuple(segments))
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == "value":
+            self.next()
+            if text not in self.values:
+                raise validation_error(f"Undefined attribute value {text}")
+            return ("value", self.values[text])
+        if kind == "ident" and self.peek(1)[1] == "(":
+            self.next()
+            self.expect("(")
+            args = [self.update_value()]
+            while self.accept(","):
+                args.append(self.update_value())
+            self.expect(")")
+            return ("function", text, args)
+        return self.path()
+
+    # conditions
+    def condition(self):
+        node = self.and_condition()
+        while self.accept("OR"):
+            node = ("or", node, self.and_condition())
+        return node
+
+    def and_condition(self):
+        node = self.not_condition()
+        while self.accept("AND"):
+            node = ("and", node, self.not_condition())
+        return node
+
+    def not_condition(self):
+        if self.accept("NOT"):
+            return ("not", self.not_condition())
+        return self.primary_condition()
+
+    def primary_condition(self):
+        if self.accept("("):
+            node = self.condition()
+            self.expect(")")
+            return node
+        left = self.operand()
+        if left[0] == "function" and self.peek()[0] != "op":
+            return left
+        kind, text = self.peek()
+        if text in ("=", "<>", "<", "<=", ">", ">="):
+            self.next()
+            return ("compare", text, left, self.operand())
+        if text == "BETWEEN":
+            self.next()
+            low = self.operand()
+            self.expect("AND")
+            return ("between", left, low, self.operand())
+        if text == "IN":
+            self.next()
+            self.expect("(")
+            options = [self.operand()]
+            while self.accept(","):
+                options.append(self.operand())
+            self.expect(")")
+            return ("in", left, options)
+        if left[0] == "function":
+            return left
+        raise validation_error(f"Invalid condition near {text}")
+
+    # updates
+    def update_value(self):
+        node = self.operand()
+        kind, text = self.peek()
+        if text in ("+", "-"):
+            self.next()
+            return ("arith", text, node, self.operand())
+        return node
+
+    def update(self):
+        actions = []
+        while not self.done():
+            kind, clause = self.next()
+            if clause not in _update_clauses:
+                raise validation_error(f"Invalid update clause {clause}")
+            while True:
+                path = self.path()
+                if clause == "SET":
+                    self.expect("=")
+                    actions.append(("SET", path, self.update_value()))
+                elif clause == "REMOVE":
+                    actions.append(("REMOVE", path, None))
+                else:
+                    actions.append((clause, path, self.operand()))
+                if not self.accept(","):
+                    break
+        return actions
+
+
+def _resolve(item: dict, segments: tuple):
+    value = item
+    for segment in segments:
+        if isinstance(segment, int):
+            if not isinstance(value, list) or segment >= len(value):
+                return MISSING
+        elif not isinstance(value, dict) or segment not in value:
+            return MISSING
+        value = value[segment]
+    return value
+
+
+def _type_of(value):
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, (int, float)) or type(value).__name__ == "Decimal":
+        return "N"
+    if isinstance(value, str):
+        return "S"
+    if isinstance(value, (bytes, bytearray)):
+        return "B"
+    if value is None:
+        return "NULL"
+    if isinstance(value, dict):
+        return "M"
+    if isinstance(value, list):
+        return "L"
+    if isinstance(value, set):
+        return "SS"
+    return type(value).__name__
+
+
+def _compare(operator: str, left, right):
+    if left is MISSING or right is MISSING:
+        return False
+    if _type_of(left) != _type_of(right):
+        return operator == "<>"
+    if operator == "=":
+        return left == right
+    if operator == "<>":
+        return left != right
+    if _type_of(left) not in ("N", "S", "B"):
+        return False
+    return {
+        "<": left < right,
+        "<=": left <= right,
+        ">": left > right,
+        ">=": left >= right,
+    }[operator]
+
+
+def _evaluate(node, item: dict):
+    kind = node[0]
+    if kind == "path":
+        return _resolve(item, node[1])
+    if kind == "value":
+        return node[1]
+    if kind == "and":
+        return _evaluate(node[1], item) and _evaluate(node[2], item)
+    if kind == "or":
+        return _evaluate(node[1], item) or _evaluate(node[2], item)
+    if kind == "not":
+        return not _evaluate(node[1], item)
+    if kind == "compare":
+        return _compare(
+            node[1], _evaluate(node[2], item), _evaluate(node[3], item)
+        )
+    if kind == "between":
+        value = _evaluate(node[1], item)
+        return _compare(">=", value, _evaluate(node[2], item)) and _compare(
+            "<=", value, _evaluate(node[3], item)
+        )
+    if kind == "in":
+        value = _evaluate(node[1], item)
+        return any(
+            _compare("=", value, _evaluate(option, item))
+            for option in node[2]
+        )
+    if kind == "arith":
+        left = _evaluate(node[2], item)
+        right = _evaluate(node[3], item)
+        if _type_of(left) != "N" or _type_of(right) != "N":
+            raise validation_error(
+                "An operand in the update expression has an incorrect type"
+            )
+        return left + right if node[1] == "+" else left - right
+    if kind == "function":
+        return _function(node[1], node[2], item)
+    raise validation_error(f"Invalid expression node {kind}")
+
+
+def _function(name: str, args: list, item: dict):
+    if name == "attribute_exists":
+        return _evaluate(args[0], item) is not MISSING
+    if name == "attribute_not_exists":
+        return _evaluate(args[0], item) is MISSING
+    if name == "begins_with":
+        value = _evaluate(args[0], item)
+        prefix = _evaluate(args[1], item)
+        return (
+            isinstance(value, (str, bytes))
+            and _type_of(value) == _type_of(prefix)
+            and value.startswith(prefix)
+        )
+    if name == "contains":
+        value = _evaluate(args[0], item)
+        operand = _evaluate(args[1], item)
+        if isinstance(value, (str, list, set)):
+            return operand in value
+        return False
+    if name == "attribute_type":
+        return _type_of(_evaluate(args[0], item)) == _evaluate(args[1], item)
+    if name == "size":
+        value = _evaluate(args[0], item)
+        return MISSING if value is MISSING else len(value)
+    if name == "if_not_exists":
+        value = _evaluate(args[0], item)
+        return _evaluate(args[1], item) if value is MISSING else value
+    if name == "list_append":
+        return list(_evaluate(args[0], item)) + list(_evaluate(args[1], item))
+    raise validation_error(f"Invalid function name {name}")
+
+
+def parse_condition(expression, names: Optional[dict], values: Optional[dict]):
+    """Condition AST of a string or boto3 `Key`/`Attr` condition"""
+    names = dict(names or {})
+    values = dict(values or {})
+    if isinstance(expression, ConditionBase):
+        built = ConditionExpressionBuilder().build_expression(
+            expression, is_key_condition=False
+        )
+        expression = built.condition_expression
+        names.update(built.attribute_name_placeholders)
+        values.update(built.attribute_value_placeholders)
+    parser = _Parser(expression, names, values)
+    node = parser.condition()
+    if not parser.done():
+        raise validation_error(f"Invalid condition {expression}")
+    return node
+
+
+def _set_path(item: dict, segments: tuple, value):
+    target = item
+    for segment in segments[:-1]:
+        target = target[segment]
+    target[segments[-1]] = value
+
+
+def _remove_path(item: dict, segments: tuple):
+    target = _resolve(item, segments[:-1]) if len(segments) > 1 else item
+    if target is not MISSING:
+        try:
+            del target[segments[-1]]
+        except (KeyError, IndexError):
+            pass
+
+
+def apply_update(item: dict, expression: str, names, values):
+    actions = _Parser(expression, names, values).update()
+    # every operand is read from the item before the update
+    original = copy.deepcopy(item)
+    for clause, (_, segments), operand in actions:
+        if clause == "SET":
+            _set_path(item, segments, _evaluate(operand, original))
+        elif clause == "REMOVE":
+            _remove_path(item, segments)
+        elif clause == "ADD":
+            current = _resolve(original, segments)
+            value = _evaluate(operand, original)
+            if current is MISSING:
+                _set_path(item, segments, value)
+            elif isinstance(current, set):
+                _set_path(item, segments, current | value)
+            elif _type_of(current) == "N" and _type_of(value) == "N":
+                _set_path(item, segments, current + value)
+            else:
+                raise validation_error(
+                    "An operand in the update expression has an incorrect "
+                    "data type"
+                )
+        elif clause == "DELETE":
+            current = _resolve(original, segments)
+            if isinstance(current, set):
+                remaining = current - _evaluate(operand, original)
+                if remaining:
+                    _set_path(item, segments, remaining)
+                else:
+                    _remove_path(item, segments)
+    return item
+
+
+def project(item: dict, projection: Optional[str], names: Optional[dict]):
+    if not projection:
+        return copy.deepcopy(item)
+    names = names or {}
+    projected = {}
+    for attribute in projection.split(","):
+        attribute = attribute.strip()
+        attribute = names.get(attribute, attribute)
+        if attribute in item:
+            projected[attribute] = copy.deepcopy(item[attribute])
+    return projected
+
+
+# ---------------------------------------------------------------- capacity
+
+
+def item_size(item: Optional[dict]):
+    """Rough size of the item in bytes, enough to estimate the capacity"""
+    return len(json.dumps(item, default=str)) if item else 0
+
+
+def capacity_units(size: int, kind: str, consistent: bool = False):
+    """Capacity units the way dynamodb charges, 1KB writes and 4KB reads
+    (half for eventually consistent reads)"""
+    if kind == "write":
+        return float(max(math.ceil(size / 1024), 1))
+    units = max(math.ceil(size / 4096), 1)
+    return float(units if consistent else units / 2)
+
+
+def with_capacity(result: dict, params: dict, table_name: str, units):
+    if params.get("ReturnConsumedCapacity", "NONE") != "NONE":
+        result["ConsumedCapacity"] = {
+            "TableName": table_name,
+            "CapacityUnits": units,
+        }
+    return result
+
+
+def _capacity_list(params: dict, units_by_table: dict):
+    if params.get("ReturnConsumedCapacity", "NONE") == "NONE":
+        return {}
+    return {
+        "ConsumedCapacity": [
+            {"TableName": name, "CapacityUnits": units}
+            for name, units in units_by_table.items()
+        ]
+    }
+
+
+# ---------------------------------------------------------------- storage
+
+
+class _SortedIndex:
+    """hash value -> sorted list of (sort value, primary key)"""
+
+    def __init__(self, hash_key: str, sort_key: Optional[str]):
+        self.hash_key = hash_key
+        self.sort_key = sort_key
+        self.partitions = {}
+
+    def entry(self, item: dict, primary_key: tuple):
+        if self.hash_key not in item:
+            return None
+        if self.sort_key and self.sort_key not in item:
+            return None
+        sort_value = item[self.sort_key] if self.sort_key else ""
+        return item[self.hash_key], (sort_value, primary_key)
+
+    def add(self, item: dict, primary_key: tuple):
+        entry = self.entry(item, primary_key)
+        if entry:
+            bisect.insort(self.partitions.setdefault(entry[0], []), entry[1])
+
+    def remove(self, item: dict, primary_key: tuple):
+        entry = self.entry(item, primary_key)
+        if not entry:
+            return
+        partition = self.partitions.get(entry[0], [])
+        position = bisect.bisect_left(partition, entry[1])
+        if position < len(partition) and partition[position] == entry[1]:
+            del partition[position]
+        if not partition:
+            self.partitions.pop(entry[0], None)
+
+
+class MemoryTable:
+    def __init__(self, engine, name: str, key_schema: list, indexes: dict):
+        self.engine = engine
+        self.name = name
+        self.table_name = name
+        keys = {k["KeyType"]: k["AttributeName"] for k in key_schema}
+        self.hash_key = keys["HASH"]
+        self.sort_key = keys.get("RANGE")
+        self.items = {}
+        self.primary = _SortedIndex(self.hash_key, self.sort_key)
+        self.indexes = {
+            index_name: _SortedIndex(
+                *(
+                    {k["KeyType"]: k["AttributeName"] for k in schema}.get(kt)
+                    for kt in ("HASH", "RANGE")
+                )
+            )
+            for index_name, schema in indexes.items()
+        }
+
+    # helpers
+    def primary_key(self, key: dict, operation: str):
+        try:
+            key_tuple = (
+                key[self.hash_key],
+                key[self.sort_key] if self.sort_key else None,
+            )
+        except KeyError as error:
+            raise validation_error(
+                "The provided key element does not match the schema",
+                operation,
+            ) from error
+        expected = 2 if self.sort_key else 1
+        if len(key) != expected and operation != "PutItem":
+            raise validation_error(
+                "The provided key element does not match the schema",
+                operation,
+            )
+        return key_tuple
+
+    def key_of(self, item: dict):
+        key = {self.hash_key: item[self.hash_key]}
+        if self.sort_key:
+            key[self.sort_key] = item[self.sort_key]
+        return key
+
+    def _store(self, primary_key: tuple, item: Optional[dict]):
+        old = self.items.pop(primary_key, None)
+        if old is not None:
+            self.primary.remove(old, primary_key)
+            for index in self.indexes.values():
+                index.remove(old, primary_key)
+        if item is not None:
+            self.items[primary_key] = item
+            self.primary.add(item, primary_key)
+            for index in self.indexes.values():
+                index.add(item, primary_key)
+        return old
+
+    def check_condition(self, item: Optional[dict], params: dict):
+        condition = params.get("ConditionExpression")
+        if not condition:
+            return True
+        node = parse_condition(
+            condition,
+            params.get("ExpressionAttributeNames"),
+            params.get("ExpressionAttributeValues"),
+        )
+        return bool(_evaluate(node, item or {}))
+
+    @staticmethod
+    def _return_values(mode: str, old: Optional[dict], new: Optional[dict]):
+        if mode in ("ALL_OLD", "UPDATED_OLD") and old:
+            return {"Attributes": copy.deepcopy(old)}
+        if mode in ("ALL_NEW", "UPDATED_NEW") and new:
+            return {"Attributes": copy.deepcopy(new)}
+        return {}
+
+    def _conditional_failed(self, operation: str, old: Optional[dict], params):
+        extra = {}
+        if params.get("ReturnValuesOnConditionCheckFailure") == "ALL_OLD":
+            extra["Item"] = serialize(old or {})
+        return client_error(
+            "ConditionalCheckFailedException",
+            "The conditional request failed",
+            operation,
+            **extra,
+        )
+
+    # operations, `_apply_*` are used by the transactions (already locked)
+    def _apply_put(self, params: dict, operation="PutItem"):
+        item = _normalize(params["Item"])
+        primary_key = self.primary_key(item, "PutItem")
+        old = self.items.get(primary_key)
+        if not self.check_condition(old, params):
+            raise self._conditional_failed(operation, old, params)
+        self._store(primary_key, item)
+        return old, item
+
+    def _apply_update(self, params: dict, operation="UpdateItem"):
+        key = _normalize(params["Key"])
+        primary_key = self.primary_key(key, operation)
+        old = self.items.get(primary_key)
+        if not self.check_condition(old, params):
+            raise self._conditional_failed(operation, old, params)
+        item = copy.deepcopy(old) if old else dict(key)
+        if params.get("UpdateExpression"):
+            values = params.get("ExpressionAttributeValues")
+            item = apply_update(
+                item,
+                params["UpdateExpression"],
+                params.get("ExpressionAttributeNames"),
+                _normalize(values) if values else values,
+            )
+        if self.key_of(item) != key:
+            raise validation_error(
+                "Cannot update attribute that is part of the key", operation
+            )
+        self._store(primary_key, _normalize(item))
+        return old, item
+
+    def _apply_delete(self, params: dict, operation="DeleteItem"):
+        primary_key = self.primary_key(_normalize(params["Key"]), operation)
+        old = self.items.get(primary_key)
+        if not self.check_condition(old, params):
+            raise self._conditional_failed(operation, old, params)
+        self._store(primary_key, None)
+        return old, None
+
+    def _write_result(self, params: dict, old, new):
+        result = self._return_values(params.get("ReturnValues"), old, new)
+        size = max(item_size(old), item_size(new))
+        return with_capacity(
+            result, params, self.name, capacity_units(size, "write")
+        )
+
+    def put_item(self, **params):
+        with self.engine.lock:
+            self.engine.count("PutItem", self.name)
+            old, new = self._apply_put(params)
+            return self._write_result(params, old, None)
+
+    def update_item(self, **params):
+        with self.engine.lock:
+            self.engine.count("UpdateItem", self.name)
+            old, new = self._apply_update(params)
+            return self._write_result(params, old, new)
+
+    def delete_item(self, **params):
+        with self.engine.lock:
+            self.engine.count("DeleteItem", self.name)
+            old, new = self._apply_delete(params)
+            return self._write_result(params, old, None)
+
+    def get_item(self, **params):
+        with self.engine.lock:
+            self.engine.count("GetItem", self.name)
+            primary_key = self.primary_key(params["Key"], "GetItem")
+            item = self.items.get(primary_key)
+            result = {}
+            if item is not None:
+                result["Item"] = project(
+                    item,
+                    params.get("ProjectionExpression"),
+                    params.get("ExpressionAttributeNames"),
+                )
+            units = capacity_units(
+                item_size(item), "read", params.get("ConsistentRead", False)
+            )
+            return with_capacity(result, params, self.name, units)
+
+    def _key_bounds(self, node, sort_key: Optional[str]):
+        """hash value and the sort key range of a key condition"""
+        conditions = []
+
+        def flatten(current):
+            if current[0] == "and":
+                flatten(current[1])
+                flatten(current[2])
+            else:
+                conditions.append(current)
+
+        flatten(node)
+        hash_value = MISSING
+        low, high = None, None
+        for condition in conditions:
+            kind = condition[0]
+            if kind == "compare" and condition[2][0] == "path":
+                attribute = condition[2][1][0]
+                value = condition[3][1]
+                if attribute != sort_key and condition[1] == "=":
+                    hash_value = value
+                elif condition[1] in ("=", ">=", ">"):
+                    low = value
+                if attribute == sort_key and condition[1] in ("=", "<=", "<"):
+                    high = value
+            elif kind == "between":
+                low, high = condition[2][1], condition[3][1]
+            elif kind == "function" and condition[1] == "begins_with":
+                low = condition[2][1][1]
+        if hash_value is MISSING:
+            raise validation_error(
+                "Query condition missed key schema element", "Query"
+            )
+        return hash_value, low, high
+
+    def _index_for(self, params: dict, operation: str):
+        index_name = params.get("IndexName")
+        if not index_name:
+            return self.primary, False
+        if index_name not in self.indexes:
+            raise validation_error(
+                "The table does not have the specified index: "
+                f"{index_name}",
+                operation,
+            )
+        return self.indexes[index_name], True
+
+    def _last_key(self, index: _SortedIndex, item: dict, secondary: bool):
+        key = self.key_of(item)
+        if secondary:
+            key[index.hash_key] = item[index.hash_key]
+            key[index.sort_key] = item[index.sort_key]
+        return key
+
+    def _page(self, entries, index, secondary, params, scanned_items):
+        limit = params.get("Limit")
+        filter_node = None
+        if params.get("FilterExpression"):
+            filter_node = parse_condition(
+                params["FilterExpression"],
+                params.get("ExpressionAttributeNames"),
+                params.get("ExpressionAttributeValues"),
+            )
+        items = []
+        scanned = 0
+        scanned_size = 0
+        last = None
+        for entry in entries:
+            item = scanned_items(entry)
+            scanned += 1
+            scanned_size += item_size(item)
+            if filter_node is None or _evaluate(filter_node, item):
+                items.append(
+                    project(
+                        item,
+                        params.get("ProjectionExpression"),
+                        params.get("ExpressionAttributeNames"),
+                    )
+                )
+            if limit and scanned >= limit:
+                last = item
+                break
+        result = {"Items": items, "Count": len(items), "ScannedCount": scanned}
+        if last is not None:
+            result["LastEvaluatedKey"] = self._last_key(index, last, secondary)
+        if params.get("Select") == "COUNT":
+            result.pop("Items")
+        units = capacity_units(
+            scanned_size, "read", params.get("ConsistentRead", False)
+        )
+        return with_capacity(result, params, self.name, units)
+
+    def query(self, **params):
+        with self.engine.lock:
+            self.engine.count("Query", self.name, params.get("IndexName"))
+            index, secondary = self._index_for(params, "Query")
+            node = parse_condition(
+                params["KeyConditionExpression"],
+                params.get("ExpressionAttributeNames"),
+                params.get("ExpressionAttributeValues"),
+            )
+            hash_value, low, high = self._key_bounds(node, index.sort_key)
+            partition = index.partitions.get(hash_value, [])
+            start, end = 0, len(partition)
+            if low is not None:
+                start = bisect.bisect_left(partition, (low,))
+            if high is not None:
+                end = bisect.bisect_right(partition, (high, (MAX_KEY,)))
+            candidates = partition[start:end]
+            if not params.get("ScanIndexForward", True):
+                candidates = candidates[::-1]
+            exclusive_start = params.get("ExclusiveStartKey")
+            if exclusive_start:
+                marker = (
+                    exclusive_start[index.sort_key] if index.sort_key else "",
+                    self.primary_key(
+                        {
+                            k: exclusive_start[k]
+                            for k in (self.hash_key, self.sort_key)
+                            if k
+                        },
+                        "Query",
+                    ),
+                )
+                candidates = [
+                    c
+                    for c in candidates
+                    if (
+                        c > marker
+                        if params.get("ScanIndexForward", True)
+                        else c < marker
+                    )
+                ]
+            # the whole key condition is checked again on each item, the
+            # bounds only narrow the range
+            matching = (
+                entry
+                for entry in candidates
+                if _evaluate(node, self.items[entry[1]])
+            )
+            return self._page(
+                matching,
+                index,
+                secondary,
+                params,
+                lambda entry: self.items[entry[1]],
+            )
+
+    def scan(self, **params):
+        with self.engine.lock:
+            self.engine.count("Scan", self.name, params.get("IndexName"))
+            index, secondary = self._index_for(params, "Scan")
+            entries = [
+                (hash_value, entry)
+                for hash_value in sorted(index.partitions, key=_sortable)
+                for entry in index.partitions[hash_value]
+            ]
+            exclusive_start = params.get("ExclusiveStartKey")
+            if exclusive_start:
+                start_key = self.primary_key(
+                    {
+                        k: exclusive_start[k]
+                        for k in (self.hash_key, self.sort_key)
+                        if k
+                    },
+                    "Scan",
+                )
+                positions = [e[1][1] for e in entries]
+                if start_key in positions:
+                    entries = entries[positions.index(start_key) + 1:]
+            return self._page(
+                entries,
+                index,
+                secondary,
+                params,
+                lambda entry: self.items[entry[1][1]],
+            )
+
+    def batch_writer(self, **_):
+        return _BatchWriter(self)
+
+
+class _MaxKey:
+    """Bigger than any primary key, used as the upper bisect bound"""
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+    def __eq__(self, other):
+        return isinstance(other, _MaxKey)
+
+    def __le__(self, other):
+        return self == other
+
+    def __ge__(self, other):
+        return True
+
+
+MAX_KEY = _MaxKey()
+
+
+def _sortable(value):
+    return (_type_of(value), value)
+
+
+class _BatchWriter:
+    def __init__(self, table: MemoryTable):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+
+class MemoryClient:
+    """Low level client operations (typed attribute values)"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def describe_table(self, TableName: str):
+        table = self.engine.table(TableName, "DescribeTable")
+        with self.engine.lock:
+            self.engine.count("DescribeTable", TableName)
+            return {
+                "Table": {
+                    "TableName": TableName,
+                    "TableStatus": "ACTIVE",
+                    "ItemCount": len(table.items),
+                }
+            }
+
+    def transact_write_items(self, TransactItems: list, **request):
+        operations = []
+        for transact_item in TransactItems:
+            ((operation, params),) = transact_item.items()
+            params = dict(params)
+            for attr in ("Key", "Item", "ExpressionAttributeValues"):
+                if attr in params:
+                    params[attr] = deserialize(params[attr])
+            table = self.engine.table(params["TableName"], "TransactWrite")
+            operations.append((operation, table, params))
+
+        with self.engine.lock:
+            self.engine.count("TransactWriteItems", None)
+            targets = set()
+            for operation, table, params in operations:
+                key = params.get("Key") or table.key_of(params["Item"])
+                target = (table.name, table.primary_key(key, "TransactWrite"))
+                if target in targets:
+                    raise validation_error(
+                        "Transaction request cannot include multiple "
+                        "operations on one item",
+                        "TransactWriteItems",
+                    )
+                targets.add(target)
+
+            reasons = []
+            for operation, table, params in operations:
+                key = params.get("Key") or table.key_of(params["Item"])
+                old = table.items.get(table.primary_key(key, "TransactWrite"))
+                if table.check_condition(old, params):
+                    reasons.append({"Code": "None"})
+                    continue
+                reason = {
+                    "Code": "ConditionalCheckFailed",
+                    "Message": "The conditional request failed",
+                }
+                if params.get("ReturnValuesOnConditionCheckFailure") == (
+                    "ALL_OLD"
+                ) and old:
+                    reason["Item"] = serialize(old)
+                reasons.append(reason)
+            if any(reason["Code"] != "None" for reason in reasons):
+                raise client_error(
+                    "TransactionCanceledException",
+                    "Transaction cancelled, please refer cancellation "
+                    "reasons for specific reasons",
+                    "TransactWriteItems",
+                    CancellationReasons=reasons,
+                )
+
+            units = {}
+            for operation, table, params in operations:
+                if operation == "Put":
+                    old, new = table._apply_put(params, "TransactWriteItems")
+                elif operation == "Update":
+                    old, new = table._apply_update(
+                        params, "TransactWriteItems"
+                    )
+                elif operation == "Delete":
+                    old, new = table._apply_delete(
+                        params, "TransactWriteItems"
+                    )
+                else:
+                    old, new = table.items.get(
+                        table.primary_key(params["Key"], "TransactWrite")
+                    ), None
+                # transactions are charged twice
+                size = max(item_size(old), item_size(new))
+                units[table.name] = units.get(
+                    table.name, 0
+                ) + 2 * capacity_units(size, "write")
+            return _capacity_list(request, units)
+
+
+class _Meta:
+    def __init__(self, client):
+        self.client = client
+
+
+class MemoryResource:
+    """Stand in of `boto3.resource("dynamodb")`"""
+
+    def __init__(self, template: Optional[dict] = None):
+        self.lock = threading.RLock()
+        self.calls = {}
+        self.tables = {}
+        self.meta = _Meta(MemoryClient(self))
+        if template is None:
+            with open(
+                os.environ.get("DYNAMODB_MEMORY_TEMPLATE", template_path)
+            ) as template_file:
+                template = json.load(template_file)
+        for resource in template["Resources"].values():
+            if resource["Type"] == "AWS::DynamoDB::Table":
+                self.create_table(resource["Properties"])
+
+    def create_table(self, properties: dict):
+        indexes = {
+            index["IndexName"]: index["KeySchema"]
+            for index in properties.get("GlobalSecondaryIndexes", [])
+        }
+        name = properties["TableName"]
+        self.tables[name] = MemoryTable(
+            self, name, properties["KeySchema"], indexes
+        )
+
+    def count(self, operation: str, table_name: Optional[str], index=None):
+        key = (operation, table_name, index)
+        self.calls[key] = self.calls.get(key, 0) + 1
+
+    def table(self, table_name: str, operation: str = "Table"):
+        if table_name not in self.tables:
+            raise client_error(
+                "ResourceNotFoundException",
+                "Requested resource not found",
+                operation,
+            )
+        return self.tables[table_name]
+
+    def Table(self, table_name: str):
+        return self.table(table_name)
+
+    def batch_get_item(self, RequestItems: dict, **params):
+        responses = {}
+        units = {}
+        for table_name, request in RequestItems.items():
+            table = self.table(table_name, "BatchGetItem")
+            items = responses.setdefault(table_name, [])
+            get_params = {
+                k: v
+                for k, v in request.items()
+                if k
+                in (
+                    "ProjectionExpression",
+                    "ExpressionAttributeNames",
+                    "ConsistentRead",
+                )
+            }
+            for key in request["Keys"]:
+                result = table.get_item(
+                    Key=key, ReturnConsumedCapacity="TOTAL", **get_params
+                )
+                units[table_name] = (
+                    units.get(table_name, 0)
+                    + result["ConsumedCapacity"]["CapacityUnits"]
+                )
+                if "Item" in result:
+                    items.append(result["Item"])
+        return {
+            "Responses": responses,
+            "UnprocessedKeys": {},
+            **_capacity_list(params, units),
+        }
+
+    def batch_write_item(self, RequestItems: dict, **params):
+        units = {}
+        for table_name, requests in RequestItems.items():
+            table = self.table(table_name, "BatchWriteItem")
+            for request in requests:
+                if "PutRequest" in request:
+                    result = table.put_item(
+                        Item=request["PutRequest"]["Item"],
+                        ReturnConsumedCapacity="TOTAL",
+                    )
+                else:
+                    result = table.delete_item(
+                        Key=request["DeleteRequest"]["Key"],
+                        ReturnConsumedCapacity="TOTAL",
+                    )
+                units[table_name] = (
+                    units.get(table_name, 0)
+                    + result["ConsumedCapacity"]["CapacityUnits"]
+                )
+        return {"UnprocessedItems": {}, **_capacity_list(params, units)}
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            for table in self.tables.values():
+                table.items.clear()
+                table.primary.partitions.clear()
+                for index in table.indexes.values():
+                    index.partitions.clear()
+
+
+_shared_lock = threading.Lock()
+_shared = None
+
+
+def shared_resource():
+    """The process wide memory database, shared by every thread"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = MemoryResource()
+        return _shared
@@ -0,0 +1,271 @@
+"""
+Retries of the failed dynamodb calls.
+
+Only the errors that `DynamoResource.error_help_strings` says are safe to
+retry, the connection errors and the timeouts are retried, with full jitter
+exponential back-off. The retries are
+limited per call, per request (`start_request`) and per process by a token
+bucket that only refills on successes, so an outage doesn't multiply the
+traffic. A table throttled (or unreachable) for many consecutive calls opens
+a circuit and its calls fail fast with `CircuitOpenError` until the cooldown
+passes.
+"""
+import contextvars
+import itertools
+import random
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+import botocore.exceptions
+
+# errors the dynamodb documentation says are safe to retry with back-off
+retryable_codes = {
+    "InternalServerError",
+    "ProvisionedThroughputExceededException",
+    "ServiceUnavailable",
+    "ThrottlingException",
+}
+throttling_codes = {
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "ThrottlingException",
+}
+# cancellation reasons of a transaction that can be retried as is
+retryable_reasons = {
+    "TransactionConflict",
+    "ProvisionedThroughputExceeded",
+    "ThrottlingError",
+}
+throttling_reasons = {"ProvisionedThroughputExceeded", "ThrottlingError"}
+# dynamodb unreachable or too slow, they count as failures of the table
+unreachable_errors = (
+    botocore.exceptions.ConnectionError,
+    botocore.exceptions.HTTPClientError,
+)
+# errors of a single attempt, the ones `RetryPolicy.run` looks at
+attempt_errors = (botocore.exceptions.ClientError, *unreachable_errors)
+
+
+class DatabaseUnavailable(Exception):
+    """Dynamodb is throttling or unreachable, the request can be retried"""
+
+    retry_after = 1
+
+
+class CircuitOpenError(DatabaseUnavailable):
+    def __init__(self, table_name: str, retry_after: float):
+        super().__init__(f"circuit open for the table {table_name}")
+        self.table_name = table_name
+        self.retry_after = max(int(retry_after + 0.999), 1)
+
+
+def error_code(error: Exception):
+    """The dynamodb error code, the class name for connection errors"""
+    if isinstance(error, botocore.exceptions.ClientError):
+        return error.response.get("Error", {}).get("Code")
+    return type(error).__name__
+
+
+def cancellation_reasons(error: botocore.exceptions.ClientError):
+    """Reason of each item of a cancelled transaction, in the items order
+    ("None" for the ones that didn't fail)"""
+    return [
+        reason.get("Code")
+        for reason in error.response.get("CancellationReasons", [])
+    ]
+
+
+def _reasons(error: botocore.exceptions.ClientError):
+    return set(cancellation_reasons(error)) - {"None", None}
+
+
+def is_retryable(error: Exception):
+    if isinstance(error, unreachable_errors):
+        return True
+    if error_code(error) == "TransactionCanceledException":
+        reasons = _reasons(error)
+        return bool(reasons) and reasons <= retryable_reasons
+    return error_code(error) in retryable_codes
+
+
+def is_throttled(error: Exception):
+    if isinstance(error, unreachable_errors):
+        return True
+    if error_code(error) == "TransactionCanceledException":
+        return bool(_reasons(error) & throttling_reasons)
+    return error_code(error) in throttling_codes
+
+
+def is_unavailable(error: botocore.exceptions.ClientError):
+    """Errors that should reach the client as 503 instead of 500"""
+    return is_throttled(error) or error_code(error) in retryable_codes
+
+
+class RetryQuota:
+    """
+    Token bucket shared by the whole process, each retry takes tokens and
+    each successful call gives one back
+    """
+
+    def __init__(self, capacity: int = 500, retry_cost: int = 5):
+        self._lock = threading.Lock()
+        self.capacity = capacity
+        self.retry_cost = retry_cost
+        self.tokens = capacity
+
+    def acquire(self):
+        with self._lock:
+            if self.tokens < self.retry_cost:
+                return False
+            self.tokens -= self.retry_cost
+            return True
+
+    def release(self):
+        if self.tokens >= self.capacity:
+            return
+        with self._lock:
+            self.tokens = min(self.tokens + 1, self.capacity)
+
+
+class RetryBudget:
+    """Retries left to the calls of one request"""
+
+    def __init__(self, retries: int):
+        self.retries = retries
+
+    def take(self):
+        if self.retries <= 0:
+            return False
+        self.retries -= 1
+        return True
+
+
+_budget: contextvars.ContextVar[Optional[RetryBudget]] = (
+    contextvars.ContextVar("dynamodb_retry_budget", default=None)
+)
+
+
+def start_request(retries: int):
+    return _budget.set(RetryBudget(retries))
+
+
+def end_request(token):
+    _budget.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Opens the circuit of a table after `threshold` consecutive throttled (or
+    unreachable) calls. After the cooldown a single trial call goes through,
+    a success closes the circuit and another failure opens it again
+    """
+
+    def __init__(self, threshold: int = 10, cooldown: float = 5):
+        self._lock = threading.Lock()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = {}
+        self._opened_at = {}
+        self._trials = set()
+
+    def check(self, table_names: Iterable[str]):
+        now = time.monotonic()
+        with self._lock:
+            trials = []
+            for table_name in table_names:
+                opened_at = self._opened_at.get(table_name)
+                if opened_at is None:
+                    continue
+                remaining = opened_at + self.cooldown - now
+                if remaining > 0 or table_name in self._trials:
+                    raise CircuitOpenError(table_name, max(remaining, 0))
+                trials.append(table_name)
+            self._trials.update(trials)
+
+    def end_trial(self, table_names: Iterable[str]):
+        """Lets the next call try the tables again, whatever the result of
+        the trial was"""
+        with self._lock:
+            self._trials.difference_update(table_names)
+
+    def record(self, table_names: Iterable[str], failed: bool):
+        with self._lock:
+            for table_name in table_names:
+                self._trials.discard(table_name)
+                if not failed:
+                    self._failures.pop(table_name, None)
+                    self._opened_at.pop(table_name, None)
+                    continue
+                failures = self._failures.get(table_name, 0) + 1
+                self._failures[table_name] = failures
+                if failures >= self.threshold:
+                    self._opened_at[table_name] = time.monotonic()
+
+    def open_tables(self):
+        with self._lock:
+            return list(self._opened_at)
+
+    def reset(self):
+        with self._lock:
+            self._failures.clear()
+            self._opened_at.clear()
+            self._trials.clear()
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        backoff_base: float = 0.025,
+        backoff_cap: float = 1,
+        quota: Optional[RetryQuota] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.quota = quota or RetryQuota()
+        self.breaker = breaker or CircuitBreaker()
+
+    def configure(self, max_attempts: int, threshold: int, cooldown: float):
+        self.max_attempts = max_attempts
+        self.breaker.threshold = threshold
+        self.breaker.cooldown = cooldown
+
+    def backoff(self, attempt: int):
+        """Full jitter, anything between 0 and the exponential delay"""
+        return random.uniform(
+            0, min(self.backoff_cap, self.backoff_base * 2**attempt)
+        )
+
+    def should_retry(self, error, attempt: int):
+        if not is_retryable(error) or attempt + 1 >= self.max_attempts:
+            return False
+        budget = _budget.get()
+        if budget is not None and not budget.take():
+            return False
+        return self.quota.acquire()
+
+    def run(self, table_names: Iterable[str], call: Callable, on_retry=None):
+        table_names = [name for name in table_names if name]
+        for attempt in itertools.count():
+            self.breaker.check(table_names)
+            try:
+                resp = call()
+            except attempt_errors as error:
+                self.breaker.record(table_names, is_throttled(error))
+                if not self.should_retry(error, attempt):
+                    raise
+                if on_retry:
+                    on_retry(error)
+                time.sleep(self.backoff(attempt))
+                continue
+            else:
+                self.breaker.record(table_names, False)
+                self.quota.release()
+                return resp
+            finally:
+                # a trial ended by any other error must not keep the circuit
+                # open for good
+                self.breaker.end_trial(table_names)
@@ -0,0 +1,85 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after `ttl` seconds.
+
+    Reads that may race with an invalidation take a `token()` before going
+    to the database and pass it to `set`, the value is discarded if the key
+    was invalidated after the token was taken, so a slow read never puts
+    back data older than a write
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._invalidated = OrderedDict()
+        self._stamp = 0
+        self._floor = 0
+
+    def configure(self, maxsize: int, ttl: float):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def token(self):
+        with self._lock:
+            return self._stamp
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.copy(entry[1])
+
+    def set(self, key, value, token: int):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            if token < self._invalidated.get(key, self._floor):
+                return
+            expires_at = time.monotonic() + self.ttl
+            self._entries[key] = (expires_at, copy.copy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._stamp += 1
+            self._entries.pop(key, None)
+            self._invalidated[key] = self._stamp
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.maxsize:
+                _, stamp = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, stamp)
+
+    def clear(self):
+        with self._lock:
+            self._stamp += 1
+            self._floor = self._stamp
+            self._entries.clear()
+            self._invalidated.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
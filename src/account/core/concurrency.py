@@ -0,0 +1,91 @@
+"""
+Shared bounded thread pool to run independent blocking calls (mostly
+dynamodb reads) at the same time.
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent import futures
+from typing import Callable, Optional
+
+_lock = threading.Lock()
+_executor: Optional[futures.ThreadPoolExecutor] = None
+_worker = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """The calls did not finish before the deadline"""
+
+
+def _mark_worker():
+    _worker.active = True
+
+
+def in_worker():
+    return getattr(_worker, "active", False)
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(
+                max_workers=int(os.environ.get("CONCURRENCY_MAX_WORKERS", 16)),
+                thread_name_prefix="fan-out",
+                initializer=_mark_worker,
+            )
+        return _executor
+
+
+def submit(fn: Callable, *args, **kwargs):
+    """
+    Runs `fn` in the shared pool with a copy of the current context, so the
+    flask app and request contexts and the retry budget are still there
+    """
+    context = contextvars.copy_context()
+    return executor().submit(context.run, fn, *args, **kwargs)
+
+
+def gather(*calls: Callable, timeout: Optional[float] = None):
+    """
+    Results of the calls, in order, running them at the same time: all but
+    the last go to the pool and the last one runs in the calling thread.
+
+    When a call raises or the `timeout` passes, the calls that did not start
+    yet are cancelled (the running ones can't be interrupted, their results
+    are discarded). From a pool thread the calls run one after the other,
+    waiting for the pool inside the pool could exhaust it
+    """
+    if not calls:
+        return []
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def remaining():
+        if deadline is None:
+            return None
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise DeadlineExceeded()
+        return left
+
+    if in_worker():
+        results = []
+        for call in calls:
+            remaining()
+            results.append(call())
+        return results
+
+    pending = [submit(call) for call in calls[:-1]]
+    try:
+        last = calls[-1]()
+        results = []
+        for future in pending:
+            try:
+                results.append(future.result(timeout=remaining()))
+            except futures.TimeoutError as error:
+                raise DeadlineExceeded() from error
+        return results + [last]
+    finally:
+        for future in pending:
+            future.cancel()
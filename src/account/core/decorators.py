@@ -21,11 +21,14 @@ def json_consumer(f):
 
 
 def query_to_json(schema):
+    # one instance for every request
+    loader = schema()
+
     def query_to_json_decorator(fn):
         @functools.wraps(fn)
         def query_to_json_inner(**kwargs):
             query = urllib.parse.parse_qsl(request.query_string)
-            kwargs["queries"] = schema().load(
+            kwargs["queries"] = loader.load(
                 {q[0].decode("utf-8"): q[1].decode("utf-8") for q in query}
             )
             return fn(**kwargs)
@@ -1,11 +1,61 @@
+import time
 from http import HTTPStatus
 
-from flask import Blueprint
+from flask import Blueprint, current_app, g, request
 from marshmallow.exceptions import ValidationError
 
+from src.account.core import concurrency, metrics
+from src.account.core.aws import retry
+
 errors = Blueprint("errors", __name__)
 
 
 @errors.app_errorhandler(ValidationError)
 def handle_error(error):
     return {"error": error.messages}, HTTPStatus.BAD_REQUEST
+
+
+@errors.app_errorhandler(retry.DatabaseUnavailable)
+def handle_database_unavailable(error):
+    return (
+        {"error": "Service temporarily unavailable, try again later"},
+        HTTPStatus.SERVICE_UNAVAILABLE,
+        {"Retry-After": str(error.retry_after)},
+    )
+
+
+@errors.app_errorhandler(concurrency.DeadlineExceeded)
+def handle_deadline_exceeded(_):
+    return (
+        {"error": "The request took too long, try again later"},
+        HTTPStatus.GATEWAY_TIMEOUT,
+    )
+
+
+@errors.before_app_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    g.retry_budget = retry.start_request(
+        current_app.config["DYNAMODB_REQUEST_RETRIES"]
+    )
+
+
+@errors.teardown_app_request
+def end_retry_budget(_):
+    token = g.pop("retry_budget", None)
+    if token is not None:
+        retry.end_request(token)
+
+
+@errors.after_app_request
+def record_duration(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # the endpoint name keeps the label values bounded, unlike the path
+        metrics.http_request_duration.observe(
+            time.perf_counter() - started,
+            request.method,
+            request.endpoint or "unmatched",
+            str(response.status_code),
+        )
+    return response
@@ -0,0 +1,13 @@
+from typing import Iterable
+
+
+def chunked(items: Iterable, size: int):
+    """Groups the items in lists of `size` (the last one may be smaller)"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
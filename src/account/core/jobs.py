@@ -0,0 +1,61 @@
+"""
+What the batch jobs (the backfill, the rollup and the transaction ids
+migration) share: the base of their reports and the workers pool.
+"""
+import logging
+import threading
+from concurrent import futures
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Optional
+
+# errors listed in the report, the rest is only counted in the logs
+max_reported_errors = 100
+
+
+@dataclass
+class JobReport:
+    errors: list = field(default_factory=list)
+    seconds: float = 0
+
+    # name of the job in the logs
+    job = "Job"
+
+    def add_error(self, error: dict):
+        if len(self.errors) < max_reported_errors:
+            self.errors.append(error)
+        logging.error(f"{self.job} error: {error}")
+
+
+def run_in_workers(
+    work: Callable,
+    tasks: Iterable,
+    workers: int,
+    on_error: Callable,
+    on_result: Optional[Callable] = None,
+):
+    """
+    Calls `work(task)` for every task with `workers` threads. At most two
+    tasks per worker are waiting, so `tasks` is read as they finish. The
+    results go to `on_result(task, result)` and the exceptions to
+    `on_error(task, error)`, one call at a time (they can change a report
+    without a lock)
+    """
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    lock = threading.Lock()
+
+    def run(task):
+        try:
+            result = work(task)
+            if on_result is not None:
+                with lock:
+                    on_result(task, result)
+        except Exception as error:
+            with lock:
+                on_error(task, error)
+        finally:
+            in_flight.release()
+
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for task in tasks:
+            in_flight.acquire()
+            executor.submit(run, task)
@@ -0,0 +1,321 @@
+"""
+Write-behind journal: records appended to a local file, acknowledged once
+they are on disk, and written to their destination by a background thread
+in batches.
+
+Each process writes its own file (`journal-<pid>-<token>.jsonl`) in the
+journal directory, locked while the process is alive. The file has one
+json per line, the records (`{"s": sequence, "r": record}`) and, after each
+batch flushed, a marker with the last sequence flushed (`{"f": sequence}`).
+A file left unlocked by a process that stopped is recovered by the next one
+opened in the directory: its records after the last marker are flushed and
+the file is deleted. The markers are not synced, after a crash the last
+batches may be flushed again, so flushing a record twice must be harmless.
+
+A batch that fails `max_attempts` times in a row is flushed one record at a
+time, the records that still fail are moved to the dead letter file
+(`dead-letter-<name>.jsonl`) so the ones after them keep flushing, and
+given to `on_dead_letter`. When all of them fail the destination is down,
+not the records, and the batch is kept.
+"""
+import fcntl
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Optional
+
+from src.account.core import metrics
+
+
+class Journal:
+    file_prefix = "journal-"
+    file_suffix = ".jsonl"
+
+    def __init__(
+        self,
+        directory: str,
+        flush: Callable[[list], None],
+        name: str = "journal",
+        batch_size: int = 25,
+        flush_interval: float = 0.2,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_attempts: int = 20,
+        on_dead_letter: Optional[Callable[[list], None]] = None,
+    ):
+        """
+        `flush` writes a list of at most `batch_size` records, an exception
+        keeps them to be tried again after `flush_interval` (`max_attempts`
+        times before looking for the records that fail, then they go to
+        `on_dead_letter`). When every record was flushed a file larger than
+        `max_bytes` starts again
+        """
+        self.directory = directory
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_attempts = max_attempts
+        self.path = None
+        self.dead_letter_path = os.path.join(
+            directory, f"dead-letter-{name}{self.file_suffix}"
+        )
+        # consecutive failures of the first batch not flushed
+        self._attempts = 0
+        self._flush = flush
+        self._on_dead_letter = on_dead_letter
+        # the file writes, the sequence and the queue
+        self._lock = threading.Lock()
+        self._synced_condition = threading.Condition()
+        self._file = None
+        self._queue = deque()
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        self._orphans = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._orphans = self._lock_orphans()
+        self.path = os.path.join(
+            self.directory,
+            f"{self.file_prefix}{os.getpid()}-{uuid.uuid4().hex}"
+            f"{self.file_suffix}",
+        )
+        self._file = open(self.path, "ab")
+        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._thread = threading.Thread(
+            target=self._run, name=f"{self.name}-journal", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def append(self, record):
+        """Writes the record and returns once it's synced to the disk"""
+        with self._lock:
+            self._written += 1
+            sequence = self._written
+            self._file.write(self._line({"s": sequence, "r": record}))
+            self._queue.append((sequence, record))
+            full = len(self._queue) >= self.batch_size
+        self._sync(sequence)
+        metrics.journal_records.inc(self.name, "appended")
+        if full:
+            self._wake.set()
+        return sequence
+
+    def pending(self):
+        """Records not flushed yet, recovered ones included"""
+        with self._lock:
+            return len(self._queue) + sum(
+                len(records) for _, records in self._orphans
+            )
+
+    def wait_flushed(self, timeout: float):
+        """True if every record was flushed before the timeout"""
+        deadline = time.monotonic() + timeout
+        while self.pending():
+            if time.monotonic() > deadline:
+                return False
+            self._wake.set()
+            time.sleep(min(self.flush_interval, 0.01))
+        return True
+
+    def close(self, timeout: float = 5):
+        """
+        Stops the thread after it tries to flush what's left. The file is
+        deleted when everything was flushed, otherwise it's recovered by the
+        next journal opened in the directory
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        with self._lock:
+            flushed = not self._queue
+            self._file.close()
+        if flushed:
+            os.remove(self.path)
+
+    @staticmethod
+    def _line(entry: dict):
+        return (json.dumps(entry, separators=(",", ":")) + "\n").encode()
+
+    def _sync(self, sequence: int):
+        """
+        Group commit: a single fsync covers every record written before it,
+        the appends that arrive while it runs wait for it or for the next
+        one
+        """
+        with self._synced_condition:
+            while self._synced < sequence and self._syncing:
+                self._synced_condition.wait()
+            if self._synced >= sequence:
+                return
+            self._syncing = True
+        synced = self._synced
+        try:
+            with self._lock:
+                self._file.flush()
+                target = self._written
+            os.fsync(self._file.fileno())
+            metrics.journal_fsyncs.inc(self.name)
+            synced = target
+        finally:
+            with self._synced_condition:
+                self._synced = max(self._synced, synced)
+                self._syncing = False
+                self._synced_condition.notify_all()
+
+    @classmethod
+    def read(cls, path: str):
+        """Records of a file not flushed yet, in order. A line cut by a
+        crash ends the file"""
+        records, flushed = [], 0
+        with open(path, "rb") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if "f" in entry:
+                    flushed = entry["f"]
+                else:
+                    records.append((entry["s"], entry["r"]))
+        return [record for sequence, record in records if sequence > flushed]
+
+    def _lock_orphans(self):
+        """Files of the stopped processes, locked until recovered"""
+        orphans = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not (
+                filename.startswith(self.file_prefix)
+                and filename.endswith(self.file_suffix)
+            ):
+                continue
+            orphan = open(os.path.join(self.directory, filename), "rb")
+            try:
+                fcntl.flock(orphan, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # a live journal
+                orphan.close()
+                continue
+            records = self.read(orphan.name)
+            logging.warning(
+                f"Recovering {len(records)} records of the journal "
+                f"{orphan.name}"
+            )
+            orphans.append((orphan, records))
+        return orphans
+
+    def _dead_letter(self, records: list):
+        with open(self.dead_letter_path, "ab") as dead_letter:
+            for record in records:
+                dead_letter.write(self._line({"r": record}))
+            dead_letter.flush()
+            os.fsync(dead_letter.fileno())
+        metrics.journal_records.inc(
+            self.name, "dead_letter", amount=len(records)
+        )
+        logging.error(
+            f"{len(records)} records of the {self.name} journal moved to "
+            f"{self.dead_letter_path}"
+        )
+        if self._on_dead_letter is None:
+            return
+        try:
+            self._on_dead_letter(records)
+        except Exception:
+            # they are in the file anyway
+            logging.exception(
+                f"Failed to handle the dead letters of the {self.name} "
+                "journal"
+            )
+
+    def _flush_batch(self, records: list):
+        """
+        Flushes the records (see the module docs about the failures).
+        Returns how many went to the dead letter file, raises when the
+        records are kept
+        """
+        try:
+            self._flush(records)
+            self._attempts = 0
+            return 0
+        except Exception:
+            self._attempts += 1
+            if self._attempts < self.max_attempts:
+                raise
+        self._attempts = 0
+        failed = []
+        for record in records:
+            try:
+                self._flush([record])
+            except Exception:
+                logging.exception(f"Failed to flush a {self.name} record")
+                failed.append(record)
+        if failed and len(failed) == len(records):
+            raise RuntimeError(f"No record of the {self.name} batch flushed")
+        if failed:
+            self._dead_letter(failed)
+        return len(failed)
+
+    def _recover(self):
+        for orphan, records in list(self._orphans):
+            # the records flushed are taken out, a failure starts again after
+            # them. The last batch stays pending until the file is deleted
+            while records:
+                batch = records[:self.batch_size]
+                dead = self._flush_batch(batch)
+                metrics.journal_records.inc(
+                    self.name, "recovered", amount=len(batch) - dead
+                )
+                if len(batch) == len(records):
+                    break
+                with self._lock:
+                    del records[:len(batch)]
+            os.remove(orphan.name)
+            orphan.close()
+            with self._lock:
+                self._orphans.remove((orphan, records))
+
+    def _flush_queue(self):
+        while True:
+            with self._lock:
+                batch = list(itertools.islice(self._queue, self.batch_size))
+            if not batch:
+                return
+            dead = self._flush_batch([record for _, record in batch])
+            metrics.journal_records.inc(
+                self.name, "flushed", amount=len(batch) - dead
+            )
+            with self._lock:
+                for _ in batch:
+                    self._queue.popleft()
+                self._file.write(self._line({"f": batch[-1][0]}))
+                if not self._queue and self._file.tell() > self.max_bytes:
+                    # everything in the file was flushed
+                    self._file.flush()
+                    self._file.truncate(0)
+
+    def _run(self):
+        while True:
+            stopping = self._stop.is_set()
+            try:
+                self._recover()
+                self._flush_queue()
+            except Exception:
+                logging.exception(
+                    f"Failed to flush the {self.name} journal, trying again"
+                )
+            if stopping:
+                return
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
@@ -0,0 +1,280 @@
+"""
+Process metrics in the prometheus text format.
+
+Every thread writes in its own shard, so recording a value takes no lock,
+the shards are only summed when the metrics are rendered. The shard of a
+thread that ended is folded into the retired one, so a thread per request
+doesn't keep a shard per request.
+"""
+import bisect
+import contextlib
+import threading
+import time
+import weakref
+from typing import Callable, Iterable
+
+default_buckets = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.total = 0.0
+        self.count = 0
+
+
+class _ShardHolder:
+    """Thread local owner of a shard, collected when the thread ends"""
+
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self, shard: dict):
+        self.shard = shard
+
+
+def _merge(merged: dict, values: dict):
+    # copying the items is atomic, the owner thread may be writing
+    for labels, value in list(values.items()):
+        if isinstance(value, _Histogram):
+            current = merged.setdefault(labels, _Histogram(len(value.counts)))
+            for index, count in enumerate(value.counts):
+                current.counts[index] += count
+            current.total += value.total
+            current.count += value.count
+        else:
+            merged[labels] = merged.get(labels, 0) + value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # the values of the threads that ended
+        self._retired = {}
+        self._shards = [self._retired]
+        self._metrics = {}
+        self._callbacks = {}
+
+    def _shard(self):
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _ShardHolder({})
+            with self._lock:
+                self._shards.append(holder.shard)
+            retire = weakref.finalize(holder, self._retire, holder.shard)
+            retire.atexit = False
+        return holder.shard
+
+    def _retire(self, shard: dict):
+        with self._lock:
+            for name, values in shard.items():
+                _merge(self._retired.setdefault(name, {}), values)
+            self._shards = [s for s in self._shards if s is not shard]
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=None
+    ):
+        return self._register(
+            Histogram(
+                self,
+                name,
+                documentation,
+                labelnames,
+                tuple(buckets or default_buckets),
+            )
+        )
+
+    def gauge_callback(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Iterable],
+        labelnames=(),
+    ):
+        """Gauge read when rendering, `callback` yields (labels, value)"""
+        with self._lock:
+            self._callbacks[name] = (documentation, labelnames, callback)
+
+    def _collect(self, name: str):
+        merged = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            _merge(merged, shard.get(name, {}))
+        return merged
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            callbacks = list(self._callbacks.items())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in sorted(self._collect(metric.name).items()):
+                lines.extend(metric.samples(labels, value))
+        for name, (documentation, labelnames, callback) in callbacks:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in callback():
+                lines.append(
+                    f"{name}{_labels(labelnames, labels)} {_number(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\n", "\\n")
+        .replace('"', '\\"')
+    )
+
+
+def _labels(labelnames: tuple, labels: tuple, extra: str = ""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry, name, documentation, labelnames):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labels, amount=1):
+        values = self.registry._shard().setdefault(self.name, {})
+        values[labels] = values.get(labels, 0) + amount
+
+    def samples(self, labels, value):
+        label_text = _labels(self.labelnames, labels)
+        return [f"{self.name}{label_text} {_number(value)}"]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames, buckets):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        values = self.registry._shard().setdefault(self.name, {})
+        histogram = values.get(labels)
+        if histogram is None:
+            histogram = values[labels] = _Histogram(len(self.buckets) + 1)
+        histogram.counts[bisect.bisect_left(self.buckets, value)] += 1
+        histogram.total += value
+        histogram.count += 1
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        """Observes the time spent in the block, even if it raised"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self, labels, histogram: _Histogram):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(
+            self.buckets + (float("inf"),), histogram.counts
+        ):
+            cumulative += count
+            le = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        label_text = _labels(self.labelnames, labels)
+        lines.append(f"{self.name}_sum{label_text} {histogram.total!r}")
+        lines.append(f"{self.name}_count{label_text} {histogram.count}")
+        return lines
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Time to handle the request, by endpoint",
+    ("method", "endpoint", "status"),
+)
+dynamodb_call_duration = registry.histogram(
+    "dynamodb_call_duration_seconds",
+    "Time of the dynamodb calls, by table and index",
+    ("operation", "table", "index"),
+)
+dynamodb_errors = registry.counter(
+    "dynamodb_errors_total",
+    "Dynamodb calls that failed, by error code",
+    ("operation", "table", "code"),
+)
+dynamodb_retries = registry.counter(
+    "dynamodb_retries_total",
+    "Dynamodb calls retried, by error code",
+    ("operation", "table", "code"),
+)
+dynamodb_consumed_capacity = registry.counter(
+    "dynamodb_consumed_capacity_units_total",
+    "Capacity units consumed, as returned by ReturnConsumedCapacity",
+    ("table", "kind"),
+)
+singleflight_calls = registry.counter(
+    "singleflight_calls_total",
+    "Reads executed and reads that shared an identical read in flight",
+    ("name", "result"),
+)
+journal_records = registry.counter(
+    "journal_records_total",
+    "Records appended to, flushed from and recovered by the write-behind "
+    "journals",
+    ("name", "event"),
+)
+journal_fsyncs = registry.counter(
+    "journal_fsyncs_total",
+    "fsync calls of the write-behind journals, each one covers every record "
+    "written before it",
+    ("name",),
+)
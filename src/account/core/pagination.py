@@ -0,0 +1,83 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+
+_lock = threading.Lock()
+_process_secret = None
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def check_secret():
+    """
+    Outside development `CURSOR_SECRET` is required: a secret of the process
+    would make the cursors given by one instance invalid in the others (and
+    after every restart)
+    """
+    if os.environ.get("CURSOR_SECRET"):
+        return
+    if os.environ.get("FLASK_ENV") != "development":
+        raise RuntimeError("CURSOR_SECRET must be defined")
+
+
+def _secret():
+    global _process_secret
+    secret = os.environ.get("CURSOR_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    with _lock:
+        if _process_secret is None:
+            logging.warning(
+                "CURSOR_SECRET not defined, the page cursors will only be "
+                "valid in this process (only allowed in development)"
+            )
+            _process_secret = secrets.token_bytes(32)
+    return _process_secret
+
+
+def _b64encode(data: bytes):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: bytes):
+    return hmac.new(_secret(), payload, hashlib.sha256).digest()
+
+
+def encode_cursor(last_evaluated_key: dict):
+    """
+    Opaque cursor for the `LastEvaluatedKey` of a query, signed so the
+    clients can't craft a `ExclusiveStartKey`
+    """
+    payload = json.dumps(
+        last_evaluated_key, separators=(",", ":"), sort_keys=True
+    ).encode("utf-8")
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        encoded_payload, encoded_signature = cursor.split(".")
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except ValueError as error:
+        raise InvalidCursor() from error
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise InvalidCursor()
+    try:
+        key = json.loads(payload)
+    except ValueError as error:
+        raise InvalidCursor() from error
+    if not isinstance(key, dict):
+        raise InvalidCursor()
+    return key
@@ -0,0 +1,69 @@
+"""
+Coalescing of identical reads in flight.
+
+When many requests read the same item at the same time only the first one
+goes to the database, the others wait for it and get a copy of its result.
+"""
+import copy
+import threading
+
+from src.account.core import metrics
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Calls made with the same key while one is running share its result (or
+    its exception). After a write, `forget` the keys it changed: the calls
+    already running may have read the old value, so the ones made after the
+    write start a new call instead of joining them
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            metrics.singleflight_calls.inc(self.name, "coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # the callers may change their results
+            return copy.copy(call.result)
+
+        metrics.singleflight_calls.inc(self.name, "executed")
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    def forget(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._calls.pop(key, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
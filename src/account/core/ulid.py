@@ -0,0 +1,104 @@
+"""
+Time ordered ids, in the ULID format: 26 characters of crockford base32,
+the first 10 with the millisecond of the id and the other 16 random.
+
+Sorting the ids sorts them by their millisecond, so a sort key made of them
+is in time order and a time range is an id range (see `lower_bound` and
+`upper_bound`). Inside the millisecond the random part starts with the
+microseconds, and the ids made by the process in the same millisecond
+always increase, so they keep the order they were made in.
+"""
+import datetime as dt
+import hashlib
+import re
+import secrets
+import threading
+
+alphabet = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+time_length = 10
+random_length = 16
+random_bits = random_length * 5
+# the random part has the microseconds in the millisecond (10 bits) and
+# the random bits, the highest bit is left out so the increments never
+# overflow
+entropy_bits = random_bits - 11
+pattern = re.compile(f"^[{alphabet}]{{{time_length + random_length}}}$")
+
+_epoch = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+_lock = threading.Lock()
+_last_millisecond = None
+_last_random = 0
+
+
+def _microseconds(moment: dt.datetime):
+    """Microseconds since the epoch, naive datetimes are UTC"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=dt.timezone.utc)
+    return (moment - _epoch) // dt.timedelta(microseconds=1)
+
+
+def millisecond(moment: dt.datetime):
+    return _microseconds(moment) // 1000
+
+
+def _encode(value: int, length: int):
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(alphabet[index])
+    return "".join(reversed(chars))
+
+
+def encode(ms: int, randomness: int):
+    return _encode(ms, time_length) + _encode(randomness, random_length)
+
+
+def new(moment: dt.datetime):
+    """Id of something made at `moment`"""
+    global _last_millisecond, _last_random
+    ms, microsecond = divmod(_microseconds(moment), 1000)
+    randomness = microsecond << entropy_bits | secrets.randbits(entropy_bits)
+    with _lock:
+        if ms == _last_millisecond:
+            randomness = max(randomness, _last_random + 1)
+        _last_millisecond, _last_random = ms, randomness
+    return encode(ms, randomness)
+
+
+def derived(moment: dt.datetime, source: str):
+    """
+    Always the same id for the same `moment` and `source`, to give an
+    ordered id to something that had another one
+    """
+    ms, microsecond = divmod(_microseconds(moment), 1000)
+    digest = hashlib.sha256(source.encode("utf-8")).digest()
+    entropy = int.from_bytes(digest, "big") >> (256 - entropy_bits)
+    return encode(ms, microsecond << entropy_bits | entropy)
+
+
+def millisecond_of(value: str):
+    """Millisecond of an id"""
+    ms = 0
+    for char in value[:time_length]:
+        ms = ms * 32 + alphabet.index(char)
+    return ms
+
+
+def lower_bound(moment: dt.datetime):
+    """Smallest id of the millisecond of `moment`"""
+    return encode(millisecond(moment), 0)
+
+
+def upper_bound(moment: dt.datetime):
+    """Greatest id of the millisecond of `moment`"""
+    return encode(millisecond(moment), 2**random_bits - 1)
+
+
+def is_ulid(value: str):
+    return bool(pattern.match(value))
+
+
+def is_ulid_of(value: str, moment: dt.datetime):
+    """Whether `value` is an id of the millisecond of `moment`, a ULID made
+    at another time would be out of order"""
+    return is_ulid(value) and millisecond_of(value) == millisecond(moment)
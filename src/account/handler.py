@@ -0,0 +1,307 @@
+"""
+Entry point to run the API as a function behind an API Gateway (REST or
+HTTP API, payload 1.0 or 2.0):
+
+    Handler: src.account.handler.handler
+
+Importing this module only loads the standard library, so the function
+starts fast. Flask, boto3 and the application are imported by the first
+invocation and kept (with the dynamodb resources and the schemas) for the
+next ones. The duration of each cold start phase is logged once and
+exported in the `cold_start_seconds` metric.
+
+Synthetic events run locally (on the in memory dynamodb with
+`DYNAMODB_BACKEND=memory`):
+
+    python -m src.account.handler [--event event.json ...] [--repeat 3]
+
+Without `--event` it creates an account and calls some endpoints with it.
+"""
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+_lock = threading.Lock()
+_app = None
+_cold_start = {}
+
+# the content types returned as text, the others are base64 encoded
+text_types = ("text/", "application/json", "application/x-ndjson")
+
+
+def _create_app():
+    # a background probe would be frozen between the invocations, the
+    # health check probes when its result is old instead
+    os.environ.setdefault("HEALTH_CHECK_MODE", "lazy")
+    started_at = time.perf_counter()
+    from src.account import wsgi
+    from src.account.core import metrics
+
+    imported_at = time.perf_counter()
+    app = wsgi.create_app(load_env=False)
+    _cold_start["import"] = imported_at - started_at
+    _cold_start["init"] = time.perf_counter() - imported_at
+    metrics.registry.gauge_callback(
+        "cold_start_seconds",
+        "Duration of each cold start phase of the function",
+        lambda: (((phase,), seconds) for phase, seconds in cold_start()),
+        labelnames=("phase",),
+    )
+    return app
+
+
+def application():
+    """The flask application, created by the first call"""
+    global _app
+    if _app is None:
+        with _lock:
+            if _app is None:
+                _app = _create_app()
+    return _app
+
+
+def cold_start():
+    """(phase, seconds) of the cold start: the imports, the application
+    creation and the first request"""
+    return list(_cold_start.items())
+
+
+def _headers(event: dict):
+    """Lowercase names, the repeated values joined by commas"""
+    multi_value = event.get("multiValueHeaders")
+    if multi_value:
+        headers = {
+            name.lower(): ",".join(values)
+            for name, values in multi_value.items()
+        }
+    else:
+        headers = {
+            name.lower(): value
+            for name, value in (event.get("headers") or {}).items()
+        }
+    if event.get("cookies"):
+        headers["cookie"] = "; ".join(event["cookies"])
+    return headers
+
+
+def _query_string(event: dict):
+    if event.get("version") == "2.0":
+        return event.get("rawQueryString", "")
+    multi_value = event.get("multiValueQueryStringParameters")
+    if multi_value:
+        return urllib.parse.urlencode(
+            [(k, v) for k, values in multi_value.items() for v in values]
+        )
+    return urllib.parse.urlencode(event.get("queryStringParameters") or {})
+
+
+def environ_from_event(event: dict, context=None):
+    """WSGI environment of an API Gateway event"""
+    if event.get("version") == "2.0":
+        http = event["requestContext"]["http"]
+        method = http["method"]
+        path = urllib.parse.unquote(event.get("rawPath") or "/")
+        source_ip = http.get("sourceIp", "")
+    else:
+        method = event["httpMethod"]
+        path = event.get("path") or "/"
+        identity = event.get("requestContext", {}).get("identity", {})
+        source_ip = identity.get("sourceIp", "")
+    headers = _headers(event)
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode("utf-8")
+
+    environ = {
+        "REQUEST_METHOD": method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": _query_string(event),
+        "SERVER_NAME": headers.get("host", "localhost"),
+        "SERVER_PORT": headers.get("x-forwarded-port", "443"),
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "REMOTE_ADDR": source_ip,
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": headers.get("x-forwarded-proto", "https"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "aws.event": event,
+        "aws.context": context,
+    }
+    for name, value in headers.items():
+        key = name.upper().replace("-", "_")
+        if key == "CONTENT_TYPE":
+            environ[key] = value
+        elif key != "CONTENT_LENGTH":
+            # the length is the one of the decoded body
+            environ[f"HTTP_{key}"] = value
+    return environ
+
+
+def _response(event: dict, status: int, headers: list, body: bytes):
+    content_type = next(
+        (value for name, value in headers if name.lower() == "content-type"),
+        "",
+    )
+    binary = bool(body) and not content_type.startswith(text_types)
+    response = {
+        "statusCode": status,
+        "body": (
+            base64.b64encode(body).decode("ascii")
+            if binary
+            else body.decode("utf-8")
+        ),
+        "isBase64Encoded": binary,
+    }
+    if event.get("version") == "2.0":
+        response["headers"] = {}
+        cookies = []
+        for name, value in headers:
+            if name.lower() == "set-cookie":
+                cookies.append(value)
+            elif name in response["headers"]:
+                response["headers"][name] += f",{value}"
+            else:
+                response["headers"][name] = value
+        if cookies:
+            response["cookies"] = cookies
+    else:
+        response["multiValueHeaders"] = {}
+        for name, value in headers:
+            response["multiValueHeaders"].setdefault(name, []).append(value)
+    return response
+
+
+def handler(event: dict, context=None):
+    app = application()
+    started_at = time.perf_counter()
+    started = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+        return chunks.append
+
+    result = app(environ_from_event(event, context), start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+    if "request" not in _cold_start:
+        _cold_start["request"] = time.perf_counter() - started_at
+        logging.info(
+            "Cold start: "
+            + json.dumps({phase: round(s, 4) for phase, s in cold_start()})
+        )
+    return _response(
+        event, started["status"], started["headers"], b"".join(chunks)
+    )
+
+
+def make_event(
+    method: str,
+    path: str,
+    query: dict = None,
+    body=None,
+    headers: dict = None,
+):
+    """Synthetic API Gateway event (HTTP API, payload 2.0)"""
+    headers = {"host": "localhost", **(headers or {})}
+    if body is not None and not isinstance(body, str):
+        body = json.dumps(body)
+        headers.setdefault("content-type", "application/json")
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": urllib.parse.urlencode(query or {}),
+        "headers": headers,
+        "requestContext": {
+            "http": {"method": method, "path": path, "sourceIp": "127.0.0.1"}
+        },
+        "body": body,
+        "isBase64Encoded": False,
+    }
+
+
+def sample_events():
+    """Creates an account and yields events using it"""
+    created = handler(
+        make_event(
+            "POST",
+            "/v1/account",
+            body={
+                "saldo": 1000,
+                "flagAtivo": True,
+                "limiteSaqueDiario": 500,
+                "tipoConta": 1,
+                "idPessoa": "local",
+            },
+        )
+    )
+    path = created["headers"]["Content-Location"]
+    yield make_event("POST", f"{path}/deposit", body={"valor": 10})
+    yield make_event("POST", f"{path}/withdraw", body={"valor": 5})
+    yield make_event("GET", f"{path}/balance")
+    yield make_event("GET", f"{path}/transactions", {"page-size": 10})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--event",
+        action="append",
+        help="json file with an event, a sample scenario when not given",
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    def events():
+        if not args.event:
+            return list(sample_events())
+        loaded = []
+        for path in args.event:
+            with open(path) as event_file:
+                loaded.append(json.load(event_file))
+        return loaded
+
+    invocations = []
+    for event in events() * args.repeat:
+        started_at = time.perf_counter()
+        response = handler(event)
+        invocations.append(
+            {
+                "method": event.get("httpMethod")
+                or event["requestContext"]["http"]["method"],
+                "path": event.get("rawPath") or event.get("path"),
+                "status": response["statusCode"],
+                "seconds": time.perf_counter() - started_at,
+            }
+        )
+    print(
+        json.dumps(
+            {"cold_start": dict(cold_start()), "invocations": invocations},
+            indent=2,
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Database health probed in background, the health check endpoint only reads
+the last result so the load balancer probes never reach dynamodb.
+
+Where a background thread would be frozen between the requests (the
+serverless handler) the prober is `lazy`: the health check probes the
+tables itself when the last result is older than the interval.
+"""
+import datetime as dt
+import logging
+import threading
+import time
+from typing import Iterable, Optional
+
+import botocore.exceptions
+
+from src.account.account.models import Account, Person, Transaction
+from src.account.core import metrics
+from src.account.core.aws.dynamodb import registry
+from src.account.health_check.serializers import Check, HealthCheck, TableCheck
+
+process_started = time.monotonic()
+
+
+class HealthProber:
+    def __init__(self, table_names: Iterable[str], interval: float = 10):
+        self.table_names = tuple(table_names)
+        self.interval = interval
+        self.lazy = False
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._tables = {}
+        self._probed_at = None
+
+    def probe_table(self, table_name: str):
+        """DescribeTable is a control plane call, it consumes no capacity"""
+        started = time.perf_counter()
+        try:
+            with metrics.dynamodb_call_duration.time(
+                "describe_table", table_name, ""
+            ):
+                resp = registry.resource().meta.client.describe_table(
+                    TableName=table_name
+                )
+            table_status = resp["Table"]["TableStatus"]
+            status = "UP" if table_status in ("ACTIVE", "UPDATING") else "DOWN"
+            last_error = None if status == "UP" else f"status {table_status}"
+        except (
+            botocore.exceptions.BotoCoreError,
+            botocore.exceptions.ClientError,
+        ) as error:
+            status, last_error = "DOWN", str(error)
+        previous = self._tables.get(table_name)
+        if last_error is None and previous:
+            last_error = previous.last_error
+        return TableCheck(
+            status=status,
+            latency_ms=round((time.perf_counter() - started) * 1000, 3),
+            last_error=last_error,
+            checked_at=dt.datetime.now(dt.timezone.utc).isoformat(),
+        )
+
+    def probe(self):
+        tables = {name: self.probe_table(name) for name in self.table_names}
+        with self._lock:
+            self._tables = tables
+            self._probed_at = time.monotonic()
+        for name, check in tables.items():
+            if check.status == "DOWN":
+                logging.warning(
+                    f"[{name}] health probe failed: {check.last_error}"
+                )
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.probe()
+            except Exception:
+                logging.exception("Health probe crashed")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="health-prober", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread:
+            thread.join()
+
+    def _stale(self):
+        with self._lock:
+            probed_at = self._probed_at
+        return (
+            probed_at is None or time.monotonic() - probed_at > self.interval
+        )
+
+    def result(self):
+        if self.lazy and self._stale():
+            # a single probe at a time, the others wait for its result
+            with self._probe_lock:
+                if self._stale():
+                    self.probe()
+        with self._lock:
+            tables = dict(self._tables)
+            probed_at = self._probed_at
+        # a result older than a few intervals means the prober is stuck
+        fresh = (
+            probed_at is not None
+            and time.monotonic() - probed_at <= self.interval * 3
+        )
+        database = (
+            "UP"
+            if fresh and all(t.status == "UP" for t in tables.values())
+            else "DOWN"
+        )
+        return HealthCheck(
+            status=database,
+            uptime=int(time.monotonic() - process_started),
+            checks=Check(database=database, tables=tables),
+        )
+
+
+prober = HealthProber(
+    (Account.table_name, Transaction.table_name, Person.table_name)
+)
@@ -1,12 +1,21 @@
-from dataclasses import dataclass
-from typing import Literal
+from dataclasses import dataclass, field
+from typing import Literal, Optional
 
 Status = Literal["UP", "DOWN"]
 
 
+@dataclass
+class TableCheck:
+    status: Status
+    latency_ms: float
+    last_error: Optional[str]
+    checked_at: str
+
+
 @dataclass
 class Check:
     database: Status
+    tables: dict = field(default_factory=dict)
 
 
 @dataclass
@@ -3,14 +3,19 @@ from http import HTTPStatus
 
 from flask import Blueprint
 
-from src.account.health_check.serializers import Check, HealthCheck
+from src.account.health_check.prober import prober
 
 bp = Blueprint("health-check", __name__)
 
 
 @bp.route("", methods=["GET"])
 def get_health_check():
-    # TODO verify database status
-    return asdict(
-        HealthCheck(status="UP", uptime=1, checks=Check(database="UP"))
-    ), HTTPStatus.OK
+    """Last result of the prober, only calls the database when it's lazy
+    and the result is older than the interval"""
+    health_check = prober.result()
+    status_code = (
+        HTTPStatus.OK
+        if health_check.status == "UP"
+        else HTTPStatus.SERVICE_UNAVAILABLE
+    )
+    return asdict(health_check), status_code
@@ -0,0 +1,16 @@
+from http import HTTPStatus
+
+from flask import Blueprint
+
+from src.account.core import metrics
+
+bp = Blueprint("metrics", __name__)
+
+content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@bp.route("", methods=["GET"])
+def get_metrics():
+    return metrics.registry.render(), HTTPStatus.OK, {
+        "Content-Type": content_type
+    }
@@ -1,17 +1,100 @@
-from dotenv import load_dotenv
+import os
+
 from flask import Flask
 
+from src.account.account import models
 from src.account.account.views import bp as account
+from src.account.health_check.prober import prober
 from src.account.health_check.views import bp as health_check
+from src.account.metrics.views import bp as metrics_views
+from src.account.core import metrics, pagination
+from src.account.core.aws.dynamodb import registry, retry_policy
 from src.account.core.hooks import errors
 
-load_dotenv()
 
+def create_app(load_env: bool = True):
+    """`load_env` reads the `.env` file, the serverless handler has the
+    variables set by the function"""
+    if load_env:
+        from dotenv import load_dotenv
 
-def create_app():
+        load_dotenv()
+    pagination.check_secret()
     app = Flask("account management")
     app.register_blueprint(account, url_prefix="/v1/account")
     app.register_blueprint(health_check, url_prefix="/v1/health-check")
+    app.register_blueprint(metrics_views, url_prefix="/v1/metrics")
     app.register_blueprint(errors)
 
+    models.Account.cache.configure(
+        maxsize=int(os.environ.get("ACCOUNT_CACHE_SIZE", 1024)),
+        ttl=float(os.environ.get("ACCOUNT_CACHE_TTL", 30)),
+    )
+    # accounts whose deposits are spread over shard items
+    models.BalanceShard.configure(
+        accounts=[
+            account_id.strip()
+            for account_id in os.environ.get("SHARDED_ACCOUNTS", "").split(",")
+            if account_id.strip()
+        ],
+        count=int(os.environ.get("BALANCE_SHARDS", 8)),
+    )
+    # transaction records written behind by a local journal
+    journal_directory = os.environ.get("TRANSACTION_JOURNAL_DIR")
+    if journal_directory:
+        models.Transaction.start_journal(
+            journal_directory,
+            float(os.environ.get("TRANSACTION_JOURNAL_FLUSH_INTERVAL", 0.2)),
+        )
+        metrics.registry.gauge_callback(
+            "journal_pending",
+            "Records of the transaction journal not flushed yet",
+            lambda: (
+                ((), journal.pending())
+                for journal in [models.Transaction.journal]
+                if journal
+            ),
+        )
+    metrics.registry.gauge_callback(
+        "account_cache",
+        "Hits, misses and size of the account cache",
+        lambda: (
+            ((stat,), value)
+            for stat, value in models.Account.cache.stats().items()
+        ),
+        labelnames=("stat",),
+    )
+    app.config["FANOUT_TIMEOUT"] = float(
+        os.environ.get("FANOUT_TIMEOUT", 5)
+    )
+    app.config["DYNAMODB_REQUEST_RETRIES"] = int(
+        os.environ.get("DYNAMODB_REQUEST_RETRIES", 6)
+    )
+    retry_policy.configure(
+        max_attempts=int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", 4)),
+        threshold=int(os.environ.get("DYNAMODB_BREAKER_THRESHOLD", 10)),
+        cooldown=float(os.environ.get("DYNAMODB_BREAKER_COOLDOWN", 5)),
+    )
+    metrics.registry.gauge_callback(
+        "dynamodb_circuit_open",
+        "Tables whose calls are failing fast after persistent throttling",
+        lambda: (
+            ((table,), 1) for table in retry_policy.breaker.open_tables()
+        ),
+        labelnames=("table",),
+    )
+    registry.warm(
+        models.Account.table_name,
+        models.Transaction.table_name,
+        models.Person.table_name,
+    )
+    # 0 disables the prober, the health check then reports the database down
+    probe_interval = float(os.environ.get("HEALTH_CHECK_INTERVAL", 10))
+    if probe_interval > 0:
+        prober.interval = probe_interval
+        if os.environ.get("HEALTH_CHECK_MODE", "background") == "lazy":
+            prober.lazy = True
+        else:
+            prober.start()
+
     return app
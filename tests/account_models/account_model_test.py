@@ -9,15 +9,25 @@ import pytest
 from botocore.exceptions import ClientError
 from werkzeug.exceptions import HTTPException
 
-from src.account.account.models import Account
+from src.account.account.models import (
+    Account,
+    DailyWithdraw,
+    DuplicateRequest,
+    Idempotency,
+    Transaction,
+)
 
 
 @pytest.mark.usefixtures("client")
 class TestAccountBalanceScenarios(unittest.TestCase):
     mock_resource_path = "src.account.account.models.DynamoResource"
     mock_uuid_path = "src.account.account.models.uuid"
+    mock_ulid_path = "src.account.account.models.ulid"
     mock_datetime_path = "src.account.account.models.dt"
 
+    def setUp(self):
+        Account.cache.clear()
+
     @mock.patch(mock_resource_path)
     @mock.patch(mock_uuid_path)
     @mock.patch(mock_datetime_path)
@@ -43,6 +53,8 @@ class TestAccountBalanceScenarios(unittest.TestCase):
                 "daily_withdraw_limit": d.Decimal("500"),
                 "active": True,
                 "account_type": 33,
+                "version": 1,
+                "ordered_transaction_ids": True,
             },
         )
 
@@ -52,43 +64,117 @@ class TestAccountBalanceScenarios(unittest.TestCase):
 
         Account.find_one_by_id("333")
 
-        mock_resource_instance.find_one_by_id.assert_called_once_with(
+        mock_resource_instance.get_item.assert_called_once_with(
             Account.table_name,
-            {"hash_key": "id", "hash_value": "333"},
+            {"id": "333"},
+            consistent_read=False,
         )
 
     @mock.patch(mock_resource_path)
-    def test_deposit_into(self, mock_resource):
+    def test_find_one_by_id_uses_cache(self, mock_resource):
         mock_resource_instance = mock_resource.return_value
-        mock_table_instance = mock_resource_instance.table_resource.return_value
+        mock_resource_instance.get_item.return_value = {"id": "333"}
 
-        Account.deposit_into("3433", d.Decimal("33.42"))
+        Account.find_one_by_id("333")
+        account = Account.find_one_by_id("333")
 
-        mock_table_instance.update_item.assert_called_once_with(
-            Key={"id": "3433"},
-            UpdateExpression="SET #balance = #balance + :balance",
-            ExpressionAttributeNames={
-                "#balance": "balance",
-                "#blocked": "blocked",
-            },
-            ExpressionAttributeValues={
-                ":balance": d.Decimal("33.42"),
-                ":blocked": False,
-            },
-            ConditionExpression="#blocked = :blocked",
+        self.assertEqual(account, {"id": "333"})
+        mock_resource_instance.get_item.assert_called_once()
+
+    @mock.patch(mock_resource_path)
+    def test_find_one_by_id_consistent_skips_cache(self, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        mock_resource_instance.get_item.return_value = {"id": "333"}
+
+        Account.find_one_by_id("333")
+        Account.find_one_by_id("333", consistent_read=True)
+
+        mock_resource_instance.get_item.assert_called_with(
+            Account.table_name, {"id": "333"}, consistent_read=True
         )
+        self.assertEqual(mock_resource_instance.get_item.call_count, 2)
 
     @mock.patch(mock_resource_path)
-    def test_deposit_into_launches_fail_condition_error(self, mock_resource):
+    def test_writes_invalidate_the_cache(self, mock_resource):
         mock_resource_instance = mock_resource.return_value
-        mock_table_instance = mock_resource_instance.table_resource.return_value
+        mock_resource_instance.get_item.return_value = {"id": "333"}
 
-        mock_table_instance.update_item.side_effect = ClientError(
+        Account.find_one_by_id("333")
+        Account.block("333", True)
+        Account.find_one_by_id("333")
+        Account.deposit_into("333", d.Decimal("1"))
+        Account.find_one_by_id("333")
+
+        self.assertEqual(mock_resource_instance.get_item.call_count, 3)
+
+    @mock.patch(mock_resource_path)
+    @mock.patch(mock_ulid_path)
+    @mock.patch(mock_datetime_path)
+    def test_deposit_into(self, mock_datetime, mock_ulid, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        mock_ulid.new.return_value = "123"
+        current_date = dt.datetime.now(dt.timezone.utc)
+        mock_datetime.datetime.now.return_value = current_date
+
+        transaction_id = Account.deposit_into("3433", d.Decimal("33.42"))
+
+        self.assertEqual(transaction_id, "123")
+        mock_resource_instance.transact_write_items.assert_called_once_with(
+            [
+                {
+                    "Update": {
+                        "TableName": Account.table_name,
+                        "Key": {"id": "3433"},
+                        "UpdateExpression": (
+                            "SET #balance = #balance + :balance, "
+                            "#version = if_not_exists(#version, :zero) "
+                            "+ :version_step, #updated_at = :updated_at"
+                        ),
+                        "ExpressionAttributeNames": {
+                            "#balance": "balance",
+                            "#blocked": "blocked",
+                            "#version": "version",
+                            "#updated_at": "updated_at",
+                        },
+                        "ExpressionAttributeValues": {
+                            ":balance": d.Decimal("33.42"),
+                            ":blocked": False,
+                            ":zero": 0,
+                            ":version_step": 1,
+                            ":updated_at": current_date.isoformat(),
+                        },
+                        "ConditionExpression": "#blocked = :blocked",
+                    }
+                },
+                {
+                    "Put": {
+                        "TableName": Transaction.table_name,
+                        "Item": {
+                            "id": "123",
+                            "account_id": "3433",
+                            "created_at": current_date.isoformat(),
+                            "value": d.Decimal("33.42"),
+                        },
+                        "ConditionExpression": "attribute_not_exists(#id)",
+                        "ExpressionAttributeNames": {"#id": "id"},
+                    }
+                },
+            ]
+        )
+
+    @mock.patch(mock_resource_path)
+    def test_deposit_into_launches_fail_condition_error(self, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        mock_resource_instance.transact_write_items.side_effect = ClientError(
             {
                 "Error": {
-                    "Code": "ConditionalCheckFailedException",
+                    "Code": "TransactionCanceledException",
                     "Message": "Everything fails dramatically! And you get sad!",
-                }
+                },
+                "CancellationReasons": [
+                    {"Code": "ConditionalCheckFailed"},
+                    {"Code": "None"},
+                ],
             },
             "walking without looking",
         )
@@ -105,9 +191,7 @@ class TestAccountBalanceScenarios(unittest.TestCase):
     @mock.patch(mock_resource_path)
     def test_deposit_into_launches_fail_error_not_handled(self, mock_resource):
         mock_resource_instance = mock_resource.return_value
-        mock_table_instance = mock_resource_instance.table_resource.return_value
-
-        mock_table_instance.update_item.side_effect = ClientError(
+        mock_resource_instance.transact_write_items.side_effect = ClientError(
             {
                 "Error": {
                     "Code": "InternalServerError",
@@ -121,44 +205,174 @@ class TestAccountBalanceScenarios(unittest.TestCase):
         mock_resource_instance.handle_error.assert_called_once()
 
     @mock.patch(mock_resource_path)
-    def test_withdraw(self, mock_resource):
+    @mock.patch(mock_ulid_path)
+    @mock.patch(mock_datetime_path)
+    def test_withdraw(self, mock_datetime, mock_ulid, mock_resource):
         mock_resource_instance = mock_resource.return_value
-        mock_table_instance = mock_resource_instance.table_resource.return_value
+        mock_ulid.new.return_value = "123"
+        current_date = dt.datetime(2021, 6, 13, 20, 14, tzinfo=dt.timezone.utc)
+        mock_datetime.datetime.now.return_value = current_date
+        mock_datetime.datetime.strptime = dt.datetime.strptime
+        mock_datetime.timedelta = dt.timedelta
+        mock_datetime.timezone = dt.timezone
 
-        Account.withdraw("3433", d.Decimal("33.42"))
+        transaction_id = Account.withdraw(
+            "3433", d.Decimal("33.42"), d.Decimal("100")
+        )
 
-        mock_table_instance.update_item.assert_called_once_with(
-            Key={"id": "3433"},
-            UpdateExpression="SET #balance = #balance - :balance",
-            ExpressionAttributeNames={
-                "#balance": "balance",
-                "#blocked": "blocked",
+        self.assertEqual(transaction_id, "123")
+        account_update, daily_update, transaction_put = (
+            mock_resource_instance.transact_write_items.call_args.args[0]
+        )
+        self.assertEqual(
+            account_update["Update"]["UpdateExpression"],
+            "SET #balance = #balance - :balance, "
+            "#version = if_not_exists(#version, :zero) + :version_step, "
+            "#updated_at = :updated_at",
+        )
+        self.assertEqual(
+            account_update["Update"]["ConditionExpression"],
+            "#blocked = :blocked And #balance > :balance",
+        )
+        self.assertEqual(
+            daily_update["Update"],
+            {
+                "TableName": DailyWithdraw.table_name,
+                "Key": {"account_id": "3433", "withdraw_date": "2021-06-13"},
+                "UpdateExpression": "ADD #total :value SET #expires = :expires",
+                "ExpressionAttributeNames": {
+                    "#total": "total",
+                    "#expires": "expires_at",
+                },
+                "ExpressionAttributeValues": {
+                    ":value": d.Decimal("33.42"),
+                    ":expires": int(
+                        dt.datetime(
+                            2021, 6, 15, tzinfo=dt.timezone.utc
+                        ).timestamp()
+                    ),
+                    ":available": d.Decimal("66.58"),
+                },
+                "ConditionExpression": (
+                    "attribute_not_exists(#total) Or #total <= :available"
+                ),
             },
-            ExpressionAttributeValues={
-                ":balance": d.Decimal("33.42"),
-                ":blocked": False,
+        )
+        self.assertEqual(
+            transaction_put["Put"]["Item"],
+            {
+                "id": "123",
+                "account_id": "3433",
+                "created_at": current_date.isoformat(),
+                "value": d.Decimal("-33.42"),
+                "withdraw_date": "2021-06-13",
+            },
+        )
+
+    @mock.patch(mock_resource_path)
+    def test_withdraw_over_balance_or_blocked(self, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        mock_resource_instance.transact_write_items.side_effect = ClientError(
+            {
+                "Error": {"Code": "TransactionCanceledException", "Message": ""},
+                "CancellationReasons": [
+                    {"Code": "ConditionalCheckFailed"},
+                    {"Code": "None"},
+                    {"Code": "None"},
+                ],
+            },
+            "walking without looking",
+        )
+
+        with self.assertRaises(HTTPException) as err:
+            Account.withdraw("3433", d.Decimal("33.42"), d.Decimal("100"))
+
+        self.assertEqual(err.exception.response.status_code, HTTPStatus.FORBIDDEN)
+        self.assertEqual(
+            err.exception.response.json,
+            {
+                "error": "Account got blocked before the deposit execution"
+                " or the withdraw was more than the balance available"
+            },
+        )
+
+    @mock.patch(mock_resource_path)
+    def test_withdraw_over_daily_limit_available(self, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        mock_resource_instance.transact_write_items.side_effect = ClientError(
+            {
+                "Error": {"Code": "TransactionCanceledException", "Message": ""},
+                "CancellationReasons": [
+                    {"Code": "None"},
+                    {"Code": "ConditionalCheckFailed"},
+                    {"Code": "None"},
+                ],
+            },
+            "walking without looking",
+        )
+        mock_resource_instance.get_item.return_value = {"total": d.Decimal("33")}
+
+        with self.assertRaises(HTTPException) as err:
+            Account.withdraw("3433", d.Decimal("54"), d.Decimal("55"))
+
+        self.assertEqual(err.exception.response.status_code, HTTPStatus.FORBIDDEN)
+        self.assertEqual(
+            err.exception.response.json,
+            {
+                "error": "It is not possible to carry out the withdraw. "
+                "Withdraw available is R$ 22"
             },
-            ConditionExpression="#blocked = :blocked And #balance > :balance",
         )
 
     @mock.patch(mock_resource_path)
-    def test_block_account(self, mock_resource):
+    @mock.patch(mock_datetime_path)
+    def test_block_account(self, mock_datetime, mock_resource):
         mock_resource_instance = mock_resource.return_value
         mock_table_instance = mock_resource_instance.table_resource.return_value
+        current_date = dt.datetime.now(dt.timezone.utc)
+        mock_datetime.datetime.now.return_value = current_date
 
         Account.block("3433", True)
 
         mock_table_instance.update_item.assert_called_once_with(
             Key={"id": "3433"},
-            UpdateExpression="SET #blocked = :blocked",
+            UpdateExpression=(
+                "SET #blocked = :blocked, "
+                "#version = if_not_exists(#version, :zero) + :version_step, "
+                "#updated_at = :updated_at"
+            ),
             ExpressionAttributeNames={
                 "#blocked": "blocked",
+                "#version": "version",
+                "#updated_at": "updated_at",
             },
             ExpressionAttributeValues={
                 ":blocked": True,
+                ":zero": 0,
+                ":version_step": 1,
+                ":updated_at": current_date.isoformat(),
             },
         )
 
+    @mock.patch(mock_resource_path)
+    def test_find_version(self, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        mock_resource_instance.get_item.return_value = {
+            "id": "3433",
+            "version": d.Decimal(7),
+        }
+
+        self.assertEqual(Account.find_version("3433"), 7)
+        mock_resource_instance.get_item.assert_called_once_with(
+            Account.table_name,
+            {"id": "3433"},
+            projection=["id", "version"],
+            consistent_read=True,
+        )
+
+        mock_resource_instance.get_item.return_value = None
+        self.assertIsNone(Account.find_version("3433"))
+
     @mock.patch(mock_resource_path)
     def test_block_validation_exception(self, mock_resource):
         mock_resource_instance = mock_resource.return_value
@@ -198,3 +412,50 @@ class TestAccountBalanceScenarios(unittest.TestCase):
 
         Account.block("3433", True)
         mock_resource_instance.handle_error.assert_called_once()
+
+    @mock.patch(mock_resource_path)
+    @mock.patch(mock_ulid_path)
+    def test_deposit_saves_idempotency_record(self, mock_ulid, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        mock_ulid.new.return_value = "123"
+        record = Idempotency.new_item("3433", "deposit", "key-1", b"{}")
+
+        Account.deposit_into("3433", d.Decimal("1"), record)
+
+        (items,) = mock_resource_instance.transact_write_items.call_args.args
+        put = items[-1]["Put"]
+        self.assertEqual(put["TableName"], Idempotency.table_name)
+        self.assertEqual(put["ReturnValuesOnConditionCheckFailure"], "ALL_OLD")
+        self.assertEqual(put["Item"]["key"], "3433#deposit#key-1")
+        self.assertEqual(put["Item"]["status"], HTTPStatus.CREATED)
+        self.assertEqual(put["Item"]["transaction_id"], "123")
+        self.assertEqual(
+            put["Item"]["content_location"], "/account/3433/transaction/123"
+        )
+
+    @mock.patch(mock_resource_path)
+    def test_deposit_with_used_idempotency_key(self, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        saved = {"key": "3433#deposit#key-1", "status": 201}
+        mock_resource.deserialize.return_value = saved
+        mock_resource_instance.transact_write_items.side_effect = ClientError(
+            {
+                "Error": {
+                    "Code": "TransactionCanceledException",
+                    "Message": "Transaction cancelled",
+                },
+                "CancellationReasons": [
+                    {"Code": "None"},
+                    {"Code": "None"},
+                    {"Code": "ConditionalCheckFailed", "Item": {"S": "..."}},
+                ],
+            },
+            "TransactWriteItems",
+        )
+        record = Idempotency.new_item("3433", "deposit", "key-1", b"{}")
+
+        with self.assertRaises(DuplicateRequest) as err:
+            Account.deposit_into("3433", d.Decimal("1"), record)
+
+        self.assertEqual(err.exception.record, saved)
+        mock_resource_instance.handle_error.assert_not_called()
@@ -0,0 +1,103 @@
+import datetime as dt
+import decimal as d
+import json
+import unittest
+from unittest import mock
+
+from src.account.account.backfill import backfill
+from src.account.core import ulid
+
+
+class TestBackfillScenarios(unittest.TestCase):
+    mock_resource_path = "src.account.account.models.DynamoResource"
+
+    @staticmethod
+    def line(**transaction):
+        return json.dumps(transaction) + "\n"
+
+    @mock.patch(mock_resource_path)
+    def test_writes_in_batches_of_25(self, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        lines = [
+            self.line(
+                idTransacao=str(i),
+                idConta="321",
+                valor=-10 if i % 2 else 10,
+                dataTransacao="2021-06-13T20:14:29-03:00",
+            )
+            for i in range(60)
+        ]
+
+        report = backfill(lines, workers=2)
+
+        self.assertEqual(report.rows, 60)
+        self.assertEqual(report.written, 60)
+        self.assertEqual(report.errors, [])
+        batches = [
+            c.args[1] for c in mock_resource_instance.batch_write.call_args_list
+        ]
+        self.assertEqual(sorted(len(b) for b in batches), [10, 25, 25])
+        items = {
+            item["legacy_id"]: item for batch in batches for item in batch
+        }
+        created_at = dt.datetime(2021, 6, 13, 23, 14, 29, tzinfo=dt.timezone.utc)
+        # the ids of the file are replaced by time ordered ones
+        self.assertEqual(
+            items["1"],
+            {
+                "id": ulid.derived(created_at, "1"),
+                "legacy_id": "1",
+                "account_id": "321",
+                "created_at": "2021-06-13T23:14:29+00:00",
+                "value": d.Decimal("-10"),
+                "withdraw_date": "2021-06-13",
+            },
+        )
+        self.assertNotIn("withdraw_date", items["2"])
+        # the account listing changed, so its version too
+        mock_table = mock_resource_instance.table_resource.return_value
+        mock_table.update_item.assert_called_once()
+        self.assertEqual(
+            mock_table.update_item.call_args.kwargs["Key"], {"id": "321"}
+        )
+
+    @mock.patch(mock_resource_path)
+    def test_invalid_lines_are_reported(self, mock_resource):
+        lines = [
+            self.line(idConta="321", valor=5, dataTransacao="2021-06-13T10:00"),
+            "not json\n",
+            "\n",
+            self.line(valor=5, dataTransacao="2021-06-13T20:14:29"),
+        ]
+
+        report = backfill(lines)
+
+        self.assertEqual(report.rows, 3)
+        self.assertEqual(report.written, 1)
+        self.assertEqual(
+            report.errors,
+            [
+                {"linha": 2, "erro": "Invalid json"},
+                {
+                    "linha": 4,
+                    "erro": {"idConta": ["Missing data for required field."]},
+                },
+            ],
+        )
+
+    @mock.patch(mock_resource_path)
+    def test_failed_batches_are_reported(self, mock_resource):
+        mock_resource.return_value.batch_write.side_effect = Exception()
+        lines = [
+            self.line(
+                idTransacao="1",
+                idConta="321",
+                valor=5,
+                dataTransacao="2021-06-13T20:14:29",
+            )
+        ]
+
+        report = backfill(lines)
+
+        self.assertEqual(report.written, 0)
+        self.assertEqual(report.errors[0]["transacoes"], ["1"])
@@ -0,0 +1,160 @@
+import unittest
+from decimal import Decimal
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+from werkzeug.exceptions import HTTPException
+
+from src.account.account import compaction
+from src.account.account.models import Account, BalanceShard
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import DynamoResource, registry
+
+
+@pytest.mark.usefixtures("application")
+class TestBalanceShard(unittest.TestCase):
+    def setUp(self):
+        environ = mock.patch.dict(
+            "src.account.core.aws.dynamodb.os.environ",
+            {"DYNAMODB_BACKEND": "memory", "FLASK_ENV": "development"},
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        registry.clear()
+        self.addCleanup(registry.clear)
+        memory.shared_resource().reset()
+        Account.cache.clear()
+        self.account_id = Account.add(
+            "p", Decimal("100"), Decimal("1000"), True, 1
+        )
+        BalanceShard.configure([self.account_id], 4)
+        self.addCleanup(BalanceShard.configure, [], 8)
+
+    def account_item(self):
+        return memory.shared_resource().Table("account").get_item(
+            Key={"id": self.account_id}
+        )["Item"]
+
+    def shards(self):
+        return BalanceShard.find_all(self.account_id, consistent_read=True)
+
+    def balance(self):
+        account = Account.find_one_by_id(self.account_id, consistent_read=True)
+        return account["balance"]
+
+    def test_deposits_go_to_the_shards(self):
+        for _ in range(20):
+            Account.deposit_into(self.account_id, Decimal("10"))
+
+        self.assertEqual(self.account_item()["balance"], 100)
+        self.assertEqual(len(self.shards()), 4)
+        self.assertEqual(sum(s["balance"] for s in self.shards()), 200)
+        self.assertEqual(self.balance(), 300)
+
+    def test_shards_are_partitions(self):
+        BalanceShard.create(self.account_id)
+        table = memory.shared_resource().Table(BalanceShard.table_name)
+
+        with mock.patch.object(
+            DynamoResource,
+            "batch_get_item",
+            autospec=True,
+            side_effect=DynamoResource.batch_get_item,
+        ) as batch_get_item:
+            shards = self.shards()
+
+        batch_get_item.assert_called_once()
+        self.assertEqual(
+            sorted(s[BalanceShard.hash_key] for s in table.scan()["Items"]),
+            [f"{self.account_id}#{n}" for n in range(4)],
+        )
+        self.assertEqual(
+            sorted(BalanceShard.number_of(s) for s in shards), [0, 1, 2, 3]
+        )
+
+    def test_version_counts_the_shards(self):
+        version = Account.find_version(self.account_id)
+        Account.deposit_into(self.account_id, Decimal("10"))
+
+        self.assertGreater(Account.find_version(self.account_id), version)
+        self.assertEqual(
+            Account.find_one_by_id(self.account_id, True)["version"],
+            Account.find_version(self.account_id),
+        )
+
+    def test_withdraw_folds_the_shards(self):
+        Account.deposit_into(self.account_id, Decimal("50"))
+        Account.deposit_into(self.account_id, Decimal("50"))
+
+        Account.withdraw(self.account_id, Decimal("150"), Decimal("1000"))
+
+        self.assertEqual(self.account_item()["balance"], 50)
+        self.assertTrue(all(s["balance"] == 0 for s in self.shards()))
+        self.assertEqual(self.balance(), 50)
+
+    def test_withdraw_more_than_the_total(self):
+        Account.deposit_into(self.account_id, Decimal("50"))
+
+        with self.assertRaises(HTTPException) as error:
+            Account.withdraw(self.account_id, Decimal("200"), Decimal("1000"))
+
+        self.assertEqual(
+            error.exception.response.status_code, HTTPStatus.FORBIDDEN
+        )
+        self.assertEqual(self.balance(), 150)
+
+    def test_blocked_account_refuses_deposits(self):
+        Account.block(self.account_id, True)
+
+        with self.assertRaises(HTTPException) as error:
+            Account.deposit_into(self.account_id, Decimal("10"))
+        Account.block(self.account_id, False)
+        Account.deposit_into(self.account_id, Decimal("10"))
+
+        self.assertEqual(
+            error.exception.response.status_code, HTTPStatus.FORBIDDEN
+        )
+        self.assertEqual(self.balance(), 110)
+        self.assertFalse(self.account_item()["blocked"])
+
+    def test_blocked_before_the_shards_exist(self):
+        memory.shared_resource().Table("account").update_item(
+            Key={"id": self.account_id},
+            UpdateExpression="SET blocked = :blocked",
+            ExpressionAttributeValues={":blocked": True},
+        )
+
+        with self.assertRaises(HTTPException) as error:
+            Account.deposit_into(self.account_id, Decimal("10"))
+
+        self.assertEqual(
+            error.exception.response.status_code, HTTPStatus.FORBIDDEN
+        )
+        self.assertEqual(self.shards(), [])
+
+    def test_block_unknown_account(self):
+        BalanceShard.configure(["unknown"], 4)
+
+        with self.assertRaises(HTTPException) as error:
+            Account.block("unknown", True)
+
+        self.assertEqual(
+            error.exception.response.status_code, HTTPStatus.NOT_FOUND
+        )
+
+    def test_compaction(self):
+        for _ in range(5):
+            Account.deposit_into(self.account_id, Decimal("10"))
+
+        report = compaction.compact([self.account_id])
+        again = compaction.compact([self.account_id])
+
+        self.assertEqual(report["compactadas"], 1)
+        self.assertEqual(again["compactadas"], 0)
+        self.assertEqual(self.account_item()["balance"], 150)
+        self.assertEqual(self.balance(), 150)
+
+    def test_configure_limits(self):
+        with self.assertRaises(ValueError):
+            BalanceShard.configure([], 100)
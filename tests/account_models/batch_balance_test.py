@@ -0,0 +1,78 @@
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+from src.account.account.models import Account, BalanceShard, DailyWithdraw
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import DynamoResource, registry
+
+
+@pytest.mark.usefixtures("application")
+class TestBatchBalance(unittest.TestCase):
+    def setUp(self):
+        environ = mock.patch.dict(
+            "src.account.core.aws.dynamodb.os.environ",
+            {"DYNAMODB_BACKEND": "memory", "FLASK_ENV": "development"},
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        registry.clear()
+        self.addCleanup(registry.clear)
+        memory.shared_resource().reset()
+        Account.cache.clear()
+        self.account_ids = [
+            Account.add("p", Decimal(100 + i), Decimal("50"), True, 1)
+            for i in range(3)
+        ]
+
+    def batch_gets(self):
+        return mock.patch.object(
+            DynamoResource,
+            "batch_get_item",
+            autospec=True,
+            side_effect=DynamoResource.batch_get_item,
+        )
+
+    def test_find_many(self):
+        Account.withdraw(self.account_ids[0], Decimal("30"))
+
+        with self.batch_gets() as batch_get_item:
+            accounts = Account.find_many(
+                [*self.account_ids, "missing"], consistent_read=True
+            )
+
+        self.assertEqual(sorted(accounts), sorted(self.account_ids))
+        self.assertEqual(
+            [accounts[i]["balance"] for i in self.account_ids], [70, 101, 102]
+        )
+        batch_get_item.assert_called_once()
+
+    def test_find_many_merges_the_shards(self):
+        BalanceShard.configure(self.account_ids[1:2], 4)
+        self.addCleanup(BalanceShard.configure, [], 8)
+        Account.deposit_into(self.account_ids[1], Decimal("10"))
+
+        accounts = Account.find_many(self.account_ids, consistent_read=True)
+
+        self.assertEqual(accounts[self.account_ids[1]]["balance"], 111)
+        self.assertEqual(accounts[self.account_ids[2]]["balance"], 102)
+
+    def test_find_totals(self):
+        Account.withdraw(self.account_ids[0], Decimal("30"))
+        Account.withdraw(self.account_ids[0], Decimal("5"))
+        Account.withdraw(self.account_ids[2], Decimal("1"))
+
+        with self.batch_gets() as batch_get_item:
+            totals = DailyWithdraw.find_totals(self.account_ids)
+
+        self.assertEqual(
+            totals,
+            {
+                self.account_ids[0]: 35,
+                self.account_ids[1]: 0,
+                self.account_ids[2]: 1,
+            },
+        )
+        batch_get_item.assert_called_once()
@@ -0,0 +1,118 @@
+import datetime as dt
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+from src.account.account import reconcile, rollup
+from src.account.account.models import Account, Transaction
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import DynamoResource, registry
+
+
+@pytest.mark.usefixtures("application")
+class TestReconcile(unittest.TestCase):
+    def setUp(self):
+        environ = mock.patch.dict(
+            "src.account.core.aws.dynamodb.os.environ",
+            {"DYNAMODB_BACKEND": "memory", "FLASK_ENV": "development"},
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        registry.clear()
+        self.addCleanup(registry.clear)
+        memory.shared_resource().reset()
+        Account.cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.addCleanup(Transaction.stop_journal)
+        self.account_id = Account.add("p", Decimal("100"), Decimal("50"), True, 1)
+
+    def transactions(self):
+        table = memory.shared_resource().Table(Transaction.table_name)
+        return table.scan()["Items"]
+
+    def account(self):
+        return Account.find_one_by_id(self.account_id, consistent_read=True)
+
+    def lost_deposit(self):
+        """A deposit committed by a process that crashed with its journal,
+        returns the transaction record"""
+        journal = Transaction.start_journal(self.directory, flush_interval=60)
+        with mock.patch.object(
+            Transaction, "add_batch", side_effect=ConnectionError()
+        ):
+            Account.deposit_into(self.account_id, Decimal("10"))
+            journal._stop.set()
+            journal._wake.set()
+            journal._thread.join(5)
+            journal._file.close()
+        Transaction.journal = None
+        (record,) = journal.read(journal.path)
+        os.remove(journal.path)
+        return DynamoResource.deserialize(record["item"])
+
+    def later(self):
+        return dt.datetime.now(dt.timezone.utc) + reconcile.pending_grace * 2
+
+    def test_dead_letters_are_flagged_missing(self):
+        journal = Transaction.start_journal(self.directory, flush_interval=60)
+        journal.max_attempts = 1
+        add_batch = Transaction.add_batch
+        poison = []
+
+        def failing(payloads):
+            if any(p["id"] in poison for p in payloads):
+                raise ValueError("invalid record")
+            add_batch(payloads)
+
+        with mock.patch.object(Transaction, "add_batch", side_effect=failing):
+            poison.append(Account.deposit_into(self.account_id, Decimal("10")))
+            flushed = Account.deposit_into(self.account_id, Decimal("5"))
+            self.assertTrue(journal.wait_flushed(5))
+
+        self.assertEqual([t["id"] for t in self.transactions()], [flushed])
+        account = self.account()
+        self.assertFalse(Account.pending_before(account))
+        self.assertEqual(account[Account.missing_attribute], set(poison))
+
+    def test_lost_records_are_flagged_missing(self):
+        payload = self.lost_deposit()
+        tomorrow = dt.datetime.now(dt.timezone.utc) + dt.timedelta(days=1)
+        self.assertIsNone(rollup.roll_up(self.account_id, tomorrow))
+
+        # too recent, its journal may still be recovered
+        report = reconcile.reconcile([self.account_id])
+        self.assertEqual(report["perdidas"], 0)
+        self.assertTrue(Account.pending_before(self.account()))
+
+        report = reconcile.reconcile(now=self.later())
+
+        self.assertEqual(report["itens"], 1)
+        self.assertEqual(report["perdidas"], 1)
+        account = self.account()
+        self.assertFalse(Account.pending_before(account))
+        self.assertEqual(account[Account.missing_attribute], {payload["id"]})
+        self.assertIsNotNone(rollup.roll_up(self.account_id, tomorrow))
+
+        # written by hand
+        Transaction.add_batch([payload])
+        report = reconcile.reconcile(now=self.later())
+
+        self.assertEqual(report["recuperadas"], 1)
+        self.assertNotIn(Account.missing_attribute, self.account())
+
+    def test_flushed_records_stop_being_pending(self):
+        payload = self.lost_deposit()
+        Transaction.add_batch([payload])
+
+        report = reconcile.reconcile([self.account_id], now=self.later())
+
+        self.assertEqual(report["encontradas"], 1)
+        account = self.account()
+        self.assertFalse(Account.pending_before(account))
+        self.assertNotIn(Account.missing_attribute, account)
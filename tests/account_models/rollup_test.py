@@ -0,0 +1,201 @@
+import datetime as dt
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+from src.account.account import rollup
+from src.account.account.models import Account, LedgerRollup, Transaction
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import registry
+
+utc = dt.timezone.utc
+
+
+@pytest.mark.usefixtures("application")
+class TestLedgerRollup(unittest.TestCase):
+    now = dt.datetime(2021, 7, 2, 12, tzinfo=utc)
+
+    def setUp(self):
+        environ = mock.patch.dict(
+            "src.account.core.aws.dynamodb.os.environ",
+            {"DYNAMODB_BACKEND": "memory", "FLASK_ENV": "development"},
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        registry.clear()
+        self.addCleanup(registry.clear)
+        memory.shared_resource().reset()
+        Account.cache.clear()
+        # the balance already has the transactions below
+        self.account_id = Account.add(
+            "p", Decimal("100"), Decimal("50"), True, 1
+        )
+        self.add_transactions(
+            ("2021-05-30T10:00", "50"),
+            ("2021-06-01T00:00", "-20"),
+            ("2021-06-15T23:59", "10"),
+            ("2021-07-02T08:00", "5"),
+        )
+
+    def add_transactions(self, *transactions):
+        Transaction.add_batch(
+            [
+                Transaction.new_item(
+                    self.account_id,
+                    Decimal(value),
+                    dt.datetime.fromisoformat(created_at).replace(tzinfo=utc),
+                )
+                for created_at, value in transactions
+            ]
+        )
+
+    def records(self):
+        table = memory.shared_resource().Table(LedgerRollup.table_name)
+        return {
+            item["period"]: item
+            for item in table.scan()["Items"]
+            if item["account_id"] == self.account_id
+        }
+
+    def test_first_run(self):
+        written = rollup.roll_up(self.account_id, self.now)
+
+        records = self.records()
+        self.assertEqual(written, 5)
+        self.assertEqual(
+            sorted(records),
+            [
+                "D#2021-05-30",
+                "D#2021-06-01",
+                "D#2021-06-15",
+                "M#2021-05",
+                "M#2021-06",
+                "STATE",
+            ],
+        )
+        self.assertEqual(records["D#2021-05-30"]["closing_balance"], 105)
+        self.assertEqual(records["D#2021-06-01"]["closing_balance"], 85)
+        june = records["M#2021-06"]
+        self.assertEqual(
+            (june["deposits"], june["withdrawals"], june["count"]),
+            (10, 20, 2),
+        )
+        self.assertEqual(june["closing_balance"], 95)
+        self.assertEqual(records["STATE"]["closed_through"], "2021-07-01")
+        self.assertEqual(records["STATE"]["opening_balance"], 55)
+
+    def test_next_runs_only_read_the_new_days(self):
+        rollup.roll_up(self.account_id, self.now)
+        self.add_transactions(("2021-07-03T10:00", "-5"))
+
+        same_day = rollup.roll_up(self.account_id, self.now)
+        with mock.patch.object(
+            Transaction, "export", wraps=Transaction.export
+        ) as mock_export:
+            written = rollup.roll_up(
+                self.account_id, self.now + dt.timedelta(days=2)
+            )
+
+        self.assertEqual(same_day, 0)
+        self.assertEqual(written, 2)
+        begin_date = mock_export.call_args.args[1]
+        self.assertEqual(begin_date.date(), dt.date(2021, 7, 2))
+        records = self.records()
+        self.assertEqual(records["D#2021-07-02"]["closing_balance"], 100)
+        self.assertEqual(records["D#2021-07-03"]["closing_balance"], 95)
+        self.assertEqual(records["STATE"]["closed_through"], "2021-07-03")
+
+    def test_balance_at(self):
+        rollup.roll_up(self.account_id, self.now)
+
+        balances = [
+            LedgerRollup.balance_at(self.account_id, dt.date(2021, *date))
+            for date in [(5, 1), (6, 10), (7, 1), (7, 2)]
+        ]
+
+        self.assertEqual(balances, [55, 85, 95, 100])
+
+    def test_balance_at_without_rollup(self):
+        self.assertEqual(
+            LedgerRollup.balance_at(self.account_id, dt.date(2021, 6, 10)),
+            85,
+        )
+        self.assertIsNone(
+            LedgerRollup.balance_at("unknown", dt.date(2021, 6, 10))
+        )
+
+    def test_totals_match_the_transactions(self):
+        ranges = [
+            (dt.date(2021, 5, 15), dt.date(2021, 7, 2)),
+            (dt.date(2021, 6, 1), dt.date(2021, 6, 30)),
+            (dt.date(2021, 6, 2), dt.date(2021, 6, 15)),
+            (dt.date(2021, 1, 1), dt.date(2021, 12, 31)),
+        ]
+        expected = [
+            LedgerRollup.totals(self.account_id, begin, end)
+            for begin, end in ranges
+        ]
+        rollup.roll_up(self.account_id, self.now)
+
+        with mock.patch.object(
+            Transaction, "export", wraps=Transaction.export
+        ) as mock_export:
+            totals = LedgerRollup.totals(self.account_id, *ranges[0])
+
+        self.assertEqual(
+            totals,
+            {"deposits": 65, "withdrawals": 20, "count": 4},
+        )
+        # only the open day was read from the transactions
+        self.assertEqual(mock_export.call_count, 1)
+        self.assertEqual(
+            [
+                LedgerRollup.totals(self.account_id, begin, end)
+                for begin, end in ranges
+            ],
+            expected,
+        )
+
+    def test_first_run_postponed_when_the_account_changes(self):
+        with mock.patch.object(Account, "find_version", return_value=99):
+            written = rollup.roll_up(self.account_id, self.now)
+
+        self.assertIsNone(written)
+        self.assertEqual(self.records(), {})
+
+    def test_roll_up_all(self):
+        report = rollup.roll_up_all(rollup.account_ids(), workers=2)
+
+        self.assertEqual(report.accounts, 1)
+        self.assertEqual(report.errors, [])
+        self.assertIn("STATE", self.records())
+
+
+class TestRollupSegments(unittest.TestCase):
+    def test_segments(self):
+        date = dt.date
+        self.assertEqual(
+            LedgerRollup._segments(date(2021, 6, 15), date(2021, 8, 10)),
+            [
+                ("D", date(2021, 6, 15), date(2021, 6, 30)),
+                ("M", date(2021, 7, 1), date(2021, 7, 31)),
+                ("D", date(2021, 8, 1), date(2021, 8, 10)),
+            ],
+        )
+        self.assertEqual(
+            LedgerRollup._segments(date(2021, 6, 15), date(2021, 6, 20)),
+            [("D", date(2021, 6, 15), date(2021, 6, 20))],
+        )
+        self.assertEqual(
+            LedgerRollup._segments(date(2021, 1, 1), date(2021, 12, 31)),
+            [("M", date(2021, 1, 1), date(2021, 12, 31))],
+        )
+        self.assertEqual(
+            LedgerRollup._segments(date(2021, 12, 2), date(2022, 1, 31)),
+            [
+                ("D", date(2021, 12, 2), date(2021, 12, 31)),
+                ("M", date(2022, 1, 1), date(2022, 1, 31)),
+            ],
+        )
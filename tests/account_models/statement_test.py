@@ -0,0 +1,203 @@
+import datetime as dt
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+from src.account.account import rollup
+from src.account.account.models import (
+    Account,
+    LedgerRollup,
+    ReadConflict,
+    Transaction,
+)
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import registry
+
+utc = dt.timezone.utc
+
+
+@pytest.mark.usefixtures("application")
+class TestStatement(unittest.TestCase):
+    now = dt.datetime(2021, 7, 2, 12, tzinfo=utc)
+    begin = dt.date(2021, 5, 1)
+    end = dt.date(2021, 7, 31)
+
+    def setUp(self):
+        environ = mock.patch.dict(
+            "src.account.core.aws.dynamodb.os.environ",
+            {"DYNAMODB_BACKEND": "memory", "FLASK_ENV": "development"},
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        registry.clear()
+        self.addCleanup(registry.clear)
+        memory.shared_resource().reset()
+        Account.cache.clear()
+        LedgerRollup.closed_days.clear()
+        self.addCleanup(LedgerRollup.closed_days.clear)
+        # the balance already has the transactions below
+        self.account_id = Account.add(
+            "p", Decimal("100"), Decimal("50"), True, 1
+        )
+        Transaction.add_batch(
+            [
+                Transaction.new_item(
+                    self.account_id,
+                    Decimal(value),
+                    dt.datetime.fromisoformat(created_at).replace(tzinfo=utc),
+                )
+                for created_at, value in (
+                    ("2021-05-30T10:00", "50"),
+                    ("2021-06-01T00:00", "-20"),
+                    ("2021-06-15T23:59", "10"),
+                    ("2021-07-02T08:00", "5"),
+                )
+            ]
+        )
+
+    def test_daily_statement(self):
+        statement = LedgerRollup.statement(
+            self.account_id, self.begin, self.end, monthly=False
+        )
+
+        self.assertEqual(statement["opening_balance"], 55)
+        self.assertEqual(
+            [
+                (
+                    row["period"],
+                    row["deposits"],
+                    row["withdrawals"],
+                    row["count"],
+                    row["closing_balance"],
+                )
+                for row in statement["periods"]
+            ],
+            [
+                ("2021-05-30", 50, 0, 1, 105),
+                ("2021-06-01", 0, 20, 1, 85),
+                ("2021-06-15", 10, 0, 1, 95),
+                ("2021-07-02", 5, 0, 1, 100),
+            ],
+        )
+
+    def test_monthly_statement(self):
+        statement = LedgerRollup.statement(
+            self.account_id, self.begin, self.end, monthly=True
+        )
+
+        self.assertEqual(
+            [
+                (row["period"], row["count"], row["closing_balance"])
+                for row in statement["periods"]
+            ],
+            [("2021-05", 1, 105), ("2021-06", 2, 95), ("2021-07", 1, 100)],
+        )
+
+    def test_range_inside_the_history(self):
+        statement = LedgerRollup.statement(
+            self.account_id,
+            dt.date(2021, 6, 10),
+            dt.date(2021, 6, 30),
+            monthly=False,
+        )
+
+        self.assertEqual(statement["opening_balance"], 85)
+        self.assertEqual(
+            [
+                (row["period"], row["closing_balance"])
+                for row in statement["periods"]
+            ],
+            [("2021-06-15", 95)],
+        )
+
+    def test_rolled_up_account_has_the_same_statement(self):
+        ranges = [
+            (self.begin, self.end, False),
+            (self.begin, self.end, True),
+            (dt.date(2021, 5, 15), dt.date(2021, 7, 1), True),
+            (dt.date(2021, 6, 10), dt.date(2021, 6, 30), False),
+        ]
+        expected = [
+            LedgerRollup.statement(self.account_id, *arguments)
+            for arguments in ranges
+        ]
+        rollup.roll_up(self.account_id, self.now)
+
+        with mock.patch.object(
+            Transaction, "export", wraps=Transaction.export
+        ) as export:
+            for arguments, statement in zip(ranges, expected):
+                self.assertEqual(
+                    LedgerRollup.statement(self.account_id, *arguments),
+                    statement,
+                )
+        # the summarized days are not read again
+        for call in export.call_args_list:
+            self.assertGreaterEqual(
+                call.args[1], dt.datetime(2021, 7, 2, tzinfo=utc)
+            )
+
+    def test_closed_days_are_cached(self):
+        first = LedgerRollup.statement(
+            self.account_id, self.begin, self.end, monthly=False
+        )
+
+        with mock.patch.object(
+            Transaction, "export", wraps=Transaction.export
+        ) as export:
+            second = LedgerRollup.statement(
+                self.account_id, dt.date(2021, 6, 1), self.end, monthly=False
+            )
+
+        self.assertEqual(second["opening_balance"], 105)
+        self.assertEqual(second["periods"], first["periods"][1:])
+        # only the transactions of the days not closed
+        first_open = rollup.last_closed_day(dt.datetime.now(utc)) + (
+            dt.timedelta(days=1)
+        )
+        self.assertEqual(
+            export.call_args.args[1], LedgerRollup.midnight(first_open)
+        )
+
+    def test_recent_change_is_not_cached(self):
+        Account.deposit_into(self.account_id, Decimal("7"))
+
+        LedgerRollup.statement(
+            self.account_id, self.begin, self.end, monthly=False
+        )
+
+        self.assertIsNone(LedgerRollup.closed_days.get(self.account_id))
+
+    def test_account_changing_while_read(self):
+        with mock.patch.object(
+            Account, "find_version", return_value=-1
+        ), self.assertRaises(ReadConflict):
+            LedgerRollup.statement(
+                self.account_id, self.begin, self.end, monthly=False
+            )
+
+        self.assertIsNone(LedgerRollup.closed_days.get(self.account_id))
+
+    def test_new_transactions_in_the_open_days(self):
+        LedgerRollup.statement(
+            self.account_id, self.begin, self.end, monthly=False
+        )
+        Account.deposit_into(self.account_id, Decimal("7"))
+        today = dt.datetime.now(utc).date()
+
+        statement = LedgerRollup.statement(
+            self.account_id, self.begin, today, monthly=False
+        )
+
+        self.assertEqual(statement["opening_balance"], 55)
+        self.assertEqual(
+            statement["periods"][-1]["period"], today.isoformat()
+        )
+        self.assertEqual(statement["periods"][-1]["closing_balance"], 107)
+
+    def test_account_not_found(self):
+        self.assertIsNone(
+            LedgerRollup.statement("missing", self.begin, self.end, False)
+        )
@@ -0,0 +1,198 @@
+import datetime as dt
+import unittest
+import uuid
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+from src.account.account import transaction_ids
+from src.account.account.models import Account, Idempotency, Transaction
+from src.account.core import ulid
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import registry
+
+utc = dt.timezone.utc
+base = dt.datetime(2021, 6, 13, 10, tzinfo=utc)
+
+
+@pytest.mark.usefixtures("application")
+class TestTransactionIds(unittest.TestCase):
+    def setUp(self):
+        environ = mock.patch.dict(
+            "src.account.core.aws.dynamodb.os.environ",
+            {"DYNAMODB_BACKEND": "memory", "FLASK_ENV": "development"},
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        registry.clear()
+        self.addCleanup(registry.clear)
+        memory.shared_resource().reset()
+        Account.cache.clear()
+        self.account_id = Account.add("p", Decimal("0"), Decimal("10"), True, 1)
+        # microseconds inside the same milliseconds
+        self.dates = [
+            base + dt.timedelta(minutes=minute, microseconds=micro)
+            for minute in range(3)
+            for micro in (100, 900)
+        ]
+
+    def add(self, *, legacy: bool):
+        items = [
+            Transaction.new_item(self.account_id, Decimal(i + 1), date)
+            for i, date in enumerate(self.dates)
+        ]
+        if legacy:
+            for item in items:
+                item["id"] = str(uuid.uuid4())
+            memory.shared_resource().Table("account").update_item(
+                Key={"id": self.account_id},
+                UpdateExpression="REMOVE ordered_transaction_ids",
+            )
+            Account.cache.clear()
+        Transaction.add_batch(items)
+
+    def queries(self):
+        return {
+            key[2]: count
+            for key, count in memory.shared_resource().calls.items()
+            if key[:2] == ("Query", "transaction")
+        }
+
+    def list_values(self, **kwargs):
+        resp = Transaction.find_by_account_id(
+            self.account_id,
+            ordered_ids=Account.ordered_ids(self.account_id),
+            **kwargs,
+        )
+        return [item["value"] for item in resp["Items"]]
+
+    def test_new_accounts_read_the_base_table(self):
+        self.add(legacy=False)
+
+        values = self.list_values(
+            begin_date=self.dates[1], end_date=self.dates[4]
+        )
+        after = self.list_values(begin_date=self.dates[3])
+        before = self.list_values(end_date=self.dates[2])
+        exported = list(Transaction.export(self.account_id, ordered_ids=True))
+
+        self.assertEqual(values, [2, 3, 4, 5])
+        self.assertEqual(after, [4, 5, 6])
+        self.assertEqual(before, [1, 2])
+        self.assertEqual([i["value"] for i in exported], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(self.queries(), {None: 4})
+
+    def test_migration(self):
+        self.add(legacy=True)
+        old_ids = {
+            i["value"]: i["id"] for i in Transaction.export(self.account_id)
+        }
+        version = Account.find_version(self.account_id)
+        self.assertFalse(Account.ordered_ids(self.account_id))
+
+        replaced = transaction_ids.migrate(self.account_id)
+        again = transaction_ids.migrate(self.account_id)
+
+        self.assertEqual((replaced, again), (6, 0))
+        self.assertTrue(Account.ordered_ids(self.account_id))
+        self.assertEqual(Account.find_version(self.account_id), version + 1)
+        items = memory.shared_resource().Table("transaction").scan()["Items"]
+        self.assertEqual(len(items), 6)
+        for item in items:
+            self.assertTrue(ulid.is_ulid(item["id"]))
+            self.assertEqual(item["legacy_id"], old_ids[item["value"]])
+        self.assertEqual(
+            self.list_values(begin_date=self.dates[1], end_date=self.dates[4]),
+            [2, 3, 4, 5],
+        )
+
+    def test_cursor_of_the_index_continues_on_the_index(self):
+        self.add(legacy=True)
+        first = Transaction.find_by_account_id(self.account_id, page_size=2)
+
+        transaction_ids.migrate(self.account_id)
+        second = Transaction.find_by_account_id(
+            self.account_id,
+            next_cursor=first["LastEvaluatedKey"],
+            page_size=2,
+            ordered_ids=True,
+        )
+
+        self.assertEqual([i["value"] for i in second["Items"]], [3, 4])
+        self.assertEqual(self.queries()["transaction_date_index"], 2)
+
+    def test_migrate_all(self):
+        self.add(legacy=True)
+
+        report = transaction_ids.migrate_all(
+            [self.account_id, "unknown"], workers=2
+        )
+
+        self.assertEqual(
+            (report.accounts, report.migrated, report.transactions),
+            (2, 1, 6),
+        )
+        self.assertEqual(report.errors, [])
+
+    def test_ulid_of_another_time_is_replaced(self):
+        kept = ulid.new(self.dates[0])
+        misleading = ulid.new(self.dates[0] + dt.timedelta(days=1))
+
+        item = Transaction.new_item(
+            self.account_id, Decimal(1), self.dates[0], kept
+        )
+        other = Transaction.new_item(
+            self.account_id, Decimal(1), self.dates[0], misleading
+        )
+
+        self.assertEqual(item["id"], kept)
+        self.assertNotIn("legacy_id", item)
+        self.assertNotEqual(other["id"], misleading)
+        self.assertEqual(other["legacy_id"], misleading)
+        self.assertTrue(ulid.is_ulid_of(other["id"], self.dates[0]))
+
+    def test_recheck_replaces_misleading_ulids(self):
+        item = Transaction.new_item(self.account_id, Decimal(1), self.dates[0])
+        misleading = ulid.new(self.dates[0] + dt.timedelta(days=1))
+        item["id"] = misleading
+        Transaction.add_batch([item])
+
+        self.assertEqual(transaction_ids.migrate(self.account_id), 0)
+        replaced = transaction_ids.migrate(self.account_id, recheck=True)
+
+        self.assertEqual(replaced, 1)
+        items = memory.shared_resource().Table("transaction").scan()["Items"]
+        self.assertEqual([i["legacy_id"] for i in items], [misleading])
+
+    def test_migration_updates_the_idempotency_records(self):
+        self.add(legacy=True)
+        old = next(iter(Transaction.export(self.account_id)))
+        record = Idempotency.with_result(
+            Idempotency.new_item(self.account_id, "deposit", "k1", b"{}"),
+            self.account_id,
+            old["id"],
+        )
+        memory.shared_resource().Table("idempotency").put_item(Item=record)
+
+        transaction_ids.migrate(self.account_id)
+
+        saved = Idempotency.find(record["key"])
+        items = memory.shared_resource().Table("transaction").scan()["Items"]
+        new = next(i for i in items if i["legacy_id"] == old["id"])
+        self.assertEqual(saved["transaction_id"], new["id"])
+        self.assertEqual(
+            saved["content_location"],
+            Transaction.location(self.account_id, new["id"]),
+        )
+
+    def test_idempotency_record_used_again_meanwhile(self):
+        self.add(legacy=True)
+        old = next(iter(Transaction.export(self.account_id)))
+
+        replaced = transaction_ids.migrate(
+            self.account_id, {old["id"]: "missing-record"}
+        )
+
+        self.assertEqual(replaced, 6)
+        self.assertIsNone(Idempotency.find("missing-record"))
@@ -0,0 +1,131 @@
+import datetime as dt
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+from src.account.account import rollup
+from src.account.account.models import Account, BalanceShard, Transaction
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import registry
+
+
+@pytest.mark.usefixtures("application")
+class TestTransactionJournal(unittest.TestCase):
+    def setUp(self):
+        environ = mock.patch.dict(
+            "src.account.core.aws.dynamodb.os.environ",
+            {"DYNAMODB_BACKEND": "memory", "FLASK_ENV": "development"},
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        registry.clear()
+        self.addCleanup(registry.clear)
+        memory.shared_resource().reset()
+        Account.cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.addCleanup(Transaction.stop_journal)
+        self.account_id = Account.add("p", Decimal("100"), Decimal("50"), True, 1)
+
+    def transactions(self):
+        table = memory.shared_resource().Table(Transaction.table_name)
+        return table.scan()["Items"]
+
+    def test_records_are_written_behind(self):
+        journal = Transaction.start_journal(self.directory, flush_interval=60)
+
+        deposit_id = Account.deposit_into(self.account_id, Decimal("10"))
+        withdraw_id = Account.withdraw(self.account_id, Decimal("5"), Decimal("50"))
+
+        account = Account.find_one_by_id(self.account_id, consistent_read=True)
+        self.assertEqual(account["balance"], 105)
+        self.assertEqual(self.transactions(), [])
+        self.assertTrue(journal.wait_flushed(5))
+        records = {item["id"]: item for item in self.transactions()}
+        self.assertEqual(sorted(records), sorted([deposit_id, withdraw_id]))
+        self.assertEqual(records[deposit_id]["value"], Decimal("10"))
+        self.assertIn("withdraw_date", records[withdraw_id])
+
+    def test_records_left_by_a_crash_are_recovered(self):
+        journal = Transaction.start_journal(self.directory, flush_interval=60)
+        with mock.patch.object(
+            Transaction, "add_batch", side_effect=ConnectionError()
+        ):
+            transaction_id = Account.deposit_into(
+                self.account_id, Decimal("10")
+            )
+            # the process stops without flushing
+            journal._stop.set()
+            journal._wake.set()
+            journal._thread.join(5)
+            journal._file.close()
+        Transaction.journal = None
+
+        recovered = Transaction.start_journal(self.directory)
+
+        self.assertTrue(recovered.wait_flushed(5))
+        self.assertEqual(
+            [item["id"] for item in self.transactions()], [transaction_id]
+        )
+
+    def hold_flushes(self):
+        """Journal whose flushes fail until the patch stops"""
+        journal = Transaction.start_journal(self.directory, flush_interval=60)
+        held = mock.patch.object(
+            Transaction, "add_batch", side_effect=ConnectionError()
+        )
+        held.start()
+        self.addCleanup(mock.patch.stopall)
+        return journal, held
+
+    def test_pending_until_flushed(self):
+        journal, held = self.hold_flushes()
+        version = Account.find_version(self.account_id)
+
+        transaction_id = Account.deposit_into(self.account_id, Decimal("10"))
+
+        account = Account.find_one_by_id(self.account_id, consistent_read=True)
+        self.assertEqual(account[Account.pending_attribute], {transaction_id})
+        self.assertTrue(Account.pending_before(account))
+        pending_version = Account.find_version(self.account_id)
+        self.assertGreater(pending_version, version)
+
+        held.stop()
+        self.assertTrue(journal.wait_flushed(5))
+
+        account = Account.find_one_by_id(self.account_id, consistent_read=True)
+        self.assertNotIn(Account.pending_attribute, account)
+        # the etags given while it was pending don't match anymore
+        self.assertGreater(account["version"], pending_version)
+
+    def test_sharded_deposits_are_pending_in_the_shard(self):
+        BalanceShard.configure([self.account_id], 2)
+        self.addCleanup(BalanceShard.configure, [], 8)
+        BalanceShard.create(self.account_id)
+        journal, held = self.hold_flushes()
+
+        transaction_id = Account.deposit_into(self.account_id, Decimal("10"))
+
+        account = Account.find_one_by_id(self.account_id, consistent_read=True)
+        self.assertEqual(account[Account.pending_attribute], {transaction_id})
+        held.stop()
+        self.assertTrue(journal.wait_flushed(5))
+        account = Account.find_one_by_id(self.account_id, consistent_read=True)
+        self.assertFalse(account.get(Account.pending_attribute))
+
+    def test_rollup_waits_for_the_journal(self):
+        journal, held = self.hold_flushes()
+        Account.deposit_into(self.account_id, Decimal("10"))
+        tomorrow = dt.datetime.now(dt.timezone.utc) + dt.timedelta(days=1)
+
+        self.assertIsNone(rollup.roll_up(self.account_id, tomorrow))
+
+        held.stop()
+        self.assertTrue(journal.wait_flushed(5))
+        self.assertEqual(rollup.roll_up(self.account_id, tomorrow), 1)
+        state = rollup.models.LedgerRollup.find_state(self.account_id)
+        self.assertEqual(state["opening_balance"], 100)
@@ -1,57 +1,59 @@
 import datetime as dt
 import decimal as d
 import unittest
-import uuid
+from http import HTTPStatus
 from unittest import mock
 
-from botocore.exceptions import ClientError
+import pytest
+from werkzeug.exceptions import HTTPException
 
-from src.account.account.models import Transaction, date_format
+from src.account.account.models import DailyWithdraw, Transaction, date_format
 
 
+@pytest.mark.usefixtures("application")
 class TestAccountBalanceScenarios(unittest.TestCase):
     mock_resource_path = "src.account.account.models.DynamoResource"
-    mock_uuid_path = "src.account.account.models.uuid"
+    mock_ulid_path = "src.account.account.models.ulid"
 
     @mock.patch(mock_resource_path)
-    @mock.patch(mock_uuid_path)
-    def test_add_deposit(self, mock_uuid, mock_resource):
-        newid = uuid.uuid4()
-        mock_uuid.uuid4.return_value = str(newid)
+    @mock.patch(mock_ulid_path)
+    def test_add_deposit(self, mock_ulid, mock_resource):
+        newid = "01F83G5T48DE3B4WZZ6KYE37BB"
+        mock_ulid.new.return_value = newid
         mock_resource_instance = mock_resource.return_value
 
         current_date = dt.datetime.now(dt.timezone.utc)
 
         transaction_id = Transaction.add("321", d.Decimal("54551"), current_date)
 
-        self.assertEqual(transaction_id, str(newid), None)
+        self.assertEqual(transaction_id, newid, None)
         mock_resource_instance.add.assert_called_once_with(
             Transaction.table_name,
             {
                 Transaction.hash_key: "321",
-                Transaction.sort_key: str(newid),
+                Transaction.sort_key: newid,
                 "created_at": current_date.isoformat(),
                 "value": d.Decimal("54551"),
             },
         )
 
     @mock.patch(mock_resource_path)
-    @mock.patch(mock_uuid_path)
-    def test_add_withdraw(self, mock_uuid, mock_resource):
-        newid = uuid.uuid4()
-        mock_uuid.uuid4.return_value = str(newid)
+    @mock.patch(mock_ulid_path)
+    def test_add_withdraw(self, mock_ulid, mock_resource):
+        newid = "01F83G5T48DE3B4WZZ6KYE37BB"
+        mock_ulid.new.return_value = newid
         mock_resource_instance = mock_resource.return_value
 
         current_date = dt.datetime.now(dt.timezone.utc)
 
         transaction_id = Transaction.add("321", d.Decimal("-54551"), current_date)
 
-        self.assertEqual(transaction_id, str(newid), None)
+        self.assertEqual(transaction_id, newid, None)
         mock_resource_instance.add.assert_called_once_with(
             Transaction.table_name,
             {
                 Transaction.hash_key: "321",
-                Transaction.sort_key: str(newid),
+                Transaction.sort_key: newid,
                 "created_at": current_date.isoformat(),
                 "value": d.Decimal("-54551"),
                 "withdraw_date": current_date.strftime(date_format),
@@ -60,32 +62,122 @@ class TestAccountBalanceScenarios(unittest.TestCase):
 
     @mock.patch(mock_resource_path)
     def test_find_withdraw_limit_available(self, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        mock_resource_instance.get_item.return_value = {"total": d.Decimal("9")}
+
+        withdraw_transactions = Transaction.find_withdraw_limit_available("321")
+
+        self.assertEqual(withdraw_transactions, 9)
+        mock_resource_instance.get_item.assert_called_once_with(
+            DailyWithdraw.table_name,
+            {
+                "account_id": "321",
+                "withdraw_date": dt.datetime.now(dt.timezone.utc).strftime(
+                    date_format
+                ),
+            },
+            projection=["total"],
+            consistent_read=False,
+        )
+        mock_resource_instance.table_resource.return_value.query.assert_not_called()
+
+    @mock.patch(mock_resource_path)
+    def test_find_withdraw_limit_available_nothing_withdrawn(self, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        mock_resource_instance.get_item.return_value = None
+
+        withdraw_transactions = Transaction.find_withdraw_limit_available("321")
+
+        self.assertEqual(withdraw_transactions, 0)
+
+    @mock.patch(mock_resource_path)
+    def test_sum_withdraw_index(self, mock_resource):
         mock_resource_instance = mock_resource.return_value
         table_resource_instance = mock_resource_instance.table_resource.return_value
         table_resource_instance.query.side_effect = (
-            {"Items": [{"value": 1}, {"value": 3}], "LastEvaluatedKey": "33"},
-            {"Items": [{"value": 5}]},
+            {"Items": [{"value": -1}, {"value": -3}], "LastEvaluatedKey": "33"},
+            {"Items": [{"value": -5}]},
         )
 
-        withdraw_transactions = Transaction.find_withdraw_limit_available("321")
+        withdrawn = Transaction.sum_withdraw_index("321", "2021-06-13")
 
-        self.assertEqual(withdraw_transactions, 9)
+        self.assertEqual(withdrawn, 9)
         self.assertEqual(table_resource_instance.query.call_count, 2)
 
     @mock.patch(mock_resource_path)
-    def test_find_withdraw_limit_available_throws_exception(self, mock_resource):
+    def test_find_by_account_id_page(self, mock_resource):
         mock_resource_instance = mock_resource.return_value
+        mock_resource_instance.projection_kwargs.return_value = {}
         table_resource_instance = mock_resource_instance.table_resource.return_value
-        table_resource_instance.query.side_effect = ClientError(
-            {
-                "Error": {
-                    "Code": "InternalServerError",
-                    "Message": "Everything fails dramatically! And you get sad!",
-                }
-            },
-            "walking without looking",
+        cursor = {"account_id": "321", "id": "1", "created_at": "2021"}
+
+        Transaction.find_by_account_id("321", next_cursor=cursor, page_size=10)
+
+        mock_resource_instance.projection_kwargs.assert_called_once_with(
+            Transaction.list_projection
         )
+        kwargs = table_resource_instance.query.call_args.kwargs
+        self.assertEqual(kwargs["ExclusiveStartKey"], cursor)
+        self.assertEqual(kwargs["Limit"], 10)
+        self.assertEqual(kwargs["IndexName"], "transaction_date_index")
 
-        Transaction.find_withdraw_limit_available("321")
+    @mock.patch(mock_resource_path)
+    def test_find_by_account_id_cursor_of_other_account(self, mock_resource):
+        cursor = {"account_id": "999", "id": "1", "created_at": "2021"}
+
+        with self.assertRaises(HTTPException) as err:
+            Transaction.find_by_account_id("321", next_cursor=cursor)
+
+        self.assertEqual(err.exception.response.status_code, HTTPStatus.BAD_REQUEST)
+        mock_resource.return_value.table_resource.assert_not_called()
+
+    @mock.patch(mock_resource_path)
+    def test_paginated_query_with_prefetch(self, mock_resource):
+        table_resource_instance = mock_resource.return_value.table_resource.return_value
+        table_resource_instance.query.side_effect = (
+            {"Items": [{"value": 1}, {"value": 3}], "LastEvaluatedKey": "33"},
+            {"Items": [{"value": 5}], "LastEvaluatedKey": "44"},
+            {"Items": []},
+        )
+
+        items = list(
+            Transaction.paginated_query(
+                table_resource_instance, "expression", "index", prefetch=True
+            )
+        )
+
+        self.assertEqual(items, [{"value": 1}, {"value": 3}, {"value": 5}])
+        self.assertEqual(
+            [
+                c.kwargs.get("ExclusiveStartKey")
+                for c in table_resource_instance.query.call_args_list
+            ],
+            [None, "33", "44"],
+        )
 
-        mock_resource_instance.handle_error.assert_called_once()
+
+class TestDailyWithdrawScenarios(unittest.TestCase):
+    mock_resource_path = "src.account.account.models.DynamoResource"
+
+    @mock.patch(mock_resource_path)
+    def test_add_accumulates_in_the_day_item(self, mock_resource):
+        mock_resource_instance = mock_resource.return_value
+        table_resource_instance = mock_resource_instance.table_resource.return_value
+
+        operation_date = dt.datetime(2021, 6, 13, 20, 14, tzinfo=dt.timezone.utc)
+        DailyWithdraw.add("321", d.Decimal("10"), operation_date)
+
+        table_resource_instance.update_item.assert_called_once_with(
+            Key={"account_id": "321", "withdraw_date": "2021-06-13"},
+            UpdateExpression="ADD #total :value SET #expires = :expires",
+            ExpressionAttributeNames={
+                "#total": "total",
+                "#expires": "expires_at",
+            },
+            ExpressionAttributeValues={
+                ":value": d.Decimal("10"),
+                ":expires": int(
+                    dt.datetime(2021, 6, 15, tzinfo=dt.timezone.utc).timestamp()
+                ),
+            },
+        )
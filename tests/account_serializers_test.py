@@ -0,0 +1,59 @@
+import decimal as d
+import unittest
+
+import marshmallow as ma
+import pytest
+from flask import current_app
+
+from src.account.account import serializers as ser
+
+
+@pytest.mark.usefixtures("application")
+class TestFastTransactionDump(unittest.TestCase):
+    items = [
+        {
+            "id": "t1",
+            "account_id": "a",
+            "value": d.Decimal("10.50"),
+            "created_at": "2021-06-13T10:00:00+00:00",
+        },
+        {"id": "t2", "account_id": "a", "value": d.Decimal("-100")},
+        {"id": "t3", "account_id": "a", "value": None, "created_at": "x"},
+        {"id": "t4", "value": d.Decimal("0.1") * 3, "other": "ignored"},
+    ]
+
+    def assert_same_json(self, resp):
+        expected = ser.ListTransactionsResponseSchema().dump(resp)
+        dumped = ser.dump_transactions_page(resp)
+
+        self.assertEqual(
+            current_app.json.dumps(dumped), current_app.json.dumps(expected)
+        )
+
+    def test_page_with_cursor(self):
+        self.assert_same_json(
+            {
+                "Items": self.items,
+                "LastEvaluatedKey": {"account_id": "a", "id": "t4"},
+            }
+        )
+
+    def test_last_page(self):
+        self.assert_same_json({"Items": self.items})
+        self.assert_same_json({"Items": []})
+
+    def test_export_rows_keep_the_field_order(self):
+        schema = ser.TransactionItemResponseSchema()
+
+        for item in self.items:
+            self.assertEqual(
+                list(ser.dump_transaction(item).items()),
+                list(schema.dump(item).items()),
+            )
+
+    def test_unsupported_fields(self):
+        class Schema(ma.Schema):
+            value = ma.fields.Decimal()
+
+        with self.assertRaises(TypeError):
+            ser.compile_dump(Schema())
@@ -1,3 +1,4 @@
+import threading
 import unittest
 from http import HTTPStatus
 from unittest import mock
@@ -82,3 +83,27 @@ class TestAccountBalanceScenarios(unittest.TestCase):
                 "saldo": 44.554554,
             },
         )
+
+    @mock.patch("src.account.account.views.models")
+    def test_balance_reads_concurrently(self, mock_models):
+        barrier = threading.Barrier(2, timeout=2)
+
+        def find_account(*_, **__):
+            barrier.wait()
+            return {"daily_withdraw_limit": 10, "balance": 5, "blocked": False}
+
+        def find_withdrawn(*_):
+            barrier.wait()
+            return 4
+
+        mock_models.Account.find_one_by_id.side_effect = find_account
+        mock_models.Transaction.find_withdraw_limit_available.side_effect = (
+            find_withdrawn
+        )
+        resp = self.client.get(self.request_path.format("3333"))
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(resp.json["limiteSaqueDisponivel"], 6)
+        mock_models.Account.find_one_by_id.assert_called_once_with(
+            "3333", consistent_read=True
+        )
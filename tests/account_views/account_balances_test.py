@@ -0,0 +1,93 @@
+import unittest
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+
+
+@pytest.mark.usefixtures("client")
+class TestBatchBalanceScenarios(unittest.TestCase):
+    mock_models_path = "src.account.account.views.models"
+
+    request_path = "/v1/account/balances"
+
+    def post(self, account_ids):
+        return self.client.post(
+            self.request_path, json={"idsConta": account_ids}
+        )
+
+    @mock.patch(mock_models_path)
+    def test_balances(self, mock_models):
+        mock_models.Account.find_many.return_value = {
+            "1": {"daily_withdraw_limit": 33, "balance": 10, "blocked": False},
+            "2": {"daily_withdraw_limit": 5, "balance": 20, "blocked": True},
+        }
+        mock_models.DailyWithdraw.find_totals.return_value = {
+            "1": 3,
+            "2": 9,
+            "3": 0,
+        }
+
+        resp = self.post(["1", "2", "3", "1"])
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            resp.json,
+            {
+                "1": {
+                    "saldo": 10,
+                    "bloqueado": False,
+                    "limiteSaqueDisponivel": 30,
+                },
+                "2": {
+                    "saldo": 20,
+                    "bloqueado": True,
+                    "limiteSaqueDisponivel": 0,
+                },
+                "3": {"error": "Account not found"},
+            },
+        )
+        # the repeated id is read once
+        mock_models.Account.find_many.assert_called_once_with(
+            ["1", "2", "3"], consistent_read=True
+        )
+        mock_models.DailyWithdraw.find_totals.assert_called_once_with(
+            ["1", "2", "3"]
+        )
+
+    @mock.patch(mock_models_path)
+    def test_ids_read_in_chunks(self, mock_models):
+        account_ids = [str(i) for i in range(250)]
+        mock_models.Account.find_many.side_effect = lambda chunk, **_: {
+            account_id: {
+                "daily_withdraw_limit": 10,
+                "balance": 1,
+                "blocked": False,
+            }
+            for account_id in chunk
+        }
+        mock_models.DailyWithdraw.find_totals.side_effect = lambda chunk: {
+            account_id: 0 for account_id in chunk
+        }
+
+        resp = self.post(account_ids)
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(sorted(resp.json), sorted(account_ids))
+        self.assertEqual(
+            sorted(
+                len(call.args[0])
+                for call in mock_models.Account.find_many.call_args_list
+            ),
+            [50, 100, 100],
+        )
+        self.assertEqual(mock_models.DailyWithdraw.find_totals.call_count, 3)
+
+    @mock.patch(mock_models_path)
+    def test_invalid_ids(self, mock_models):
+        for account_ids in ([], [""], [str(i) for i in range(501)]):
+            with self.subTest(count=len(account_ids)):
+                resp = self.post(account_ids)
+
+                self.assertEqual(resp.status_code, HTTPStatus.BAD_REQUEST)
+        mock_models.Account.find_many.assert_not_called()
@@ -52,8 +52,7 @@ class TestAccountDepositScenarios(unittest.TestCase):
     @mock.patch(mock_models_path)
     def test_depositing_returns_resource_location(self, mock_models):
         mock_models.Account.find_one_by_id.return_value = {"blocked": False}
-        mock_models.Account.deposit_into.return_value = "now"
-        mock_models.Transaction.add.return_value = "123"
+        mock_models.Account.deposit_into.return_value = "123"
         resp = self.client.post(
             self.request_path.format("3333"),
             json={"valor": 44},
@@ -65,8 +64,10 @@ class TestAccountDepositScenarios(unittest.TestCase):
             resp.headers["Content-Location"],
             "/account/3333/transaction/123",
         )
-        mock_models.Account.deposit_into.assert_called_once_with("3333", 44)
-        mock_models.Transaction.add.assert_called_once_with("3333", 44, "now")
+        mock_models.Account.deposit_into.assert_called_once_with(
+            "3333", 44, None
+        )
+        mock_models.Transaction.add.assert_not_called()
 
     @mock.patch(mock_models_path)
     def test_depositing_account_not_found(self, mock_models):
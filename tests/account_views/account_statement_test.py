@@ -0,0 +1,119 @@
+import datetime as dt
+import decimal as d
+import unittest
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+
+from src.account.account import models
+
+
+@pytest.mark.usefixtures("client")
+class TestAccountStatementScenarios(unittest.TestCase):
+    mock_models_path = "src.account.account.views.models"
+
+    request_path = "/v1/account/{}/statement"
+
+    statement = {
+        "opening_balance": d.Decimal("55"),
+        "periods": [
+            {
+                "period": "2021-06",
+                "deposits": d.Decimal("10.5"),
+                "withdrawals": d.Decimal("20"),
+                "count": 2,
+                "closing_balance": d.Decimal("45.5"),
+            }
+        ],
+    }
+
+    @mock.patch(mock_models_path)
+    def test_monthly_statement(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+        mock_models.LedgerRollup.statement.return_value = self.statement
+
+        resp = self.client.get(
+            self.request_path.format("3333"),
+            query_string={
+                "begin-date": "2021-06-01",
+                "end-date": "2021-06-30",
+                "period": "month",
+            },
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            resp.json,
+            {
+                "saldoInicial": 55,
+                "periodos": [
+                    {
+                        "periodo": "2021-06",
+                        "depositos": 10.5,
+                        "saques": 20,
+                        "quantidade": 2,
+                        "saldoFinal": 45.5,
+                    }
+                ],
+            },
+        )
+        mock_models.LedgerRollup.statement.assert_called_once_with(
+            "3333", dt.date(2021, 6, 1), dt.date(2021, 6, 30), monthly=True
+        )
+
+    @mock.patch(mock_models_path)
+    def test_end_date_defaults_to_today(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+        mock_models.LedgerRollup.statement.return_value = self.statement
+
+        resp = self.client.get(
+            self.request_path.format("3333"),
+            query_string={"begin-date": "2021-06-01"},
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        args, kwargs = mock_models.LedgerRollup.statement.call_args
+        self.assertEqual(args[2], dt.datetime.now(dt.timezone.utc).date())
+        self.assertFalse(kwargs["monthly"])
+
+    @mock.patch(mock_models_path)
+    def test_invalid_range(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+
+        resp = self.client.get(
+            self.request_path.format("3333"),
+            query_string={
+                "begin-date": "2021-07-01",
+                "end-date": "2021-06-01",
+            },
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.BAD_REQUEST)
+        mock_models.LedgerRollup.statement.assert_not_called()
+
+    @mock.patch(mock_models_path)
+    def test_account_not_found(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = None
+
+        resp = self.client.get(
+            self.request_path.format("3333"),
+            query_string={"begin-date": "2021-06-01"},
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.NOT_FOUND)
+
+    @mock.patch(mock_models_path)
+    def test_account_changing(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+        mock_models.LedgerRollup.statement.side_effect = models.ReadConflict(
+            "account 3333 kept changing"
+        )
+
+        resp = self.client.get(
+            self.request_path.format("3333"),
+            query_string={"begin-date": "2021-06-01"},
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertIn("Retry-After", resp.headers)
@@ -73,28 +73,6 @@ class TestAccountWithdrawScenarios(unittest.TestCase):
             },
         )
 
-    @mock.patch("src.account.account.views.models")
-    def test_withdraw_smaller_than_daily_but_smaller_than_available(
-        self, mock_models
-    ):
-        mock_models.Account.find_one_by_id.return_value = {
-            "balance": 100,
-            "blocked": False,
-            "daily_withdraw_limit": 55,
-        }
-        mock_models.Transaction.find_withdraw_limit_available.return_value = 33
-        resp = self.client.post(
-            self.request_path.format("3333"), json={"valor": "54"}
-        )
-
-        self.assertEqual(resp.status_code, HTTPStatus.FORBIDDEN)
-        self.assertDictEqual(
-            resp.json,
-            {
-                "error": "It is not possible to carry out the withdraw. Withdraw available is R$ 22"
-            },
-        )
-
     @mock.patch("src.account.account.views.models")
     def test_withdraw_executed_success_fully(self, mock_models):
         mock_models.Account.find_one_by_id.return_value = {
@@ -102,9 +80,7 @@ class TestAccountWithdrawScenarios(unittest.TestCase):
             "blocked": False,
             "daily_withdraw_limit": 55,
         }
-        mock_models.Transaction.find_withdraw_limit_available.return_value = 2
-        mock_models.Account.withdraw.return_value = "now"
-        mock_models.Transaction.add.return_value = "123"
+        mock_models.Account.withdraw.return_value = "123"
         resp = self.client.post(
             self.request_path.format("3333"), json={"valor": "10"}
         )
@@ -116,12 +92,8 @@ class TestAccountWithdrawScenarios(unittest.TestCase):
             "/account/3333/transaction/123",
         )
 
-        mock_models.Transaction.find_withdraw_limit_available.assert_called_once_with(
-            "3333"
-        )
+        mock_models.Transaction.find_withdraw_limit_available.assert_not_called()
         mock_models.Account.withdraw.assert_called_once_with(
-            "3333", d.Decimal(10)
-        )
-        mock_models.Transaction.add.assert_called_once_with(
-            "3333", d.Decimal(-10), "now"
+            "3333", d.Decimal(10), 55, None
         )
+        mock_models.Transaction.add.assert_not_called()
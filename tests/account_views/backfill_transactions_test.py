@@ -0,0 +1,46 @@
+import unittest
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+
+from src.account.account.backfill import BackfillReport
+
+
+@pytest.mark.usefixtures("client")
+class TestBackfillTransactionsScenarios(unittest.TestCase):
+    mock_backfill_path = "src.account.account.views.backfill"
+
+    request_path = "/v1/account/transactions/backfill"
+
+    @mock.patch(mock_backfill_path)
+    def test_report(self, mock_backfill):
+        mock_backfill.backfill.return_value = BackfillReport(
+            rows=3, written=2, errors=[{"linha": 2}], seconds=0.5
+        )
+
+        resp = self.client.post(
+            self.request_path,
+            data=b'{"a": 1}\n{"a": 2}\n{"a": 3}\n',
+            content_type="application/x-ndjson",
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            resp.json,
+            {
+                "linhas": 3,
+                "gravadas": 2,
+                "erros": [{"linha": 2}],
+                "segundos": 0.5,
+                "linhasPorSegundo": 4.0,
+            },
+        )
+        mock_backfill.backfill.assert_called_once()
+
+    @mock.patch(mock_backfill_path)
+    def test_content_type_must_be_ndjson(self, mock_backfill):
+        resp = self.client.post(self.request_path, json={"a": 1})
+
+        self.assertEqual(resp.status_code, HTTPStatus.BAD_REQUEST)
+        mock_backfill.backfill.assert_not_called()
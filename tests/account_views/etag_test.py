@@ -0,0 +1,118 @@
+import datetime as dt
+import unittest
+from decimal import Decimal
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+
+from src.account.account import views
+from src.account.account.models import Account
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import registry
+
+
+@pytest.mark.usefixtures("client")
+@mock.patch.object(views, "etag_settle_seconds", 0)
+class TestAccountEtag(unittest.TestCase):
+    def setUp(self):
+        environ = mock.patch.dict(
+            "src.account.core.aws.dynamodb.os.environ",
+            {"DYNAMODB_BACKEND": "memory", "FLASK_ENV": "development"},
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        registry.clear()
+        memory.shared_resource().reset()
+        Account.cache.clear()
+        self.account_id = Account.add(
+            "p", Decimal("100"), Decimal("50"), True, 1
+        )
+
+    def tearDown(self):
+        registry.clear()
+
+    def get(self, resource, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        return self.client.get(
+            f"/v1/account/{self.account_id}/{resource}", headers=headers
+        )
+
+    def dynamo_calls(self):
+        return dict(memory.shared_resource().calls)
+
+    def test_balance_not_modified(self):
+        first = self.get("balance")
+        calls = self.dynamo_calls()
+        second = self.get("balance", first.headers["ETag"])
+
+        self.assertEqual(first.status_code, HTTPStatus.OK)
+        self.assertEqual(second.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+        self.assertEqual(second.data, b"")
+        # only the version was read
+        new_calls = {
+            key: count - calls.get(key, 0)
+            for key, count in self.dynamo_calls().items()
+            if count != calls.get(key, 0)
+        }
+        self.assertEqual(new_calls, {("GetItem", "account", None): 1})
+
+    def test_balance_changes_with_each_write(self):
+        etags = [self.get("balance").headers["ETag"]]
+        Account.deposit_into(self.account_id, Decimal("1"))
+        etags.append(self.get("balance").headers["ETag"])
+        Account.withdraw(self.account_id, Decimal("1"), Decimal("50"))
+        etags.append(self.get("balance").headers["ETag"])
+        Account.block(self.account_id, True)
+        resp = self.get("balance", etags[-1])
+
+        self.assertEqual(len(set(etags)), 3)
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertTrue(resp.json["bloqueado"])
+
+    def test_balance_etag_changes_with_the_day(self):
+        etag = self.get("balance").headers["ETag"]
+
+        with mock.patch.object(views, "utc_today", return_value="2099-01-01"):
+            resp = self.get("balance", etag)
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+
+    def test_transactions_not_modified(self):
+        Account.deposit_into(self.account_id, Decimal("1"))
+        first = self.get("transactions")
+        second = self.get("transactions", first.headers["ETag"])
+        Account.deposit_into(self.account_id, Decimal("1"))
+        third = self.get("transactions", first.headers["ETag"])
+
+        self.assertEqual(second.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(third.status_code, HTTPStatus.OK)
+        self.assertEqual(len(third.json["items"]), 2)
+
+    def test_unknown_account(self):
+        self.account_id = "unknown"
+
+        resp = self.get("balance", '"1-2021-06-13"')
+
+        self.assertEqual(resp.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_no_etag_while_the_change_settles(self):
+        Account.deposit_into(self.account_id, Decimal("1"))
+
+        with mock.patch.object(views, "etag_settle_seconds", 60):
+            resp = self.get("balance")
+
+        self.assertNotIn("ETag", resp.headers)
+
+    def test_response_etag_of_old_items(self):
+        updated_at = dt.datetime(2021, 6, 13, tzinfo=dt.timezone.utc)
+
+        self.assertEqual(views.response_etag({}), "0")
+        self.assertEqual(
+            views.response_etag(
+                {"version": Decimal(3), "updated_at": updated_at.isoformat()},
+                "2021-06-13",
+            ),
+            "3-2021-06-13",
+        )
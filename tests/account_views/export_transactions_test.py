@@ -0,0 +1,87 @@
+import decimal as d
+import json
+import unittest
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+
+
+@pytest.mark.usefixtures("client")
+class TestExportTransactionsScenarios(unittest.TestCase):
+    mock_models_path = "src.account.account.views.models"
+
+    request_path = "/v1/account/{}/transactions/export"
+
+    items = [
+        {
+            "id": str(i),
+            "account_id": "3333",
+            "value": d.Decimal("10.5") * i,
+            "created_at": f"2021-06-13T20:14:{i:02}",
+        }
+        for i in range(250)
+    ]
+
+    @mock.patch(mock_models_path)
+    def test_export_ndjson(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+        mock_models.Transaction.export.return_value = iter(self.items)
+
+        resp = self.client.get(
+            self.request_path.format("3333"),
+            query_string={"begin-date": "2021-06-13T00:00:00"},
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        rows = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual(len(rows), 250)
+        self.assertEqual(
+            rows[3],
+            {
+                "idTransacao": "3",
+                "idConta": "3333",
+                "valor": 31.5,
+                "dataTransacao": "2021-06-13T20:14:03",
+            },
+        )
+        _, kwargs = mock_models.Transaction.export.call_args
+        self.assertEqual(kwargs["begin_date"].isoformat(), "2021-06-13T00:00:00")
+
+    @mock.patch(mock_models_path)
+    def test_export_csv(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+        mock_models.Transaction.export.return_value = iter(self.items)
+
+        resp = self.client.get(
+            self.request_path.format("3333"), query_string={"format": "csv"}
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(resp.mimetype, "text/csv")
+        lines = resp.data.decode("utf-8").splitlines()
+        self.assertEqual(lines[0], "idTransacao,idConta,valor,dataTransacao")
+        self.assertEqual(lines[2], "1,3333,10.5,2021-06-13T20:14:01")
+        self.assertEqual(len(lines), 251)
+
+    @mock.patch(mock_models_path)
+    def test_export_empty_history(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+        mock_models.Transaction.export.return_value = iter([])
+
+        resp = self.client.get(self.request_path.format("3333"))
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(resp.data, b"")
+
+    @mock.patch(mock_models_path)
+    def test_export_unknown_format(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+
+        resp = self.client.get(
+            self.request_path.format("3333"), query_string={"format": "xml"}
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.BAD_REQUEST)
+        mock_models.Transaction.export.assert_not_called()
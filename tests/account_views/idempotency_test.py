@@ -0,0 +1,129 @@
+import unittest
+from decimal import Decimal
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+
+from src.account.account import views
+from src.account.account.models import Account, DuplicateRequest
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import registry
+
+
+@pytest.mark.usefixtures("client")
+@mock.patch.dict(
+    "src.account.core.aws.dynamodb.os.environ",
+    {"DYNAMODB_BACKEND": "memory", "FLASK_ENV": "development"},
+)
+class TestIdempotencyKey(unittest.TestCase):
+    def setUp(self):
+        registry.clear()
+        memory.shared_resource().reset()
+        Account.cache.clear()
+
+    def tearDown(self):
+        registry.clear()
+
+    def create_account(self):
+        return Account.add("p", Decimal("100"), Decimal("50"), True, 1)
+
+    def post(self, account_id, operation, key, value):
+        return self.client.post(
+            f"v1/account/{account_id}/{operation}",
+            json={"valor": value},
+            headers={"Idempotency-Key": key},
+        )
+
+    def balance(self, account_id):
+        account = Account.find_one_by_id(account_id, consistent_read=True)
+        return account["balance"]
+
+    def test_deposit_replayed(self):
+        account_id = self.create_account()
+
+        first = self.post(account_id, "deposit", "key-1", 10)
+        second = self.post(account_id, "deposit", "key-1", 10)
+
+        self.assertEqual(first.status_code, HTTPStatus.CREATED)
+        self.assertEqual(second.status_code, HTTPStatus.CREATED)
+        self.assertEqual(
+            second.headers["Content-Location"],
+            first.headers["Content-Location"],
+        )
+        self.assertEqual(second.headers["Idempotent-Replayed"], "true")
+        self.assertNotIn("Idempotent-Replayed", first.headers)
+        self.assertEqual(self.balance(account_id), Decimal("110"))
+
+    def test_withdraw_replayed_after_the_balance_changed(self):
+        account_id = self.create_account()
+
+        first = self.post(account_id, "withdraw", "key-1", 40)
+        Account.withdraw(account_id, Decimal("55"))
+        second = self.post(account_id, "withdraw", "key-1", 40)
+
+        self.assertEqual(second.status_code, HTTPStatus.CREATED)
+        self.assertEqual(
+            second.headers["Content-Location"],
+            first.headers["Content-Location"],
+        )
+        self.assertEqual(self.balance(account_id), Decimal("5"))
+
+    def test_keys_are_per_operation_and_account(self):
+        account_id = self.create_account()
+        other_id = self.create_account()
+
+        self.post(account_id, "deposit", "key-1", 10)
+        withdraw = self.post(account_id, "withdraw", "key-1", 10)
+        other = self.post(other_id, "deposit", "key-1", 10)
+
+        self.assertNotIn("Idempotent-Replayed", withdraw.headers)
+        self.assertNotIn("Idempotent-Replayed", other.headers)
+        self.assertEqual(self.balance(account_id), Decimal("100"))
+        self.assertEqual(self.balance(other_id), Decimal("110"))
+
+    def test_key_reused_with_another_body(self):
+        account_id = self.create_account()
+
+        self.post(account_id, "deposit", "key-1", 10)
+        resp = self.post(account_id, "deposit", "key-1", 20)
+
+        self.assertEqual(resp.status_code, HTTPStatus.UNPROCESSABLE_ENTITY)
+        self.assertEqual(self.balance(account_id), Decimal("110"))
+
+    def test_invalid_key(self):
+        account_id = self.create_account()
+
+        resp = self.post(account_id, "deposit", "k" * 256, 10)
+
+        self.assertEqual(resp.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(self.balance(account_id), Decimal("100"))
+
+    def test_concurrent_request_with_the_same_key(self):
+        """The first lookup missed the record, the transaction finds it"""
+        account_id = self.create_account()
+        first = self.post(account_id, "deposit", "key-1", 10)
+
+        with mock.patch.object(
+            views.models.Idempotency, "find", return_value=None
+        ):
+            second = self.post(account_id, "deposit", "key-1", 10)
+
+        self.assertEqual(second.status_code, HTTPStatus.CREATED)
+        self.assertEqual(
+            second.headers["Content-Location"],
+            first.headers["Content-Location"],
+        )
+        self.assertEqual(self.balance(account_id), Decimal("110"))
+
+    def test_model_raises_duplicate_request(self):
+        account_id = self.create_account()
+        self.post(account_id, "deposit", "key-1", 10)
+        record = views.models.Idempotency.new_item(
+            account_id, "deposit", "key-1", b""
+        )
+
+        with self.assertRaises(DuplicateRequest) as error:
+            Account.deposit_into(account_id, Decimal("10"), record)
+
+        self.assertEqual(error.exception.record["status"], HTTPStatus.CREATED)
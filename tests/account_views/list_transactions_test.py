@@ -0,0 +1,94 @@
+import unittest
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+
+from src.account.core.pagination import decode_cursor, encode_cursor
+
+
+@pytest.mark.usefixtures("client")
+class TestListTransactionsScenarios(unittest.TestCase):
+    mock_models_path = "src.account.account.views.models"
+
+    request_path = "/v1/account/{}/transactions"
+
+    @mock.patch(mock_models_path)
+    def test_page_with_next_cursor(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+        last_key = {"account_id": "3333", "id": "2", "created_at": "2021"}
+        mock_models.Transaction.find_by_account_id.return_value = {
+            "Items": [
+                {
+                    "id": "2",
+                    "account_id": "3333",
+                    "value": 10,
+                    "created_at": "2021",
+                }
+            ],
+            "LastEvaluatedKey": last_key,
+        }
+
+        resp = self.client.get(
+            self.request_path.format("3333"), query_string={"page-size": 1}
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            resp.json["items"],
+            [
+                {
+                    "idTransacao": "2",
+                    "idConta": "3333",
+                    "valor": 10,
+                    "dataTransacao": "2021",
+                }
+            ],
+        )
+        self.assertEqual(decode_cursor(resp.json["nextCursor"]), last_key)
+        mock_models.Transaction.find_by_account_id.assert_called_once_with(
+            "3333", ordered_ids=False, page_size=1
+        )
+
+    @mock.patch(mock_models_path)
+    def test_cursor_is_passed_decoded(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+        mock_models.Transaction.find_by_account_id.return_value = {"Items": []}
+        last_key = {"account_id": "3333", "id": "2", "created_at": "2021"}
+
+        resp = self.client.get(
+            self.request_path.format("3333"),
+            query_string={"next-page-cursor": encode_cursor(last_key)},
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(resp.json, {"items": []})
+        mock_models.Transaction.find_by_account_id.assert_called_once_with(
+            "3333", ordered_ids=False, next_cursor=last_key, page_size=25
+        )
+
+    @mock.patch(mock_models_path)
+    def test_invalid_cursor(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+
+        resp = self.client.get(
+            self.request_path.format("3333"),
+            query_string={"next-page-cursor": "eyJpZCI6IjEifQ.bad"},
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(
+            resp.json, {"error": {"next-page-cursor": ["Invalid cursor"]}}
+        )
+        mock_models.Transaction.find_by_account_id.assert_not_called()
+
+    @mock.patch(mock_models_path)
+    def test_page_size_limit(self, mock_models):
+        mock_models.Account.find_one_by_id.return_value = {"blocked": False}
+
+        resp = self.client.get(
+            self.request_path.format("3333"), query_string={"page-size": 101}
+        )
+
+        self.assertEqual(resp.status_code, HTTPStatus.BAD_REQUEST)
+        mock_models.Transaction.find_by_account_id.assert_not_called()
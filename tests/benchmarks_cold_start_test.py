@@ -0,0 +1,28 @@
+import unittest
+
+from benchmarks import cold_start
+
+
+class TestColdStartBenchmark(unittest.TestCase):
+    def test_summarize(self):
+        runs = [
+            {
+                "process": 0.5,
+                "cold_start": {"import": 0.3, "init": 0.1, "request": 0.01},
+                "invocations": [{"seconds": 0.002}, {"seconds": 0.004}],
+            },
+            {
+                "process": 0.7,
+                "cold_start": {"import": 0.4, "init": 0.1, "request": 0.02},
+                "invocations": [{"seconds": 0.001}],
+            },
+        ]
+
+        summary = cold_start.summarize(runs)
+
+        self.assertEqual(
+            sorted(summary), ["import", "init", "process", "request", "warm"]
+        )
+        self.assertEqual(summary["warm"]["count"], 3)
+        self.assertAlmostEqual(summary["import"]["p95_ms"], 400)
+        self.assertAlmostEqual(summary["warm"]["p50_ms"], 2)
@@ -0,0 +1,69 @@
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from benchmarks import endpoints
+
+
+class TestEndpointsBenchmark(unittest.TestCase):
+    def tearDown(self):
+        endpoints.registry.clear()
+
+    def test_percentile(self):
+        self.assertEqual(endpoints.percentile([5, 1, 3, 2, 4], 50), 3)
+        self.assertEqual(endpoints.percentile([5, 1, 3, 2, 4], 99), 5)
+        self.assertIsNone(endpoints.percentile([], 50))
+
+    def test_load_traffic_skips_other_lines(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as traffic:
+            traffic.write(
+                '{"method": "get", "path": "/v1/account/{account_id}/balance"}\n'
+                '{"request_id": "not a request"}\n'
+                "\n"
+            )
+            traffic.flush()
+
+            requests, skipped = endpoints.load_traffic(traffic.name)
+
+        self.assertEqual(
+            requests,
+            [endpoints.BenchRequest("GET", "/v1/account/{account_id}/balance")],
+        )
+        self.assertEqual(skipped, 1)
+
+    @mock.patch.dict(endpoints.os.environ, {"DYNAMODB_BACKEND": "memory"})
+    def test_run_reports_every_endpoint(self):
+        with tempfile.NamedTemporaryFile("r", suffix=".json") as output:
+            code = endpoints.main(
+                [
+                    "--requests=40",
+                    "--warmup=4",
+                    "--accounts=2",
+                    f"--output={output.name}",
+                ]
+            )
+            results = json.load(output)
+
+        self.assertEqual(code, 0)
+        self.assertEqual(results["total"]["count"], 40)
+        self.assertEqual(
+            set(results["endpoints"]),
+            {
+                "GET account.get_balance",
+                "GET account.list_transactions",
+                "POST account.deposito_em_conta",
+                "POST account.withdraw",
+            },
+        )
+        balance = results["endpoints"]["GET account.get_balance"]
+        self.assertEqual(balance["dynamo_calls_per_request"], 2)
+        self.assertEqual(balance["status"], {"200": balance["count"]})
+
+    def test_compare_flags_regressions(self):
+        baseline = {"endpoints": {"GET x": {"p95_ms": 1.0}}}
+        current = {"endpoints": {"GET x": {"p95_ms": 1.5}}}
+
+        _, regressed = endpoints.compare(current, baseline, 0.2)
+
+        self.assertTrue(regressed)
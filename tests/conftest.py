@@ -4,7 +4,9 @@ from src.account import wsgi
 
 
 @pytest.fixture
-def application():
+def application(monkeypatch):
+    monkeypatch.setenv("HEALTH_CHECK_INTERVAL", "0")
+    monkeypatch.setenv("FLASK_ENV", "development")
     application = wsgi.create_app()
     with application.app_context():
         yield application
@@ -1,14 +1,25 @@
+import threading
 import unittest
+from decimal import Decimal
 from unittest import mock
 
 from botocore.exceptions import ClientError
 
-from src.account.core.aws.dynamodb import DynamoResource
+from src.account.core.aws.dynamodb import (
+    DynamoResource,
+    UnprocessedKeysError,
+    registry,
+    retry_policy,
+)
+from src.account.core.aws.retry import DatabaseUnavailable
 
 
 class TestDynamodbResource(unittest.TestCase):
     mock_path = "src.account.core.aws.dynamodb"
 
+    def setUp(self):
+        registry.clear()
+
     @mock.patch.dict(
         f"{mock_path}.os.environ", {"LOCALSTACK": "1", "FLASK_ENV": "development"}
     )
@@ -25,7 +36,9 @@ class TestDynamodbResource(unittest.TestCase):
         )
 
         resource_mock.Table.assert_called_once_with(table_name)
-        table_mock.put_item.assert_called_once_with(Item={**save_data})
+        table_mock.put_item.assert_called_once_with(
+            Item={**save_data}, ReturnConsumedCapacity="TOTAL"
+        )
 
     @mock.patch(f"{mock_path}.logging")
     @mock.patch.dict(
@@ -38,7 +51,7 @@ class TestDynamodbResource(unittest.TestCase):
         table_mock.put_item.side_effect = ClientError(
             {
                 "Error": {
-                    "Code": "InternalServerError",
+                    "Code": "ValidationException",
                     "Message": "Everything fails dramatically! And you get sad!",
                 }
             },
@@ -53,7 +66,9 @@ class TestDynamodbResource(unittest.TestCase):
             )
 
         logging_mock.error.assert_called_once()
-        table_mock.put_item.assert_called_once_with(Item={**save_data})
+        table_mock.put_item.assert_called_once_with(
+            Item={**save_data}, ReturnConsumedCapacity="TOTAL"
+        )
 
     @mock.patch(f"{mock_path}.logging")
     @mock.patch.dict(
@@ -68,7 +83,7 @@ class TestDynamodbResource(unittest.TestCase):
         table_mock.put_item.side_effect = ClientError(
             {
                 "Error": {
-                    "Code": "InternalServerError",
+                    "Code": "ValidationException",
                     "Message": "Everything fails dramatically! And you get sad!",
                 }
             },
@@ -83,4 +98,238 @@ class TestDynamodbResource(unittest.TestCase):
             )
 
         logging_mock.error.assert_called_once()
-        table_mock.put_item.assert_called_once_with(Item={**save_data})
+        table_mock.put_item.assert_called_once_with(
+            Item={**save_data}, ReturnConsumedCapacity="TOTAL"
+        )
+
+    @mock.patch("src.account.core.aws.retry.time.sleep")
+    @mock.patch(f"{mock_path}.logging")
+    @mock.patch.dict(
+        f"{mock_path}.os.environ", {"LOCALSTACK": "", "FLASK_ENV": "development"}
+    )
+    @mock.patch(f"{mock_path}.boto3")
+    def test_save_retries_and_reports_unavailable(self, boto3_mock, *_):
+        retry_policy.breaker.reset()
+        table_mock = boto3_mock.resource.return_value.Table.return_value
+        table_mock.put_item.side_effect = ClientError(
+            {"Error": {"Code": "InternalServerError", "Message": "sad"}}, "PutItem"
+        )
+
+        with self.assertRaises(DatabaseUnavailable):
+            DynamoResource().add("test-table", {"id": "test"})
+
+        self.assertEqual(table_mock.put_item.call_count, retry_policy.max_attempts)
+
+    @mock.patch.dict(f"{mock_path}.os.environ", {"LOCALSTACK": ""})
+    @mock.patch(f"{mock_path}.boto3")
+    def test_transact_write_items_serializes_values(self, boto3_mock):
+        client_mock = boto3_mock.resource.return_value.meta.client
+
+        DynamoResource().transact_write_items(
+            [
+                {
+                    "Update": {
+                        "TableName": "account",
+                        "Key": {"id": "1"},
+                        "UpdateExpression": "SET #b = #b + :v",
+                        "ExpressionAttributeNames": {"#b": "balance"},
+                        "ExpressionAttributeValues": {":v": Decimal("1.5")},
+                    }
+                },
+                {"Put": {"TableName": "transaction", "Item": {"id": "2"}}},
+            ]
+        )
+
+        client_mock.transact_write_items.assert_called_once_with(
+            TransactItems=[
+                {
+                    "Update": {
+                        "TableName": "account",
+                        "Key": {"id": {"S": "1"}},
+                        "UpdateExpression": "SET #b = #b + :v",
+                        "ExpressionAttributeNames": {"#b": "balance"},
+                        "ExpressionAttributeValues": {":v": {"N": "1.5"}},
+                    }
+                },
+                {"Put": {"TableName": "transaction", "Item": {"id": {"S": "2"}}}},
+            ],
+            ReturnConsumedCapacity="TOTAL",
+            ClientRequestToken=mock.ANY,
+        )
+
+    @mock.patch.dict(f"{mock_path}.os.environ", {"LOCALSTACK": ""})
+    @mock.patch(f"{mock_path}.boto3")
+    def test_get_item(self, boto3_mock):
+        table_mock = boto3_mock.resource.return_value.Table.return_value
+        table_mock.get_item.return_value = {"Item": {"id": "1", "value": 3}}
+
+        item = DynamoResource().get_item(
+            "transaction", {"id": "1"}, projection=["id", "value"]
+        )
+
+        self.assertEqual(item, {"id": "1", "value": 3})
+        table_mock.get_item.assert_called_once_with(
+            Key={"id": "1"},
+            ConsistentRead=False,
+            ProjectionExpression="#p0, #p1",
+            ExpressionAttributeNames={"#p0": "id", "#p1": "value"},
+            ReturnConsumedCapacity="TOTAL",
+        )
+
+    @mock.patch.dict(f"{mock_path}.os.environ", {"LOCALSTACK": ""})
+    @mock.patch(f"{mock_path}.boto3")
+    def test_get_item_not_found(self, boto3_mock):
+        table_mock = boto3_mock.resource.return_value.Table.return_value
+        table_mock.get_item.return_value = {}
+
+        item = DynamoResource().get_item(
+            "account", {"id": "1"}, consistent_read=True
+        )
+
+        self.assertIsNone(item)
+        table_mock.get_item.assert_called_once_with(
+            Key={"id": "1"}, ConsistentRead=True, ReturnConsumedCapacity="TOTAL"
+        )
+
+    @mock.patch(f"{mock_path}.time")
+    @mock.patch.dict(f"{mock_path}.os.environ", {"LOCALSTACK": ""})
+    @mock.patch(f"{mock_path}.boto3")
+    def test_batch_get_item_chunks_and_retries(self, boto3_mock, time_mock):
+        resource_mock = boto3_mock.resource.return_value
+        keys = [{"id": str(i)} for i in range(150)]
+        resource_mock.batch_get_item.side_effect = (
+            {
+                "Responses": {"account": keys[:90]},
+                "UnprocessedKeys": {"account": {"Keys": keys[90:100]}},
+            },
+            {"Responses": {"account": keys[90:100]}, "UnprocessedKeys": {}},
+            {"Responses": {"account": keys[100:]}},
+        )
+
+        items = DynamoResource().batch_get_item("account", keys)
+
+        self.assertEqual(items, keys)
+        calls = resource_mock.batch_get_item.call_args_list
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(
+            [len(c.kwargs["RequestItems"]["account"]["Keys"]) for c in calls],
+            [100, 10, 50],
+        )
+        time_mock.sleep.assert_called_once()
+
+    @mock.patch(f"{mock_path}.logging")
+    @mock.patch(f"{mock_path}.time")
+    @mock.patch.dict(f"{mock_path}.os.environ", {"LOCALSTACK": ""})
+    @mock.patch(f"{mock_path}.boto3")
+    def test_batch_get_item_gives_up(self, boto3_mock, time_mock, _):
+        resource_mock = boto3_mock.resource.return_value
+        resource_mock.batch_get_item.return_value = {
+            "Responses": {},
+            "UnprocessedKeys": {"account": {"Keys": [{"id": "1"}]}},
+        }
+
+        with self.assertRaises(UnprocessedKeysError):
+            DynamoResource().batch_get_item("account", [{"id": "1"}])
+
+        self.assertEqual(
+            resource_mock.batch_get_item.call_count,
+            DynamoResource.batch_max_attempts,
+        )
+
+    @mock.patch(f"{mock_path}.time")
+    @mock.patch.dict(f"{mock_path}.os.environ", {"LOCALSTACK": ""})
+    @mock.patch(f"{mock_path}.boto3")
+    def test_batch_write_chunks_and_retries(self, boto3_mock, time_mock):
+        resource_mock = boto3_mock.resource.return_value
+        items = [{"id": str(i)} for i in range(30)]
+        unprocessed = [{"PutRequest": {"Item": items[0]}}]
+        resource_mock.batch_write_item.side_effect = (
+            {"UnprocessedItems": {"transaction": unprocessed}},
+            {"UnprocessedItems": {}},
+            {},
+        )
+
+        DynamoResource().batch_write("transaction", items)
+
+        calls = resource_mock.batch_write_item.call_args_list
+        self.assertEqual(
+            [len(c.kwargs["RequestItems"]["transaction"]) for c in calls],
+            [25, 1, 5],
+        )
+        self.assertEqual(calls[1].kwargs["RequestItems"]["transaction"], unprocessed)
+        time_mock.sleep.assert_called_once()
+
+
+class TestDynamoRegistry(unittest.TestCase):
+    mock_path = "src.account.core.aws.dynamodb"
+
+    def setUp(self):
+        registry.clear()
+
+    @mock.patch.dict(f"{mock_path}.os.environ", {"LOCALSTACK": ""})
+    @mock.patch(f"{mock_path}.boto3")
+    def test_resource_and_tables_are_reused(self, boto3_mock):
+        resource_mock = boto3_mock.resource.return_value
+
+        first = DynamoResource()
+        second = DynamoResource()
+        first.table_resource("account")
+        second.table_resource("account")
+        second.table_resource("transaction")
+
+        boto3_mock.resource.assert_called_once()
+        self.assertEqual(resource_mock.Table.call_count, 2)
+
+    @mock.patch.dict(
+        f"{mock_path}.os.environ",
+        {
+            "LOCALSTACK": "",
+            "DYNAMODB_MAX_POOL_CONNECTIONS": "42",
+            "DYNAMODB_CONNECT_TIMEOUT": "0.5",
+            "DYNAMODB_READ_TIMEOUT": "2",
+        },
+    )
+    @mock.patch(f"{mock_path}.boto3")
+    def test_resource_uses_pool_configuration(self, boto3_mock):
+        DynamoResource()
+
+        config = boto3_mock.resource.call_args.kwargs["config"]
+        self.assertEqual(config.max_pool_connections, 42)
+        self.assertEqual(config.connect_timeout, 0.5)
+        self.assertEqual(config.read_timeout, 2)
+        self.assertTrue(config.tcp_keepalive)
+
+    @mock.patch.dict(f"{mock_path}.os.environ", {"LOCALSTACK": ""})
+    @mock.patch(f"{mock_path}.boto3")
+    def test_threads_share_the_resource(self, boto3_mock):
+        boto3_mock.resource.side_effect = lambda *_, **__: mock.Mock()
+        registry.warm("account")
+
+        # a thread per request, as the development server
+        resources, tables = [], []
+
+        def request():
+            dynamodb_resource = DynamoResource()
+            resources.append(dynamodb_resource.resource)
+            tables.append(dynamodb_resource.table_resource("account"))
+            tables.append(dynamodb_resource.table_resource("account"))
+
+        for _ in range(8):
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+
+        boto3_mock.resource.assert_called_once()
+        self.assertTrue(all(r is registry.resource() for r in resources))
+        # each thread builds its own table handles, once
+        self.assertEqual(registry.resource().Table.call_count, 9)
+        self.assertEqual(len({id(table) for table in tables}), 8)
+
+    @mock.patch.dict(f"{mock_path}.os.environ", {"LOCALSTACK": ""})
+    @mock.patch(f"{mock_path}.boto3")
+    def test_clear_recreates_resources(self, boto3_mock):
+        DynamoResource()
+        registry.clear()
+        DynamoResource()
+
+        self.assertEqual(boto3_mock.resource.call_count, 2)
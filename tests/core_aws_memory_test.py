@@ -0,0 +1,249 @@
+import datetime as dt
+import unittest
+from decimal import Decimal
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from werkzeug.exceptions import HTTPException
+
+from src.account.account.models import Account, DailyWithdraw, Transaction
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import DynamoResource, registry
+
+
+class TestMemoryResource(unittest.TestCase):
+    def setUp(self):
+        self.resource = memory.MemoryResource()
+        self.table = self.resource.Table("transaction")
+
+    def put_transactions(self):
+        for index, created_at in enumerate(["2021-06-12", "2021-06-10", "2021-06-11"]):
+            self.table.put_item(
+                Item={
+                    "account_id": "1",
+                    "id": f"t{index}",
+                    "created_at": created_at,
+                    "value": index,
+                }
+            )
+        self.table.put_item(
+            Item={"account_id": "2", "id": "x", "created_at": "2021-06-11"}
+        )
+
+    def test_tables_from_template(self):
+        self.assertEqual(
+            set(self.resource.tables),
+            {
+                "account",
+                "transaction",
+                "person",
+                "daily_withdraw",
+                "idempotency",
+                "ledger_rollup",
+                "balance_shard",
+            },
+        )
+        self.assertEqual(
+            set(self.table.indexes), {"withdraw_index", "transaction_date_index"}
+        )
+
+    def test_put_and_get_normalizes_numbers(self):
+        self.put_transactions()
+
+        item = self.table.get_item(Key={"account_id": "1", "id": "t2"})["Item"]
+
+        self.assertEqual(item["value"], Decimal("2"))
+        self.assertIsInstance(item["value"], Decimal)
+        self.assertEqual(self.table.get_item(Key={"account_id": "1", "id": "?"}), {})
+
+    def test_query_index_sorted_by_range(self):
+        self.put_transactions()
+
+        result = self.table.query(
+            IndexName="transaction_date_index",
+            KeyConditionExpression=Key("account_id").eq("1")
+            & Key("created_at").between("2021-06-10", "2021-06-11"),
+        )
+
+        self.assertEqual([i["id"] for i in result["Items"]], ["t1", "t2"])
+        self.assertNotIn("LastEvaluatedKey", result)
+
+    def test_query_pages_with_limit(self):
+        self.put_transactions()
+        query = {
+            "IndexName": "transaction_date_index",
+            "KeyConditionExpression": Key("account_id").eq("1"),
+            "Limit": 2,
+        }
+
+        first = self.table.query(**query)
+        second = self.table.query(**query, ExclusiveStartKey=first["LastEvaluatedKey"])
+
+        self.assertEqual([i["id"] for i in first["Items"]], ["t1", "t2"])
+        self.assertEqual(
+            first["LastEvaluatedKey"],
+            {"account_id": "1", "id": "t2", "created_at": "2021-06-11"},
+        )
+        self.assertEqual([i["id"] for i in second["Items"]], ["t0"])
+
+    def test_sparse_index(self):
+        self.put_transactions()
+        self.table.put_item(
+            Item={"account_id": "1", "id": "w", "withdraw_date": "2021-06-11"}
+        )
+
+        result = self.table.query(
+            IndexName="withdraw_index",
+            KeyConditionExpression=Key("account_id").eq("1"),
+        )
+
+        self.assertEqual([i["id"] for i in result["Items"]], ["w"])
+
+    def test_conditional_update(self):
+        table = self.resource.Table("account")
+        table.put_item(Item={"id": "1", "balance": 10, "blocked": False})
+        update = {
+            "Key": {"id": "1"},
+            "UpdateExpression": "SET #balance = #balance - :value",
+            "ConditionExpression": "#blocked = :blocked And #balance > :value",
+            "ExpressionAttributeNames": {"#balance": "balance", "#blocked": "blocked"},
+            "ExpressionAttributeValues": {":value": 4, ":blocked": False},
+            "ReturnValues": "ALL_NEW",
+        }
+
+        self.assertEqual(table.update_item(**update)["Attributes"]["balance"], 6)
+        self.assertEqual(table.update_item(**update)["Attributes"]["balance"], 2)
+        with self.assertRaises(ClientError) as error:
+            table.update_item(**update)
+
+        self.assertEqual(
+            error.exception.response["Error"]["Code"],
+            "ConditionalCheckFailedException",
+        )
+
+    def test_add_creates_the_item(self):
+        table = self.resource.Table("daily_withdraw")
+        update = {
+            "Key": {"account_id": "1", "withdraw_date": "2021-06-13"},
+            "UpdateExpression": "ADD #total :value SET #expires = :expires",
+            "ConditionExpression": (
+                "attribute_not_exists(#total) Or #total <= :available"
+            ),
+            "ExpressionAttributeNames": {"#total": "total", "#expires": "expires_at"},
+            "ExpressionAttributeValues": {
+                ":value": Decimal("7"),
+                ":expires": 10,
+                ":available": Decimal("3"),
+            },
+        }
+
+        table.update_item(**update)
+        with self.assertRaises(ClientError):
+            table.update_item(**update)
+
+        item = table.get_item(
+            Key={"account_id": "1", "withdraw_date": "2021-06-13"}
+        )["Item"]
+        self.assertEqual(item, {
+            "account_id": "1",
+            "withdraw_date": "2021-06-13",
+            "total": Decimal("7"),
+            "expires_at": Decimal("10"),
+        })
+
+    def test_transaction_is_all_or_nothing(self):
+        client = self.resource.meta.client
+        self.resource.Table("account").put_item(Item={"id": "1", "balance": 1})
+
+        with self.assertRaises(ClientError) as error:
+            client.transact_write_items(
+                TransactItems=[
+                    {
+                        "Put": {
+                            "TableName": "transaction",
+                            "Item": {"account_id": {"S": "1"}, "id": {"S": "t"}},
+                        }
+                    },
+                    {
+                        "Update": {
+                            "TableName": "account",
+                            "Key": {"id": {"S": "1"}},
+                            "UpdateExpression": "SET balance = balance - :v",
+                            "ConditionExpression": "balance > :v",
+                            "ExpressionAttributeValues": {":v": {"N": "5"}},
+                        }
+                    },
+                ]
+            )
+
+        self.assertEqual(
+            [r["Code"] for r in error.exception.response["CancellationReasons"]],
+            ["None", "ConditionalCheckFailed"],
+        )
+        self.assertEqual(self.table.get_item(Key={"account_id": "1", "id": "t"}), {})
+
+    def test_consumed_capacity(self):
+        result = self.table.put_item(
+            Item={"account_id": "1", "id": "t"}, ReturnConsumedCapacity="TOTAL"
+        )
+        read = self.table.get_item(
+            Key={"account_id": "1", "id": "t"}, ReturnConsumedCapacity="TOTAL"
+        )
+
+        self.assertEqual(
+            result["ConsumedCapacity"],
+            {"TableName": "transaction", "CapacityUnits": 1.0},
+        )
+        self.assertEqual(read["ConsumedCapacity"]["CapacityUnits"], 0.5)
+
+    def test_unknown_table(self):
+        with self.assertRaises(ClientError) as error:
+            self.resource.Table("nope")
+
+        self.assertEqual(
+            error.exception.response["Error"]["Code"], "ResourceNotFoundException"
+        )
+
+
+@pytest.mark.usefixtures("application")
+@mock.patch.dict(
+    "src.account.core.aws.dynamodb.os.environ",
+    {"DYNAMODB_BACKEND": "memory", "FLASK_ENV": "development"},
+)
+class TestModelsWithMemoryBackend(unittest.TestCase):
+    def setUp(self):
+        registry.clear()
+        memory.shared_resource().reset()
+        Account.cache.clear()
+
+    def tearDown(self):
+        registry.clear()
+
+    def test_registry_selects_memory(self):
+        self.assertIs(DynamoResource().resource, memory.shared_resource())
+
+    def test_account_flow(self):
+        account_id = Account.add("p", Decimal("100"), Decimal("50"), True, 1)
+
+        Account.deposit_into(account_id, Decimal("10"))
+        Account.withdraw(account_id, Decimal("30"), Decimal("50"))
+        with self.assertRaises(HTTPException) as error:
+            Account.withdraw(account_id, Decimal("30"), Decimal("50"))
+
+        self.assertEqual(
+            error.exception.response.status_code, HTTPStatus.FORBIDDEN
+        )
+        account = Account.find_one_by_id(account_id, consistent_read=True)
+        self.assertEqual(account["balance"], Decimal("80"))
+        self.assertEqual(DailyWithdraw.find_total(account_id), Decimal("30"))
+        today = dt.datetime.now(dt.timezone.utc)
+        page = Transaction.find_by_account_id(
+            account_id, today - dt.timedelta(days=1), today + dt.timedelta(days=1)
+        )
+        self.assertEqual(
+            sorted(i["value"] for i in page["Items"]),
+            [Decimal("-30"), Decimal("10")],
+        )
@@ -0,0 +1,209 @@
+import unittest
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+from botocore.exceptions import (
+    ClientError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+from src.account.core.aws import retry
+
+
+def client_error(code, reasons=None):
+    response = {"Error": {"Code": code, "Message": ""}}
+    if reasons:
+        response["CancellationReasons"] = [{"Code": r} for r in reasons]
+    return ClientError(response, "operation")
+
+
+@mock.patch("src.account.core.aws.retry.time.sleep")
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = retry.RetryPolicy(max_attempts=4)
+
+    def test_retries_until_success(self, sleep_mock):
+        call = mock.Mock(side_effect=[client_error("InternalServerError"), "ok"])
+
+        self.assertEqual(self.policy.run(["account"], call), "ok")
+        self.assertEqual(call.call_count, 2)
+        delay = sleep_mock.call_args.args[0]
+        self.assertTrue(0 <= delay <= self.policy.backoff_base)
+
+    def test_does_not_retry_other_errors(self, sleep_mock):
+        call = mock.Mock(side_effect=client_error("ValidationException"))
+
+        with self.assertRaises(ClientError):
+            self.policy.run(["account"], call)
+
+        call.assert_called_once()
+        sleep_mock.assert_not_called()
+
+    def test_gives_up_after_max_attempts(self, _):
+        call = mock.Mock(side_effect=client_error("ThrottlingException"))
+
+        with self.assertRaises(ClientError):
+            self.policy.run(["account"], call)
+
+        self.assertEqual(call.call_count, 4)
+
+    def test_transaction_reasons(self, _):
+        self.assertTrue(
+            retry.is_retryable(
+                client_error(
+                    "TransactionCanceledException", ["None", "TransactionConflict"]
+                )
+            )
+        )
+        self.assertFalse(
+            retry.is_retryable(
+                client_error(
+                    "TransactionCanceledException",
+                    ["ConditionalCheckFailed", "TransactionConflict"],
+                )
+            )
+        )
+
+    def test_request_budget(self, _):
+        call = mock.Mock(side_effect=client_error("ThrottlingException"))
+        token = retry.start_request(2)
+        try:
+            with self.assertRaises(ClientError):
+                self.policy.run(["account"], call)
+            with self.assertRaises(ClientError):
+                self.policy.run(["account"], call)
+        finally:
+            retry.end_request(token)
+
+        self.assertEqual(call.call_count, 4)
+
+    def test_quota_stops_retries(self, _):
+        self.policy.quota = retry.RetryQuota(capacity=10, retry_cost=5)
+        call = mock.Mock(side_effect=client_error("ThrottlingException"))
+
+        with self.assertRaises(ClientError):
+            self.policy.run(["account"], call)
+
+        self.assertEqual(call.call_count, 3)
+        self.assertEqual(self.policy.quota.tokens, 0)
+        self.policy.run(["account"], mock.Mock())
+        self.assertEqual(self.policy.quota.tokens, 1)
+
+
+@mock.patch("src.account.core.aws.retry.time")
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_and_half_opens(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        breaker = retry.CircuitBreaker(threshold=2, cooldown=5)
+
+        breaker.record(["account"], True)
+        breaker.check(["account"])
+        breaker.record(["account"], True)
+
+        with self.assertRaises(retry.CircuitOpenError) as error:
+            breaker.check(["account", "transaction"])
+        self.assertEqual(error.exception.retry_after, 5)
+        breaker.check(["transaction"])
+
+        time_mock.monotonic.return_value = 106
+        breaker.check(["account"])
+        with self.assertRaises(retry.CircuitOpenError):
+            breaker.check(["account"])
+
+        breaker.record(["account"], False)
+        breaker.check(["account"])
+        self.assertEqual(breaker.open_tables(), [])
+
+    def test_policy_fails_fast(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        policy = retry.RetryPolicy(
+            max_attempts=1, breaker=retry.CircuitBreaker(threshold=1)
+        )
+        call = mock.Mock(side_effect=client_error("ThrottlingException"))
+
+        with self.assertRaises(ClientError):
+            policy.run(["account"], call)
+        with self.assertRaises(retry.CircuitOpenError):
+            policy.run(["account"], call)
+
+        call.assert_called_once()
+
+    def test_retries_timeouts(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        policy = retry.RetryPolicy(max_attempts=3)
+        on_retry = mock.Mock()
+        timeout = ReadTimeoutError(endpoint_url="http://dynamodb")
+        call = mock.Mock(side_effect=[timeout, "ok"])
+
+        self.assertEqual(policy.run(["account"], call, on_retry), "ok")
+
+        self.assertEqual(call.call_count, 2)
+        on_retry.assert_called_once_with(timeout)
+        self.assertEqual(retry.error_code(timeout), "ReadTimeoutError")
+        time_mock.sleep.assert_called_once()
+
+    def test_timeouts_use_the_request_budget(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        policy = retry.RetryPolicy(max_attempts=5)
+        call = mock.Mock(
+            side_effect=ReadTimeoutError(endpoint_url="http://dynamodb")
+        )
+
+        token = retry.start_request(1)
+        try:
+            with self.assertRaises(ReadTimeoutError):
+                policy.run(["account"], call)
+        finally:
+            retry.end_request(token)
+
+        self.assertEqual(call.call_count, 2)
+
+    def test_failed_trial_closes_again(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        policy = retry.RetryPolicy(
+            max_attempts=1,
+            breaker=retry.CircuitBreaker(threshold=1, cooldown=0),
+        )
+        call = mock.Mock(
+            side_effect=[
+                client_error("ThrottlingException"),
+                EndpointConnectionError(endpoint_url="http://dynamodb"),
+                "ok",
+            ]
+        )
+
+        with self.assertRaises(ClientError):
+            policy.run(["account"], call)
+        with self.assertRaises(EndpointConnectionError):
+            policy.run(["account"], call)
+        self.assertEqual(policy.breaker.open_tables(), ["account"])
+
+        self.assertEqual(policy.run(["account"], call), "ok")
+        self.assertEqual(policy.breaker.open_tables(), [])
+
+    def test_trial_cleared_on_any_error(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        breaker = retry.CircuitBreaker(threshold=1, cooldown=0)
+        policy = retry.RetryPolicy(max_attempts=1, breaker=breaker)
+        breaker.record(["account"], True)
+
+        with self.assertRaises(ValueError):
+            policy.run(["account"], mock.Mock(side_effect=ValueError()))
+
+        breaker.check(["account"])
+
+
+@pytest.mark.usefixtures("client")
+class TestUnavailableResponse(unittest.TestCase):
+    @mock.patch("src.account.account.views.models")
+    def test_circuit_open_is_503(self, mock_models):
+        mock_models.Account.find_one_by_id.side_effect = retry.CircuitOpenError(
+            "account", 2.5
+        )
+
+        resp = self.client.get("/v1/account/1/balance")
+
+        self.assertEqual(resp.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(resp.headers["Retry-After"], "3")
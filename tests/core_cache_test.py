@@ -0,0 +1,63 @@
+import unittest
+from unittest import mock
+
+from src.account.core.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    mock_path = "src.account.core.cache"
+
+    def test_get_counts_hits_and_misses(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("1", {"blocked": False}, cache.token())
+
+        self.assertEqual(cache.get("1"), {"blocked": False})
+        self.assertIsNone(cache.get("2"))
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+    def test_get_returns_a_copy(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("1", {"blocked": False}, cache.token())
+
+        cache.get("1")["blocked"] = True
+
+        self.assertEqual(cache.get("1"), {"blocked": False})
+
+    @mock.patch(f"{mock_path}.time")
+    def test_entries_expire(self, time_mock):
+        time_mock.monotonic.return_value = 100
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("1", {"blocked": False}, cache.token())
+
+        time_mock.monotonic.return_value = 111
+
+        self.assertIsNone(cache.get("1"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        for key in ("1", "2"):
+            cache.set(key, key, cache.token())
+        cache.get("1")
+        cache.set("3", "3", cache.token())
+
+        self.assertEqual(cache.get("1"), "1")
+        self.assertIsNone(cache.get("2"))
+        self.assertEqual(cache.get("3"), "3")
+
+    def test_read_started_before_invalidation_is_discarded(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        token = cache.token()
+        cache.invalidate("1")
+        cache.set("1", "stale", token)
+
+        self.assertIsNone(cache.get("1"))
+
+        cache.set("1", "fresh", cache.token())
+        self.assertEqual(cache.get("1"), "fresh")
+
+    def test_zero_ttl_disables_the_cache(self):
+        cache = TTLCache(maxsize=2, ttl=0)
+        cache.set("1", "1", cache.token())
+
+        self.assertIsNone(cache.get("1"))
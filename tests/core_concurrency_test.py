@@ -0,0 +1,52 @@
+import contextvars
+import threading
+import time
+import unittest
+
+from src.account.core import concurrency
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+class TestGather(unittest.TestCase):
+    def test_results_in_order_and_concurrent(self):
+        barrier = threading.Barrier(3, timeout=2)
+
+        def read(value):
+            barrier.wait()
+            return value
+
+        results = concurrency.gather(
+            lambda: read(1), lambda: read(2), lambda: read(3)
+        )
+
+        self.assertEqual(results, [1, 2, 3])
+
+    def test_context_is_copied(self):
+        request_id.set("abc")
+
+        results = concurrency.gather(request_id.get, request_id.get)
+
+        self.assertEqual(results, ["abc", "abc"])
+
+    def test_error_is_raised(self):
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            concurrency.gather(fail, lambda: 1)
+
+    def test_deadline(self):
+        started = time.monotonic()
+
+        with self.assertRaises(concurrency.DeadlineExceeded):
+            concurrency.gather(lambda: time.sleep(1), lambda: None, timeout=0.05)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_nested_gather_runs_in_order(self):
+        def nested():
+            self.assertTrue(concurrency.in_worker())
+            return concurrency.gather(lambda: 1, lambda: 2)
+
+        self.assertEqual(concurrency.gather(nested, lambda: 3), [[1, 2], 3])
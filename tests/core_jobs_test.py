@@ -0,0 +1,47 @@
+import threading
+import unittest
+from dataclasses import dataclass
+
+from src.account.core import jobs
+
+
+@dataclass
+class CountReport(jobs.JobReport):
+    done: int = 0
+
+    job = "Count"
+
+
+class TestJobs(unittest.TestCase):
+    def test_results_and_errors_reach_the_report(self):
+        report = CountReport()
+        threads = set()
+
+        def work(task: int):
+            threads.add(threading.current_thread().name)
+            if task % 10 == 0:
+                raise ValueError(task)
+            return task
+
+        def done(_, result: int):
+            report.done += result
+
+        def failed(task: int, error: Exception):
+            report.add_error({"task": task, "erro": repr(error)})
+
+        jobs.run_in_workers(work, iter(range(100)), 4, failed, done)
+
+        self.assertEqual(report.done, sum(range(100)) - sum(range(0, 100, 10)))
+        self.assertEqual(
+            sorted(error["task"] for error in report.errors),
+            list(range(0, 100, 10)),
+        )
+        self.assertLessEqual(len(threads), 4)
+
+    def test_reported_errors_are_limited(self):
+        report = CountReport()
+
+        for i in range(jobs.max_reported_errors + 5):
+            report.add_error({"task": i})
+
+        self.assertEqual(len(report.errors), jobs.max_reported_errors)
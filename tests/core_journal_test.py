@@ -0,0 +1,249 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent import futures
+from unittest import mock
+
+from src.account.core.journal import Journal
+
+
+class Destination:
+    """Flush target that can be made to fail"""
+
+    def __init__(self):
+        self.batches = []
+        self.failing = False
+        self.lock = threading.Lock()
+
+    def __call__(self, records):
+        if self.failing:
+            raise ConnectionError("down")
+        with self.lock:
+            self.batches.append(list(records))
+
+    @property
+    def records(self):
+        return [record for batch in self.batches for record in batch]
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.destination = Destination()
+
+    def journal(self, destination=None, **kwargs):
+        kwargs.setdefault("flush_interval", 0.01)
+        return Journal(
+            self.directory, destination or self.destination, **kwargs
+        ).open()
+
+    def crash(self, journal):
+        """Stops the journal without flushing, releasing its file lock"""
+        journal._stop.set()
+        journal._wake.set()
+        journal._thread.join(5)
+        journal._file.close()
+
+    def test_flushes_in_batches(self):
+        journal = self.journal(flush_interval=60)
+        self.addCleanup(journal.close)
+
+        for i in range(60):
+            journal.append({"id": i})
+
+        self.assertTrue(journal.wait_flushed(5))
+        self.assertEqual(
+            self.destination.records, [{"id": i} for i in range(60)]
+        )
+        self.assertTrue(all(len(b) <= 25 for b in self.destination.batches))
+
+    def test_appends_share_the_fsync(self):
+        journal = self.journal(flush_interval=60)
+        self.addCleanup(journal.close)
+        fsync = threading.Event()
+        calls = []
+
+        def slow_fsync(fd):
+            calls.append(fd)
+            fsync.wait(5)
+
+        with mock.patch("src.account.core.journal.os.fsync", slow_fsync):
+            with futures.ThreadPoolExecutor(max_workers=8) as pool:
+                appends = [pool.submit(journal.append, {"id": 0})]
+                while not calls:
+                    time.sleep(0.001)
+                appends += [
+                    pool.submit(journal.append, {"id": i})
+                    for i in range(1, 8)
+                ]
+                # the others are waiting for the running fsync
+                self.assertFalse(any(a.done() for a in appends))
+                fsync.set()
+                sequences = [a.result(5) for a in appends]
+
+        self.assertEqual(sorted(sequences), list(range(1, 9)))
+        # the first fsync and one for everything written while it ran
+        self.assertEqual(len(calls), 2)
+
+    def test_failed_flushes_are_retried(self):
+        self.destination.failing = True
+        journal = self.journal()
+        self.addCleanup(journal.close)
+
+        journal.append({"id": 1})
+        self.assertFalse(journal.wait_flushed(0.05))
+        self.destination.failing = False
+
+        self.assertTrue(journal.wait_flushed(5))
+        self.assertEqual(self.destination.records, [{"id": 1}])
+
+    def test_poison_record_goes_to_the_dead_letter(self):
+        def destination(records):
+            if {"id": 2} in records:
+                raise ValueError("invalid record")
+            self.destination(records)
+
+        journal = self.journal(destination, flush_interval=60, max_attempts=3)
+        self.addCleanup(journal.close)
+
+        for i in range(5):
+            journal.append({"id": i})
+
+        self.assertTrue(journal.wait_flushed(5))
+        self.assertEqual(
+            sorted(r["id"] for r in self.destination.records), [0, 1, 3, 4]
+        )
+        with open(journal.dead_letter_path) as dead_letter:
+            self.assertEqual(dead_letter.read(), '{"r":{"id":2}}\n')
+
+        journal.append({"id": 5})
+        self.assertTrue(journal.wait_flushed(5))
+        self.assertEqual(self.destination.records[-1], {"id": 5})
+
+    def test_dead_letters_are_handed_over(self):
+        def destination(records):
+            if {"id": 1} in records:
+                raise ValueError("invalid record")
+            self.destination(records)
+
+        on_dead_letter = mock.Mock(side_effect=[RuntimeError("down")])
+        journal = self.journal(
+            destination,
+            flush_interval=60,
+            max_attempts=1,
+            on_dead_letter=on_dead_letter,
+        )
+        self.addCleanup(journal.close)
+
+        journal.append({"id": 0})
+        journal.append({"id": 1})
+
+        self.assertTrue(journal.wait_flushed(5))
+        on_dead_letter.assert_called_once_with([{"id": 1}])
+        # a failure of the handler doesn't stop the journal
+        journal.append({"id": 2})
+        self.assertTrue(journal.wait_flushed(5))
+        self.assertEqual(self.destination.records[-1], {"id": 2})
+
+    def test_destination_down_keeps_the_records(self):
+        self.destination.failing = True
+        journal = self.journal(max_attempts=2)
+        self.addCleanup(journal.close)
+
+        journal.append({"id": 1})
+        journal.append({"id": 2})
+        self.assertFalse(journal.wait_flushed(0.1))
+        self.destination.failing = False
+
+        self.assertTrue(journal.wait_flushed(5))
+        self.assertEqual(self.destination.records, [{"id": 1}, {"id": 2}])
+        self.assertFalse(os.path.exists(journal.dead_letter_path))
+
+    def test_poison_record_of_a_recovered_file(self):
+        crashed = self.journal()
+        self.destination.failing = True
+        for i in range(3):
+            crashed.append({"id": i})
+        self.crash(crashed)
+
+        def destination(records):
+            if {"id": 0} in records:
+                raise ValueError("invalid record")
+            self.destination(records)
+
+        self.destination.failing = False
+        journal = self.journal(destination, max_attempts=2)
+        self.addCleanup(journal.close)
+
+        self.assertTrue(journal.wait_flushed(5))
+        self.assertEqual(self.destination.records, [{"id": 1}, {"id": 2}])
+        self.assertTrue(os.path.exists(journal.dead_letter_path))
+
+    def test_recovers_the_records_not_flushed(self):
+        crashed = self.journal()
+        crashed.append({"id": 1})
+        crashed.append({"id": 2})
+        self.assertTrue(crashed.wait_flushed(5))
+        self.destination.failing = True
+        crashed.append({"id": 3})
+        self.crash(crashed)
+
+        recovered = Destination()
+        journal = self.journal(recovered)
+        self.addCleanup(journal.close)
+
+        self.assertTrue(journal.wait_flushed(5))
+        self.assertEqual(recovered.records, [{"id": 3}])
+        self.assertEqual(
+            os.listdir(self.directory), [os.path.basename(journal.path)]
+        )
+
+    def test_live_journals_are_not_recovered(self):
+        live = self.journal()
+        self.addCleanup(live.close)
+        self.destination.failing = True
+        live.append({"id": 1})
+
+        other = self.journal(Destination())
+        self.addCleanup(other.close)
+
+        self.assertEqual(other.pending(), 0)
+        self.assertEqual(live.pending(), 1)
+        self.destination.failing = False
+
+    def test_cut_line_ends_the_file(self):
+        journal = self.journal()
+        self.destination.failing = True
+        journal.append({"id": 1})
+        self.crash(journal)
+        with open(journal.path, "ab") as journal_file:
+            journal_file.write(b'{"s":2,"r":{"id"')
+
+        self.assertEqual(Journal.read(journal.path), [{"id": 1}])
+
+    def test_close(self):
+        journal = self.journal(flush_interval=60)
+        journal.append({"id": 1})
+
+        journal.close()
+
+        self.assertEqual(self.destination.records, [{"id": 1}])
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_file_starts_again_when_everything_was_flushed(self):
+        journal = self.journal(max_bytes=100)
+        self.addCleanup(journal.close)
+
+        for i in range(10):
+            journal.append({"id": i})
+        self.assertTrue(journal.wait_flushed(5))
+
+        self.assertEqual(os.path.getsize(journal.path), 0)
+        self.destination.failing = True
+        journal.append({"id": 10})
+        self.assertEqual(Journal.read(journal.path), [{"id": 10}])
+        self.destination.failing = False
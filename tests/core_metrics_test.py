@@ -0,0 +1,133 @@
+import threading
+import unittest
+
+import pytest
+from botocore.exceptions import ClientError
+
+from src.account.core import metrics
+from src.account.core.aws.dynamodb import instrumented_call
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_counter_sums_every_thread(self):
+        counter = self.registry.counter("calls_total", "Calls", ("table",))
+
+        def work():
+            for _ in range(1000):
+                counter.inc("account")
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIn('calls_total{table="account"} 4000', self.registry.render())
+
+    def test_shards_of_ended_threads_are_folded(self):
+        counter = self.registry.counter("calls_total", "Calls", ("table",))
+        histogram = self.registry.histogram("latency_seconds", "Latency")
+
+        def request():
+            counter.inc("account")
+            histogram.observe(0.01)
+
+        # a thread per request
+        for _ in range(200):
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+
+        self.assertLessEqual(len(self.registry._shards), 2)
+        rendered = self.registry.render()
+        self.assertIn('calls_total{table="account"} 200', rendered)
+        self.assertIn("latency_seconds_count 200", rendered)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram(
+            "latency_seconds", "Latency", ("endpoint",), buckets=(0.1, 1)
+        )
+
+        histogram.observe(0.05, "a")
+        histogram.observe(0.5, "a")
+        histogram.observe(5, "a")
+
+        self.assertEqual(
+            self.registry.render().splitlines(),
+            [
+                "# HELP latency_seconds Latency",
+                "# TYPE latency_seconds histogram",
+                'latency_seconds_bucket{endpoint="a",le="0.1"} 1',
+                'latency_seconds_bucket{endpoint="a",le="1"} 2',
+                'latency_seconds_bucket{endpoint="a",le="+Inf"} 3',
+                'latency_seconds_sum{endpoint="a"} 5.55',
+                'latency_seconds_count{endpoint="a"} 3',
+            ],
+        )
+
+    def test_gauge_callback(self):
+        self.registry.gauge_callback(
+            "cache", "Cache", lambda: [(("hits",), 3)], labelnames=("stat",)
+        )
+
+        self.assertIn('cache{stat="hits"} 3', self.registry.render())
+
+
+class TestInstrumentedCall(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+
+    def test_records_capacity_and_duration(self):
+        def call(**kwargs):
+            self.assertEqual(kwargs["ReturnConsumedCapacity"], "TOTAL")
+            return {"ConsumedCapacity": {"TableName": "t", "CapacityUnits": 0.5}}
+
+        instrumented_call("query", "t", call, index_name="i", Limit=1)
+        instrumented_call("query", "t", call, index_name="i", Limit=1)
+
+        rendered = metrics.registry.render()
+        self.assertIn(
+            'dynamodb_consumed_capacity_units_total{table="t",kind="read"} 1.0',
+            rendered,
+        )
+        self.assertIn(
+            'dynamodb_call_duration_seconds_count{operation="query",table="t",'
+            'index="i"} 2',
+            rendered,
+        )
+
+    def test_records_errors(self):
+        def call(**_):
+            raise ClientError(
+                {"Error": {"Code": "ValidationException", "Message": ""}}, "Put"
+            )
+
+        with self.assertRaises(ClientError):
+            instrumented_call("put_item", "t", call)
+
+        self.assertIn(
+            'dynamodb_errors_total{operation="put_item",table="t",'
+            'code="ValidationException"} 1',
+            metrics.registry.render(),
+        )
+
+
+@pytest.mark.usefixtures("client")
+class TestMetricsView(unittest.TestCase):
+    def test_exposes_request_latency(self):
+        self.client.get("/v1/metrics")
+
+        resp = self.client.get("/v1/metrics")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain; version=0.0.4"))
+        body = resp.get_data(as_text=True)
+        self.assertIn(
+            'http_request_duration_seconds_count{method="GET",'
+            'endpoint="metrics.get_metrics",status="200"}',
+            body,
+        )
+        self.assertIn('account_cache{stat="size"}', body)
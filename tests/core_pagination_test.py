@@ -0,0 +1,65 @@
+import os
+import unittest
+from unittest import mock
+
+from src.account import wsgi
+from src.account.core.pagination import (
+    InvalidCursor,
+    check_secret,
+    decode_cursor,
+    encode_cursor,
+)
+
+
+class TestPaginationCursor(unittest.TestCase):
+    mock_path = "src.account.core.pagination"
+
+    @mock.patch.dict(f"{mock_path}.os.environ", {"CURSOR_SECRET": "s3cr3t"})
+    def test_cursor_round_trip(self):
+        key = {"account_id": "1", "id": "2", "created_at": "2021-06-13"}
+
+        cursor = encode_cursor(key)
+
+        self.assertNotIn("account_id", cursor)
+        self.assertEqual(decode_cursor(cursor), key)
+
+    @mock.patch.dict(f"{mock_path}.os.environ", {"CURSOR_SECRET": "s3cr3t"})
+    def test_tampered_cursor_is_rejected(self):
+        _, signature = encode_cursor({"account_id": "1"}).split(".")
+        forged, _ = encode_cursor({"account_id": "2"}).split(".")
+
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(f"{forged}.{signature}")
+
+    def test_cursor_signed_with_other_secret_is_rejected(self):
+        with mock.patch.dict(
+            f"{self.mock_path}.os.environ", {"CURSOR_SECRET": "one"}
+        ):
+            cursor = encode_cursor({"account_id": "1"})
+        with mock.patch.dict(
+            f"{self.mock_path}.os.environ", {"CURSOR_SECRET": "other"}
+        ):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    def test_secret_required_outside_development(self):
+        environ = f"{self.mock_path}.os.environ"
+        with mock.patch.dict(environ, {"FLASK_ENV": "production"}):
+            os.environ.pop("CURSOR_SECRET", None)
+            with self.assertRaises(RuntimeError):
+                check_secret()
+            # the application doesn't start
+            with self.assertRaises(RuntimeError):
+                wsgi.create_app(load_env=False)
+        with mock.patch.dict(
+            environ, {"FLASK_ENV": "production", "CURSOR_SECRET": "s3cr3t"}
+        ):
+            check_secret()
+        with mock.patch.dict(environ, {"FLASK_ENV": "development"}):
+            os.environ.pop("CURSOR_SECRET", None)
+            check_secret()
+
+    def test_garbage_cursor_is_rejected(self):
+        for cursor in ("", "abc", "a.b.c", "!!!.???"):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
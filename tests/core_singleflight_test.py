@@ -0,0 +1,181 @@
+import threading
+import time
+import unittest
+from concurrent import futures
+from decimal import Decimal
+from unittest import mock
+
+from src.account.account.models import Account
+from src.account.core import metrics
+from src.account.core.singleflight import SingleFlight
+
+
+def wait_coalesced(name, count, timeout=5):
+    """The callers are waiting for the call once they were counted"""
+    deadline = time.monotonic() + timeout
+    while metrics.registry._collect("singleflight_calls_total").get(
+        (name, "coalesced"), 0
+    ) < count:
+        if time.monotonic() > deadline:
+            raise AssertionError("the calls were not coalesced")
+        time.sleep(0.001)
+
+
+class BlockedCall:
+    """Call that only returns after `release`, counting the executions"""
+
+    def __init__(self, result=None, error=None):
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.released.wait(5)
+        if self.error:
+            raise self.error
+        return self.result
+
+    def release(self):
+        self.released.set()
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.flight = SingleFlight("test")
+        self.pool = futures.ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.pool.shutdown(wait=True)
+
+    def start(self, key, call, count):
+        leader = self.pool.submit(self.flight.do, key, call)
+        call.started.wait(5)
+        followers = [
+            self.pool.submit(self.flight.do, key, call)
+            for _ in range(count - 1)
+        ]
+        wait_coalesced("test", count - 1)
+        return [leader] + followers
+
+    def test_concurrent_calls_share_the_result(self):
+        call = BlockedCall(result={"balance": 1})
+
+        calls = self.start("1", call, 3)
+        call.release()
+        results = [c.result(5) for c in calls]
+
+        self.assertEqual(call.calls, 1)
+        self.assertEqual(results, [{"balance": 1}] * 3)
+        # every caller has its own copy
+        self.assertEqual(len({id(r) for r in results}), 3)
+        self.assertEqual(self.flight.in_flight(), 0)
+        rendered = metrics.registry.render()
+        self.assertIn(
+            'singleflight_calls_total{name="test",result="executed"} 1',
+            rendered,
+        )
+        self.assertIn(
+            'singleflight_calls_total{name="test",result="coalesced"} 2',
+            rendered,
+        )
+
+    def test_error_is_shared(self):
+        call = BlockedCall(error=ValueError("boom"))
+
+        calls = self.start("1", call, 2)
+        call.release()
+
+        for c in calls:
+            with self.assertRaises(ValueError):
+                c.result(5)
+        self.assertEqual(call.calls, 1)
+
+    def test_other_keys_are_not_coalesced(self):
+        first = BlockedCall(result=1)
+        second = BlockedCall(result=2)
+
+        calls = [
+            self.pool.submit(self.flight.do, "1", first),
+            self.pool.submit(self.flight.do, "2", second),
+        ]
+        first.release()
+        second.release()
+
+        self.assertEqual([c.result(5) for c in calls], [1, 2])
+        self.assertEqual((first.calls, second.calls), (1, 1))
+
+    def test_calls_after_forget_start_a_new_call(self):
+        old = BlockedCall(result="old")
+        new = BlockedCall(result="new")
+        new.release()
+
+        running = self.start("1", old, 1)[0]
+        self.flight.forget("1")
+        after_write = self.flight.do("1", new)
+        old.release()
+
+        self.assertEqual(after_write, "new")
+        self.assertEqual(running.result(5), "old")
+        self.assertEqual((old.calls, new.calls), (1, 1))
+
+    def test_sequential_calls_are_not_cached(self):
+        self.assertEqual(self.flight.do("1", lambda: 1), 1)
+        self.assertEqual(self.flight.do("1", lambda: 2), 2)
+
+
+class TestAccountReadsCoalesced(unittest.TestCase):
+    mock_resource_path = "src.account.account.models.DynamoResource"
+
+    def setUp(self):
+        metrics.registry.clear()
+        Account.cache.clear()
+
+    @mock.patch(mock_resource_path)
+    def test_reads_share_the_get_item(self, mock_resource):
+        call = BlockedCall(result={"id": "1", "balance": Decimal("10")})
+        mock_resource.return_value.get_item.side_effect = (
+            lambda *args, **kwargs: call()
+        )
+
+        with futures.ThreadPoolExecutor(max_workers=3) as pool:
+            reads = [pool.submit(Account.find_one_by_id, "1")]
+            call.started.wait(5)
+            reads += [pool.submit(Account.find_one_by_id, "1") for _ in "ab"]
+            wait_coalesced("account", 2)
+            call.release()
+            results = [r.result(5) for r in reads]
+
+        self.assertEqual(call.calls, 1)
+        self.assertTrue(all(r["balance"] == Decimal("10") for r in results))
+
+    @mock.patch(mock_resource_path)
+    def test_consistent_reads_are_not_shared(self, mock_resource):
+        """A read in flight may miss a write another process just made"""
+        call = BlockedCall(result={"id": "1", "balance": Decimal("10")})
+        call.release()
+        mock_resource.return_value.get_item.side_effect = (
+            lambda *args, **kwargs: call()
+        )
+
+        for _ in range(3):
+            Account.find_one_by_id("1", consistent_read=True)
+
+        self.assertEqual(call.calls, 3)
+        self.assertEqual(
+            metrics.registry._collect("singleflight_calls_total").get(
+                ("account", "executed"), 0
+            ),
+            0,
+        )
+
+    @mock.patch(mock_resource_path)
+    def test_write_forgets_the_reads_in_flight(self, mock_resource):
+        with mock.patch.object(Account.reads, "forget") as mock_forget:
+            Account.deposit_into("1", Decimal("1"))
+
+        mock_forget.assert_called_once_with("1")
@@ -0,0 +1,61 @@
+import datetime as dt
+import unittest
+
+from src.account.core import ulid
+
+utc = dt.timezone.utc
+
+
+class TestUlid(unittest.TestCase):
+    moment = dt.datetime(2021, 6, 13, 20, 14, 29, 123456, tzinfo=utc)
+
+    def test_format(self):
+        value = ulid.new(self.moment)
+
+        self.assertEqual(len(value), 26)
+        self.assertTrue(ulid.is_ulid(value))
+        self.assertFalse(ulid.is_ulid("f81d4fae-7dec-11d0-a765-00a0c91e6bf6"))
+        self.assertEqual(ulid.encode(0, 0), "0" * 26)
+
+    def test_sorted_by_time(self):
+        later = self.moment + dt.timedelta(milliseconds=1)
+        ids = [ulid.new(later), ulid.new(self.moment)]
+
+        self.assertEqual(sorted(ids), ids[::-1])
+
+    def test_same_millisecond_is_monotonic(self):
+        ids = [ulid.new(self.moment) for _ in range(100)]
+
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(len(set(ids)), 100)
+        self.assertEqual({i[: ulid.time_length] for i in ids}, {ids[0][:10]})
+
+    def test_microseconds_order_the_millisecond(self):
+        later = self.moment + dt.timedelta(microseconds=100)
+
+        self.assertLess(
+            ulid.derived(self.moment, "b"), ulid.derived(later, "a")
+        )
+
+    def test_bounds(self):
+        value = ulid.new(self.moment)
+        before = self.moment - dt.timedelta(microseconds=500)
+        after = self.moment + dt.timedelta(milliseconds=1)
+
+        self.assertLessEqual(ulid.lower_bound(self.moment), value)
+        self.assertLessEqual(value, ulid.upper_bound(self.moment))
+        self.assertLess(ulid.upper_bound(before), value)
+        self.assertLess(value, ulid.lower_bound(after))
+
+    def test_derived(self):
+        first = ulid.derived(self.moment, "f81d4fae-7dec-11d0")
+
+        self.assertEqual(ulid.derived(self.moment, "f81d4fae-7dec-11d0"), first)
+        self.assertNotEqual(ulid.derived(self.moment, "other"), first)
+        self.assertEqual(first[:10], ulid.lower_bound(self.moment)[:10])
+
+    def test_naive_datetime_is_utc(self):
+        self.assertEqual(
+            ulid.millisecond(self.moment.replace(tzinfo=None)),
+            ulid.millisecond(self.moment),
+        )
@@ -0,0 +1,172 @@
+import base64
+import json
+import os
+import subprocess
+import sys
+import unittest
+from http import HTTPStatus
+from unittest import mock
+
+from src.account import handler
+from src.account.core.aws import memory
+from src.account.core.aws.dynamodb import registry
+from src.account.health_check.prober import prober
+
+# modules the function must not load before its first invocation
+heavy_modules = ["boto3", "botocore", "flask", "marshmallow", "dotenv"]
+import_budget_seconds = 0.1
+cold_start_budget_seconds = 5
+
+
+def run_python(code: str, **env):
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        check=True,
+        env={**os.environ, **env},
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+class TestImportTime(unittest.TestCase):
+    def test_import_budget(self):
+        result = run_python(
+            "import json, sys, time\n"
+            "started_at = time.perf_counter()\n"
+            "import src.account.handler\n"
+            "seconds = time.perf_counter() - started_at\n"
+            f"heavy = [m for m in {heavy_modules!r} if m in sys.modules]\n"
+            "print(json.dumps({'seconds': seconds, 'heavy': heavy}))"
+        )
+
+        self.assertEqual(result["heavy"], [])
+        self.assertLess(result["seconds"], import_budget_seconds)
+
+    def test_cold_start_budget(self):
+        result = run_python(
+            "import json, sys\n"
+            "from src.account import handler\n"
+            "handler.application()\n"
+            "print(json.dumps({\n"
+            "    'phases': dict(handler.cold_start()),\n"
+            "    'memory': 'src.account.core.aws.memory' in sys.modules,\n"
+            "}))",
+            DYNAMODB_BACKEND="aws",
+            CURSOR_SECRET="test",
+            AWS_DEFAULT_REGION="us-east-1",
+            AWS_ACCESS_KEY_ID="test",
+            AWS_SECRET_ACCESS_KEY="test",
+        )
+
+        self.assertEqual(sorted(result["phases"]), ["import", "init"])
+        self.assertLess(
+            sum(result["phases"].values()), cold_start_budget_seconds
+        )
+        # the in memory database is only imported when used
+        self.assertFalse(result["memory"])
+
+
+class TestHandler(unittest.TestCase):
+    def setUp(self):
+        environ = mock.patch.dict(
+            os.environ,
+            {
+                "DYNAMODB_BACKEND": "memory",
+                "FLASK_ENV": "development",
+            },
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        lazy = mock.patch.object(prober, "lazy", False)
+        lazy.start()
+        self.addCleanup(lazy.stop)
+        app = mock.patch.object(handler, "_app", None)
+        app.start()
+        self.addCleanup(app.stop)
+        cold_start = mock.patch.dict(handler._cold_start, clear=True)
+        cold_start.start()
+        self.addCleanup(cold_start.stop)
+        registry.clear()
+        self.addCleanup(registry.clear)
+        memory.shared_resource().reset()
+
+    def create_account(self):
+        response = handler.handler(
+            handler.make_event(
+                "POST",
+                "/v1/account",
+                body={
+                    "saldo": 100,
+                    "flagAtivo": True,
+                    "limiteSaqueDiario": 50,
+                    "tipoConta": 1,
+                    "idPessoa": "p",
+                },
+            )
+        )
+        self.assertEqual(response["statusCode"], HTTPStatus.CREATED)
+        return response["headers"]["Content-Location"]
+
+    def test_health_check_probes_lazily(self):
+        response = handler.handler(
+            handler.make_event("GET", "/v1/health-check")
+        )
+
+        self.assertEqual(response["statusCode"], HTTPStatus.OK)
+        self.assertEqual(json.loads(response["body"])["status"], "UP")
+        self.assertTrue(prober.lazy)
+        self.assertFalse(prober._thread and prober._thread.is_alive())
+
+    def test_http_api_event(self):
+        path = self.create_account()
+
+        deposit = handler.handler(
+            handler.make_event("POST", f"{path}/deposit", body={"valor": 10})
+        )
+        balance = handler.handler(handler.make_event("GET", f"{path}/balance"))
+
+        self.assertEqual(deposit["statusCode"], HTTPStatus.CREATED)
+        self.assertEqual(balance["statusCode"], HTTPStatus.OK)
+        self.assertFalse(balance["isBase64Encoded"])
+        self.assertEqual(json.loads(balance["body"])["saldo"], 110)
+        self.assertEqual(
+            [phase for phase, _ in handler.cold_start()],
+            ["import", "init", "request"],
+        )
+
+    def test_rest_api_event(self):
+        path = self.create_account()
+        deposit = {
+            "httpMethod": "POST",
+            "path": f"{path}/deposit",
+            "multiValueHeaders": {"Content-Type": ["application/json"]},
+            "body": base64.b64encode(b'{"valor": 5}').decode(),
+            "isBase64Encoded": True,
+            "requestContext": {"identity": {"sourceIp": "127.0.0.1"}},
+        }
+        transactions = {
+            "httpMethod": "GET",
+            "path": f"{path}/transactions",
+            "headers": {"Host": "localhost"},
+            "multiValueQueryStringParameters": {"page-size": ["1"]},
+        }
+
+        created = handler.handler(deposit)
+        page = handler.handler(transactions)
+
+        self.assertEqual(created["statusCode"], HTTPStatus.CREATED)
+        self.assertIn(
+            path.rsplit("/", 1)[1],
+            created["multiValueHeaders"]["Content-Location"][0],
+        )
+        self.assertEqual(page["statusCode"], HTTPStatus.OK)
+        self.assertEqual(len(json.loads(page["body"])["items"]), 1)
+
+    def test_cold_start_metric(self):
+        response = handler.handler(handler.make_event("GET", "/v1/metrics"))
+
+        self.assertIn(
+            'cold_start_seconds{phase="import"}',
+            response["body"],
+        )
@@ -0,0 +1,122 @@
+import unittest
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from src.account.health_check import prober as prober_module
+from src.account.health_check.prober import HealthProber
+
+
+class TestHealthProber(unittest.TestCase):
+    mock_registry_path = "src.account.health_check.prober.registry"
+
+    @mock.patch(mock_registry_path)
+    def test_probe_up(self, registry_mock):
+        client_mock = registry_mock.resource.return_value.meta.client
+        client_mock.describe_table.return_value = {
+            "Table": {"TableStatus": "ACTIVE"}
+        }
+        prober = HealthProber(("account", "person"))
+
+        prober.probe()
+        result = prober.result()
+
+        self.assertEqual(result.status, "UP")
+        self.assertEqual(set(result.checks.tables), {"account", "person"})
+        self.assertIsNone(result.checks.tables["account"].last_error)
+        client_mock.describe_table.assert_any_call(TableName="person")
+
+    @mock.patch(mock_registry_path)
+    def test_probe_down_keeps_the_last_error(self, registry_mock):
+        client_mock = registry_mock.resource.return_value.meta.client
+        client_mock.describe_table.side_effect = ClientError(
+            {"Error": {"Code": "ResourceNotFoundException", "Message": "gone"}},
+            "DescribeTable",
+        )
+        prober = HealthProber(("account",))
+
+        prober.probe()
+        self.assertEqual(prober.result().status, "DOWN")
+
+        client_mock.describe_table.side_effect = None
+        client_mock.describe_table.return_value = {
+            "Table": {"TableStatus": "ACTIVE"}
+        }
+        prober.probe()
+        check = prober.result().checks.tables["account"]
+
+        self.assertEqual(check.status, "UP")
+        self.assertIn("gone", check.last_error)
+
+    @mock.patch(mock_registry_path)
+    @mock.patch("src.account.health_check.prober.time")
+    def test_stale_result_is_down(self, time_mock, registry_mock):
+        client_mock = registry_mock.resource.return_value.meta.client
+        client_mock.describe_table.return_value = {
+            "Table": {"TableStatus": "ACTIVE"}
+        }
+        time_mock.perf_counter.return_value = 0
+        time_mock.monotonic.return_value = 100
+        prober = HealthProber(("account",), interval=10)
+        prober.probe()
+
+        time_mock.monotonic.return_value = 131
+
+        self.assertEqual(prober.result().status, "DOWN")
+
+    @mock.patch(mock_registry_path)
+    @mock.patch("src.account.health_check.prober.time")
+    def test_lazy_probes_old_results(self, time_mock, registry_mock):
+        client_mock = registry_mock.resource.return_value.meta.client
+        client_mock.describe_table.return_value = {
+            "Table": {"TableStatus": "ACTIVE"}
+        }
+        time_mock.perf_counter.return_value = 0
+        time_mock.monotonic.return_value = 100
+        prober = HealthProber(("account",), interval=10)
+        prober.lazy = True
+
+        self.assertEqual(prober.result().status, "UP")
+        time_mock.monotonic.return_value = 105
+        prober.result()
+        self.assertEqual(client_mock.describe_table.call_count, 1)
+
+        time_mock.monotonic.return_value = 111
+        self.assertEqual(prober.result().status, "UP")
+        self.assertEqual(client_mock.describe_table.call_count, 2)
+
+    def test_not_probed_yet_is_down(self):
+        self.assertEqual(HealthProber(("account",)).result().status, "DOWN")
+
+
+@pytest.mark.usefixtures("client")
+class TestHealthCheckView(unittest.TestCase):
+    @mock.patch.object(prober_module.prober, "result")
+    def test_reads_the_cached_result(self, result_mock):
+        result_mock.return_value = HealthProber(("account",)).result()
+
+        resp = self.client.get("/v1/health-check")
+
+        self.assertEqual(resp.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(resp.json["checks"]["database"], "DOWN")
+
+    @mock.patch(TestHealthProber.mock_registry_path)
+    def test_up(self, registry_mock):
+        client_mock = registry_mock.resource.return_value.meta.client
+        client_mock.describe_table.return_value = {
+            "Table": {"TableStatus": "ACTIVE"}
+        }
+        prober_module.prober.probe()
+        client_mock.describe_table.reset_mock()
+
+        resp = self.client.get("/v1/health-check")
+
+        self.assertEqual(resp.status_code, HTTPStatus.OK)
+        self.assertEqual(resp.json["status"], "UP")
+        self.assertIsInstance(resp.json["uptime"], int)
+        self.assertEqual(
+            set(resp.json["checks"]["tables"]), {"account", "transaction", "person"}
+        )
+        client_mock.describe_table.assert_not_called()